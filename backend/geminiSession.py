@@ -1,76 +1,446 @@
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 import socketio
 import uvicorn
 from google import genai
-import base64
 import asyncio
+import time
 from dotenv import load_dotenv
 import os
-from utils.debugUtils import play_gemini_pcm
-import websockets
+from utils.debugUtils import play_gemini_pcm, PlaybackEngine
+from utils.loopMonitor import LoopLagMonitor
+from utils.structuredLog import get_logger, setup_logging, shutdown_logging, log_stats
+from services.mockLive import MockLiveClient
+from services.payload import decode_media_async, max_buffer_size, PayloadError, MAX_BYTES, OFFLOAD_BYTES
+from services.audioFraming import PcmFramer
+from services.vad import VoiceActivityDetector
+from services.frameGate import FrameGate
+from services.imageNormalizer import FrameNormalizer, get_pool, shutdown_pool
+from services.mediaQueue import MediaQueue, pump, DROP_OLDEST
+from services.livePool import LiveConnectionPool
+from services.resilientUpstream import ResilientUpstream, UpstreamClosed
+from services.admission import AdmissionController, AdmissionRejected, TokenBucket
+from services.sessionManager import SessionManager
+from services import serverMetrics as metrics
+from services.cluster import LocalPubSubManager, pin_sids, run_cluster, worker_socket_path, broker_socket_path
+from services.resampler import Resampler, negotiate_rate
+from services.frameRateController import FrameRateController
+from services.recorder import SessionRecorder, recorder_stats, AUDIO_IN, IMAGE_IN, RESPONSE, RESPONSE_END
+from services.audio import AudioEncoder, WavStreamWriter, SUPPORTED_CODECS, CODEC_PCM, SUPPORTED_CONTAINERS, CONTAINER_WAV
 
+load_dotenv()
+
+# マルチプロセス構成のワーカーとして起動された場合（WORKERS=N で親プロセスが設定する）
+WORKER_ID = os.getenv("WORKER_ID")
+CLUSTER_DIR = os.getenv("CLUSTER_DIR")
+
+if WORKER_ID is not None:
+    # 他のワーカーが持つ sid への emit は親プロセスのブローカー経由で届ける
+    client_manager = LocalPubSubManager(broker_socket_path(CLUSTER_DIR), int(WORKER_ID))
+else:
+    client_manager = None
+
+# 受信ペイロードのメディアごとの上限（デコード前に弾く）と、スレッドでデコードする大きさ
+PAYLOAD_LIMITS = {
+    "audio/pcm": int(os.getenv("MAX_AUDIO_PAYLOAD_BYTES", str(MAX_BYTES["audio/pcm"]))),
+    "image/jpeg": int(os.getenv("MAX_IMAGE_PAYLOAD_BYTES", str(MAX_BYTES["image/jpeg"]))),
+}
+PAYLOAD_OFFLOAD_BYTES = int(os.getenv("PAYLOAD_OFFLOAD_BYTES", str(OFFLOAD_BYTES)))
 
-sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*", max_http_buffer_size=100* 1024 * 1024)
+# Socket.IO パケット自体の解析はイベントループ上で行われるので、バッファの上限も最大のメディアに合わせて抑える
+sio = socketio.AsyncServer(async_mode="asgi", client_manager=client_manager, cors_allowed_origins="*", max_http_buffer_size=max_buffer_size(PAYLOAD_LIMITS))
+if WORKER_ID is not None:
+    # sid の先頭にワーカー番号を入れ、ルーターが同じワーカーへつなげるようにする
+    pin_sids(sio, int(WORKER_ID))
 app = FastAPI()
 socket_app = socketio.ASGIApp(sio, app)
 
-load_dotenv()
+# ログはキュー経由で別スレッドが書き出す（LOG_LEVEL / LOG_DISABLE / LOG_SAMPLE で調整）
+setup_logging()
+session_log = get_logger("session")
+media_log = get_logger("media")
+gemini_log = get_logger("gemini")
 
-# Gemini API 初期化
-client = genai.Client(api_key=os.getenv("API_KEY"), http_options={'api_version': 'v1beta'})
+# Gemini API 初期化（GEMINI_MOCK_URL が設定されていればローカルのモックサーバーに接続する）
+if mock_url := os.getenv("GEMINI_MOCK_URL"):
+    client = MockLiveClient(mock_url)
+else:
+    client = genai.Client(api_key=os.getenv("API_KEY"), http_options={'api_version': 'v1beta'})
 model_id = "gemini-2.0-flash-live-001"
 config = {"response_modalities": ["AUDIO"]}
+# Geminiへ送る / Geminiから返ってくる音声のサンプルレート（端末のレートとの違いは Resampler で吸収する）
+SEND_SAMPLE_RATE = 16000
+RECEIVE_SAMPLE_RATE = 24000
+# Geminiへ送る音声フレームの長さ（ms）
+AUDIO_FRAME_MS = int(os.getenv("AUDIO_FRAME_MS", "100"))
+# サーバー側VADで無音を間引くかどうか
+VAD_ENABLED = os.getenv("VAD_ENABLED", "0") == "1"
+VAD_HANGOVER_MS = int(os.getenv("VAD_HANGOVER_MS", "800"))
+VAD_SILENCE_KEEP_EVERY = int(os.getenv("VAD_SILENCE_KEEP_EVERY", "0"))
+# 画像フレームの間引き（ほぼ同じ画面は送らない / 最小送信間隔）
+FRAME_HASH_THRESHOLD = int(os.getenv("FRAME_HASH_THRESHOLD", "5"))
+# ADAPTIVE_VIDEO のときは固定の間隔ではなく、クライアントに伝えた間隔 × FRAME_INTERVAL_SLACK を使う
+# （端末のタイマーの揺れで、指示どおりのフレームまで捨てないよう少し緩める）
+FRAME_MIN_INTERVAL_MS = int(os.getenv("FRAME_MIN_INTERVAL_MS", "1000"))
+FRAME_INTERVAL_SLACK = float(os.getenv("FRAME_INTERVAL_SLACK", "0.8"))
+# 画像の正規化（長辺の上限・JPEG品質・プロセスプールのワーカー数）
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "70"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "0")) or None
+# セッションごとのキューの上限と満杯時のポリシー（drop_oldest / drop_newest / block）
+AUDIO_IN_QUEUE_SIZE = int(os.getenv("AUDIO_IN_QUEUE_SIZE", "50"))
+AUDIO_IN_QUEUE_POLICY = os.getenv("AUDIO_IN_QUEUE_POLICY", "block")
+VIDEO_IN_QUEUE_SIZE = int(os.getenv("VIDEO_IN_QUEUE_SIZE", "2"))
+VIDEO_IN_QUEUE_POLICY = os.getenv("VIDEO_IN_QUEUE_POLICY", "drop_oldest")
+AUDIO_OUT_QUEUE_SIZE = int(os.getenv("AUDIO_OUT_QUEUE_SIZE", "200"))
+AUDIO_OUT_QUEUE_POLICY = os.getenv("AUDIO_OUT_QUEUE_POLICY", "block")
+PLAYBACK_QUEUE_SIZE = int(os.getenv("PLAYBACK_QUEUE_SIZE", "200"))
+# デバッグ再生の出力先（null は音を出さずに同じ間隔で再生して統計だけ取る。デバイスを開けなければ自動で null）
+PLAYBACK_DEVICE = os.getenv("PLAYBACK_DEVICE", "auto")
+# 再生を始める（途切れた後に再開する）までに溜める量の範囲
+PLAYBACK_MIN_JITTER_MS = int(os.getenv("PLAYBACK_MIN_JITTER_MS", "60"))
+PLAYBACK_MAX_JITTER_MS = int(os.getenv("PLAYBACK_MAX_JITTER_MS", "500"))
+# 事前に開いておくGemini接続の数と、使われずに閉じるまでの秒数
+LIVE_POOL_SIZE = int(os.getenv("LIVE_POOL_SIZE", "2"))
+LIVE_POOL_MAX_IDLE_S = float(os.getenv("LIVE_POOL_MAX_IDLE_S", "480"))
+# gemini_response をまとめて送るときのバイト上限と最大待ち時間（ms）
+EMIT_BATCH_BYTES = int(os.getenv("EMIT_BATCH_BYTES", "9600"))
+EMIT_BATCH_DELAY_MS = int(os.getenv("EMIT_BATCH_DELAY_MS", "60"))
+# 音声・画像が届かなくなってからセッションを閉じるまでの秒数
+SESSION_IDLE_TIMEOUT_S = float(os.getenv("SESSION_IDLE_TIMEOUT_S", "120"))
+# カメラフレームの送信間隔・品質をクライアントに指示するか（上りの詰まり具合で AIMD 調整する）
+ADAPTIVE_VIDEO = os.getenv("ADAPTIVE_VIDEO", "1") == "1"
+VIDEO_MIN_INTERVAL_MS = int(os.getenv("VIDEO_MIN_INTERVAL_MS", "300"))
+VIDEO_MAX_INTERVAL_MS = int(os.getenv("VIDEO_MAX_INTERVAL_MS", "5000"))
+VIDEO_MIN_QUALITY = int(os.getenv("VIDEO_MIN_QUALITY", "30"))
+VIDEO_CONTROL_INTERVAL_MS = int(os.getenv("VIDEO_CONTROL_INTERVAL_MS", "1000"))
+# 音声の遅れ（キューに溜まった音声 + 送信時間）の上限。超えたら映像を削る
+AUDIO_LATENCY_BUDGET_MS = int(os.getenv("AUDIO_LATENCY_BUDGET_MS", "200"))
+# セッションの録画先（空なら録画しない）と、書き込み待ちの上限（MB）
+RECORD_DIR = os.getenv("RECORD_DIR", "")
+RECORD_MAX_PENDING_MB = int(os.getenv("RECORD_MAX_PENDING_MB", "64"))
+# Gemini 接続が切れたときのつなぎ直し（指数バックオフ）
+RECONNECT_MAX_ATTEMPTS = int(os.getenv("RECONNECT_MAX_ATTEMPTS", "6"))
+RECONNECT_BASE_DELAY_MS = int(os.getenv("RECONNECT_BASE_DELAY_MS", "250"))
+RECONNECT_MAX_DELAY_MS = int(os.getenv("RECONNECT_MAX_DELAY_MS", "8000"))
+# この秒数続かずに切れた接続は失敗扱いにし、試行回数とバックオフを持ち越す
+RECONNECT_MIN_UPTIME_S = float(os.getenv("RECONNECT_MIN_UPTIME_S", "2"))
+# つなぎ直した接続へ送り直すため、直近何秒分の上り音声を覚えておくか
+REPLAY_AUDIO_SECONDS = float(os.getenv("REPLAY_AUDIO_SECONDS", "5"))
+# セッション再開ハンドルを受け取り、つなぎ直しても会話の文脈を引き継ぐ
+SESSION_RESUMPTION = os.getenv("SESSION_RESUMPTION", "1") == "1"
+if SESSION_RESUMPTION:
+    config["session_resumption"] = {}
+# 同時に開く Gemini セッションの上限（WORKERS=N ならワーカーごと）。溢れた start_session は順番待ちにする
+MAX_UPSTREAM_SESSIONS = int(os.getenv("MAX_UPSTREAM_SESSIONS", "50"))
+# 1クライアント（送信元IP）あたりのセッション数の上限（0 で無制限）
+MAX_SESSIONS_PER_CLIENT = int(os.getenv("MAX_SESSIONS_PER_CLIENT", "4"))
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", "100"))
+ADMISSION_WAIT_TIMEOUT_S = float(os.getenv("ADMISSION_WAIT_TIMEOUT_S", "60"))
+# 受信チャンクの流量制限（音声は端末レートの実時間の何倍まで、画像は毎秒何枚まで。INGRESS_BURST_S 秒分までは溜められる）
+INGRESS_AUDIO_RATE_FACTOR = float(os.getenv("INGRESS_AUDIO_RATE_FACTOR", "2.0"))
+INGRESS_IMAGE_FPS = float(os.getenv("INGRESS_IMAGE_FPS", "5"))
+INGRESS_BURST_S = float(os.getenv("INGRESS_BURST_S", "2"))
+
+# クライアント（＝Socket.IOのsid）ごとのGeminiセッション・タスク・パイプラインを管理
+session_manager = SessionManager(idle_timeout=SESSION_IDLE_TIMEOUT_S)
+
+# Gemini セッションの数を抑え、溢れたら公平に順番待ちさせる
+admission = AdmissionController(
+    max_sessions=MAX_UPSTREAM_SESSIONS, max_per_client=MAX_SESSIONS_PER_CLIENT,
+    max_waiting=ADMISSION_MAX_WAITING, wait_timeout=ADMISSION_WAIT_TIMEOUT_S,
+)
+
+# start_session ですぐ使えるよう、Gemini接続を事前に開いておく
+live_pool = LiveConnectionPool(client, size=LIVE_POOL_SIZE, max_idle=LIVE_POOL_MAX_IDLE_S)
 
-# 「どのクライアント（＝Socket.IOのsid）が、どのGeminiセッションを持っているか」を管理
-session_map = {}
-# 「どのクライアントが、Geminiからの応答を受け取る非同期タスク（asyncio.Task）」を持っているか」を管理
-receive_tasks = {}
-# 「どのクライアントが、Geminiセッションを開始しているか」を管理
-task_map = {}
+# イベントループの遅延を計測（負荷試験時に /stats で確認する）
+loop_monitor = LoopLagMonitor(histogram=metrics.LOOP_LAG)
+
+# /metrics の出力時に、セッション数・キューの長さ・タスク数を集計する
+metrics.bind_collectors(session_manager, asyncio.all_tasks, admission)
 
 # セッションを管理するための非同期関数
-async def handle_session(sid):
+async def handle_session(cs):
+    sid = cs.sid
+    # 接続が切れても Socket.IO 側はそのままで、ResilientUpstream がつなぎ直して溜まった入力を送り直す
+    upstream = ResilientUpstream(
+        live_pool, client, model_id, config,
+        replay_seconds=REPLAY_AUDIO_SECONDS, sample_rate=SEND_SAMPLE_RATE,
+        max_attempts=RECONNECT_MAX_ATTEMPTS, base_delay=RECONNECT_BASE_DELAY_MS / 1000,
+        max_delay=RECONNECT_MAX_DELAY_MS / 1000, min_uptime=RECONNECT_MIN_UPTIME_S, metrics=metrics.observe_reconnect,
+    )
     try:
-        async with client.aio.live.connect(model=model_id, config=config) as session:
-            session_map[sid] = session
+        # 枠が空くまで待つ（待っている間は待ち順を session_queued で知らせ、受信したチャンクは捨てる）
+        async def notify_position(position, waiting):
+            await sio.emit("session_queued", {"position": position, "waiting": waiting}, to=sid)
+
+        queued = not cs.ticket.admitted
+        waited = await cs.ticket.wait(notify_position)
+        metrics.ADMISSION_WAIT.observe(waited)
+        if queued:
+            session_log.info("session_admitted", sid, waited_ms=round(waited * 1000))
+            await sio.emit("session_admitted", {"waited_ms": round(waited * 1000)}, to=sid)
+
+        async with upstream:
+            cs.attach(upstream)
+
+            # 上り（Gemini行き）・下り（クライアント行き）のキュー
+            queues = cs.queues = {
+                "audio_in": MediaQueue(AUDIO_IN_QUEUE_SIZE, AUDIO_IN_QUEUE_POLICY, drop_counter=metrics.AUDIO_IN_DROPPED),
+                "video_in": MediaQueue(VIDEO_IN_QUEUE_SIZE, VIDEO_IN_QUEUE_POLICY, drop_counter=metrics.VIDEO_IN_DROPPED),
+                "audio_out": MediaQueue(AUDIO_OUT_QUEUE_SIZE, AUDIO_OUT_QUEUE_POLICY, drop_counter=metrics.AUDIO_OUT_DROPPED),
+            }
+
+            # VAD_ENABLED でなくても発話の判定はする（発話の終わりから応答までの時間を測るため）
+            cs.vad = VoiceActivityDetector(
+                hangover_ms=VAD_HANGOVER_MS, silence_keep_every=VAD_SILENCE_KEEP_EVERY, drop_silence=VAD_ENABLED,
+            )
+
+            gate_interval_ms = FRAME_MIN_INTERVAL_MS
+            if cs.video_control:
+                gate_interval_ms = cs.video_control.notified_interval_ms * FRAME_INTERVAL_SLACK
+            cs.gate = FrameGate(threshold=FRAME_HASH_THRESHOLD, min_interval_ms=gate_interval_ms)
+            cs.normalizer = FrameNormalizer(queues["video_in"].put, max_edge=IMAGE_MAX_EDGE, quality=IMAGE_JPEG_QUALITY, sid=sid)
+
+            # 受信した音声チャンクを固定長フレームにまとめ、無音を間引いてからキューに入れる
+            async def send_audio_frame(frame):
+                frame = cs.vad.process(frame)
+                if cs.vad.had_speech:
+                    cs.metrics.speech()
+                if not frame:
+                    return
+                await queues["audio_in"].put(frame)
+
+            cs.framer = PcmFramer(send_audio_frame, frame_ms=AUDIO_FRAME_MS)
 
-            # audio_queueをこのセッション専用に作る
-            audio_queue = asyncio.Queue()
+            async def send_audio(frame):
+                start = time.perf_counter()
+                await upstream.send(input={"mime_type": "audio/pcm", "data": frame})
+                if cs.video_control:
+                    cs.video_control.observe_audio_send(time.perf_counter() - start)
+                cs.metrics.upstream_audio(len(frame))
 
-            # 受信タスク
-            receive_tasks[sid] = asyncio.create_task(receive_from_gemini(session, sid, audio_queue))
+            async def send_image(image):
+                start = time.perf_counter()
+                await upstream.send(input={"mime_type": "image/jpeg", "data": image})
+                if cs.video_control:
+                    cs.video_control.observe_image_send(time.perf_counter() - start)
+                metrics.UPSTREAM_IMAGE_BYTES.inc(len(image))
+                metrics.UPSTREAM_IMAGE_CHUNKS.inc()
 
-            # 再生タスク
-            play_task = asyncio.create_task(play_gemini_pcm(audio_queue))
+            # audio_out には (イベント名, データ) を入れ、音声とターン終了の順番を保つ
+            async def emit_audio(item):
+                event, data = item
+                if event == "gemini_interrupted":
+                    # クライアントの ack までの時間で、割り込みが届く速さを測る
+                    await sio.emit(event, data, to=sid, callback=cs.metrics.interruption_acked)
+                    cs.metrics.interruption_emitted()
+                    return
+                await sio.emit(event, data, to=sid)
+                if event == "gemini_response":
+                    metrics.DOWNSTREAM_AUDIO_BYTES.inc(len(data))
+                    metrics.DOWNSTREAM_AUDIO_CHUNKS.inc()
+                    if cs.recorder:
+                        cs.recorder.record(RESPONSE, data)
+                elif cs.recorder:
+                    cs.recorder.record(RESPONSE_END, data["header"] or b"")
 
-            # どちらかが終わるまで待つ（どっちも並行でOK）
-            await receive_tasks[sid]
-            # 通常、再生タスクも停止させる必要がある場合はキャンセルしてOK
-            play_task.cancel()
+            # まとめたPCMを、クライアントと合意したコーデックでエンコードしてからキューに入れる
+            async def encode_audio(pcm):
+                if data := cs.writer.write(cs.encoder.encode(pcm)):
+                    await queues["audio_out"].put(("gemini_response", data))
+
+            # Geminiから届く細切れのPCMを、バイト上限か待ち時間のどちらかでまとめてから送る
+            # （再生レートに変換した後なので、上限もレートに合わせる）
+            out_rate = cs.output_resampler.out_rate
+            cs.emit_batcher = PcmFramer(
+                encode_audio, sample_rate=out_rate,
+                frame_bytes=EMIT_BATCH_BYTES * out_rate // RECEIVE_SAMPLE_RATE & ~1, max_delay_ms=EMIT_BATCH_DELAY_MS,
+            )
+
+            # キューを送り先へ流し続けるタスク
+            cs.spawn("pump_audio_in", pump(queues["audio_in"], send_audio, "audio_in", sid))
+            cs.spawn("pump_video_in", pump(queues["video_in"], send_image, "video_in", sid))
+            cs.spawn("pump_audio_out", pump(queues["audio_out"], emit_audio, "audio_out", sid))
+
+            # 上りの詰まり具合を見て、カメラフレームの間隔・品質をクライアントに伝える
+            if cs.video_control:
+                def sample_upstream():
+                    queued_audio_ms = queues["audio_in"].qsize() * AUDIO_FRAME_MS
+                    dropped_frames = queues["video_in"].dropped + cs.normalizer.dropped_stale
+                    # ループが詰まっていれば、受信した音声の処理もその分遅れる
+                    loop_lag_ms = loop_monitor.recent_max(VIDEO_CONTROL_INTERVAL_MS / 1000) * 1000
+                    return queued_audio_ms, dropped_frames, loop_lag_ms
+
+                async def apply_video_settings(settings):
+                    # Gemini へ送る画像の再エンコード品質と、間引きの最小間隔も合わせる
+                    cs.normalizer.quality = settings["quality"]
+                    cs.gate.min_interval = settings["interval_ms"] * FRAME_INTERVAL_SLACK / 1000
+                    await sio.emit("video_control", settings, to=sid)
+
+                cs.spawn("video_control", cs.video_control.run(VIDEO_CONTROL_INTERVAL_MS / 1000, sample_upstream, apply_video_settings))
+
+            # audio_queueをこのセッション専用に作る（デバッグ再生用なので古いものから捨てる）
+            audio_queue = MediaQueue(PLAYBACK_QUEUE_SIZE, DROP_OLDEST)
+
+            # 受信タスク・再生タスク
+            receive_task = cs.spawn("receive", receive_from_gemini(cs, audio_queue))
+            cs.playback = PlaybackEngine(
+                samplerate=RECEIVE_SAMPLE_RATE, min_target_ms=PLAYBACK_MIN_JITTER_MS,
+                max_target_ms=PLAYBACK_MAX_JITTER_MS, null_device=PLAYBACK_DEVICE == "null",
+                histogram=metrics.PLAYBACK_LATENCY,
+            )
+            cs.spawn("play", play_gemini_pcm(audio_queue, cs.playback))
+
+            # 受信が終わったら、再生・送信タスクも含めて全て止める
+            await receive_task
 
     except asyncio.CancelledError:
-        print(f"[handle_session] セッション {sid} はキャンセルされました")
+        session_log.info("session_cancelled", sid)
+
+    except AdmissionRejected as e:
+        metrics.ADMISSION_REJECTED.labels(e.reason).inc()
+        session_log.warning("session_rejected", sid, reason=e.reason)
+        await sio.emit("session_rejected", {"reason": e.reason}, to=sid)
+
+    except UpstreamClosed as e:
+        session_log.error("upstream_gave_up", sid, error=str(e))
+        await sio.emit("session_error", {"reason": "upstream_closed"}, to=sid)
+
+    except Exception as e:
+        # 想定外の失敗でも、クライアントに知らせてから枠を返す（finally の discard で片付ける）
+        session_log.error("session_failed", sid, exc_info=True, error=repr(e))
+        await sio.emit("session_error", {"reason": "internal_error"}, to=sid)
 
     finally:
-        session_map.pop(sid, None)
-        receive_tasks.pop(sid, None)
-        task_map.pop(sid, None)
-        print(f"[handle_session] セッション {sid} が終了しました")
+        if cs.playback:
+            metrics.PLAYBACK_EVENTS.labels("underrun").inc(cs.playback.underruns)
+            metrics.PLAYBACK_EVENTS.labels("overrun").inc(cs.playback.overruns)
+        session_manager.discard(cs)
+        session_log.info("session_finished", sid)
 
 
 # Geminiからの応答を受信する非同期関数
 
-async def receive_from_gemini(session, sid, audio_queue):
-    while True:
-        try:
-            async for response in session.receive():
-                if data := response.data:
-                    await sio.emit("gemini_response", data, to=sid)
-                    await audio_queue.put(data)
-                if text := response.text:
-                    print(text, end="")
-        except websockets.exceptions.ConnectionClosedOK:
-            break 
+async def receive_from_gemini(cs, audio_queue):
+    # 応答の途中か（turn_complete を待っているか）
+    responding = False
+
+    async def close_cut_turn(resumed):
+        # 応答の途中で切れたターンの続きは届かないので、割り込みと同じく打ち切ってクライアントに知らせる
+        nonlocal responding
+        if cs.interrupted:
+            # 割り込みの区切りは送り済みで、待っていた turn_complete が来なくなっただけ
+            cs.interrupted = False
+        elif responding:
+            await interrupt_turn(cs, audio_queue, reason="reconnect")
+        responding = False
+
+    cs.upstream.on_reconnect = close_cut_turn
+    # 切れてもつなぎ直して続きを返す（諦めたら UpstreamClosed）
+    async for response in cs.upstream.responses():
+        server_content = response.server_content
+        if server_content and server_content.interrupted:
+            await interrupt_turn(cs, audio_queue)
+        # 割り込まれたターンの残り（turn_complete まで）は送らない
+        if (data := response.data) and not cs.interrupted:
+            responding = True
+            cs.metrics.response_audio(len(data))
+            # クライアントへはまとめてからキュー経由で送る（満杯ならGeminiからの読み込みが待たされる）
+            await cs.emit_batcher.push(cs.output_resampler.process(data))
+            await audio_queue.put(data)
+        if text := response.text:
+            gemini_log.info("gemini_text", cs.sid, text=text)
+        if server_content and server_content.turn_complete:
+            responding = False
+            cs.metrics.turn_complete()
+            if cs.interrupted:
+                # 区切りは gemini_interrupted で送り済み
+                cs.interrupted = False
+                continue
+            # 応答の末尾を待たせないよう、ターンの終わりで残りを送る
+            if tail := cs.output_resampler.flush():
+                await cs.emit_batcher.push(tail)
+            await cs.emit_batcher.flush()
+            await finish_turn(cs)
+
+
+# エンコーダーの端数を送り、wav なら長さを確定したヘッダーを付けてターンの終わりを知らせる
+async def finish_turn(cs):
+    queue = cs.queues["audio_out"]
+    if tail := cs.writer.write(cs.encoder.flush()):
+        await queue.put(("gemini_response", tail))
+    turn_bytes = cs.writer.turn_bytes
+    header = cs.writer.finalize()
+    await queue.put(("gemini_response_end", {"turn": cs.turn, "bytes": turn_bytes, "header": header}))
+    cs.turn += 1
+
+
+# ユーザーが話し始めて応答が打ち切られたら、まだ送っていない応答音声を全て捨て、
+# gemini_interrupted でターンの区切りを知らせる（クライアントは途中まで受け取った分を捨てて再生を止める）
+# reason="reconnect" は Gemini 接続が応答の途中で切れた場合（新しい接続からは turn_complete が来ないので待たない）
+async def interrupt_turn(cs, audio_queue, reason="interrupted"):
+    cs.interrupted = reason == "interrupted"
+    # 送信中のまとめを待ってから捨てるので、この後に古い音声がキューに入ることはない
+    discarded = await cs.emit_batcher.discard()
+    cs.output_resampler.reset()
+    cs.encoder.reset()
+    cs.writer.abort()
+    queue = cs.queues["audio_out"]
+    # 前のターンの残り（gemini_response_end を含む）も、再生される前に打ち切られたので捨てる
+    while not queue.empty():
+        event, data = queue.get_nowait()
+        if event == "gemini_response":
+            discarded += len(data)
+    audio_queue.clear()
+    if cs.playback:
+        cs.playback.clear()
+    if cs.interrupted:
+        cs.metrics.interrupted(discarded)
+    else:
+        cs.metrics.turn_complete()
+    gemini_log.info("gemini_interrupted", cs.sid, turn=cs.turn, discarded_bytes=discarded, reason=reason)
+    await queue.put(("gemini_interrupted", {"turn": cs.turn, "discarded_bytes": discarded, "reason": reason}))
+    cs.turn += 1
+
+
+# ------------------------------------- HTTPエンドポイント -------------------------------------------------------
+
+@app.on_event("startup")
+async def on_startup():
+    loop_monitor.start()
+    # 最初のフレームでプロセス起動を待たないよう、先に作っておく
+    get_pool(IMAGE_WORKERS)
+    live_pool.warm(model_id, config)
+    session_manager.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await session_manager.shutdown()
+    shutdown_pool()
+    await live_pool.close()
+    shutdown_logging()
+
+
+# Prometheus 形式のメトリクス
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "loop_lag": loop_monitor.summary(),
+        "live_pool": live_pool.stats(),
+        "logging": log_stats(),
+        "worker": client_manager.stats() if client_manager else None,
+        "recorder": recorder_stats(),
+        "admission": admission.stats(),
+        **session_manager.snapshot(),
+    }
 
 
 # ------------------------------------- socket.ioエンドポイント -------------------------------------------------------
@@ -78,51 +448,171 @@ async def receive_from_gemini(session, sid, audio_queue):
 # クライアント接続イベント
 @sio.event
 async def connect(sid, environ):
-    print(f"✅ クライアント {sid} が接続しました")
+    session_log.info("client_connected", sid)
           
 # geminiセッション開始イベント
 @sio.event
 async def start_session(sid, data):
-     task_map[sid] = asyncio.create_task(handle_session(sid))
-     print(f"[start_session] セッション {sid} を開始しました")
-# 音声チャンクをgeminiに送信するイベント
+     # 同じ sid の古いセッションは create で閉じて枠を返してから、新しい枠を取る
+     cs = session_manager.create(sid)
+     try:
+         cs.ticket = admission.enter(client_key(sid))
+     except AdmissionRejected as e:
+         session_manager.discard(cs)
+         metrics.ADMISSION_REJECTED.labels(e.reason).inc()
+         session_log.warning("session_rejected", sid, reason=e.reason)
+         return {"error": "rejected", "reason": e.reason}
+     cs.metrics = metrics.SessionMetrics()
+     options = data if isinstance(data, dict) else {}
+     # 端末の録音・再生レートが Gemini と違えば変換する
+     cs.input_resampler = Resampler(negotiate_rate(options.get("input_rate"), SEND_SAMPLE_RATE), SEND_SAMPLE_RATE)
+     cs.output_resampler = Resampler(RECEIVE_SAMPLE_RATE, negotiate_rate(options.get("output_rate"), RECEIVE_SAMPLE_RATE))
+     out_rate = cs.output_resampler.out_rate
+     # 端末の録音レートの実時間を大きく超える音声・多すぎる画像は、Gemini へ送る前に捨てる
+     audio_rate = cs.input_resampler.in_rate * 2 * INGRESS_AUDIO_RATE_FACTOR
+     cs.ingress = {
+         "audio": TokenBucket(audio_rate, audio_rate * INGRESS_BURST_S),
+         "image": TokenBucket(INGRESS_IMAGE_FPS, INGRESS_IMAGE_FPS * INGRESS_BURST_S),
+     }
+     cs.encoder = AudioEncoder(negotiate_codec(data))
+     cs.writer = WavStreamWriter(cs.encoder.codec, out_rate, negotiate_container(data), cs.encoder.block_align)
+     if ADAPTIVE_VIDEO:
+         cs.video_control = FrameRateController(
+             min_interval_ms=VIDEO_MIN_INTERVAL_MS, max_interval_ms=VIDEO_MAX_INTERVAL_MS,
+             min_quality=VIDEO_MIN_QUALITY, max_quality=IMAGE_JPEG_QUALITY, audio_budget_ms=AUDIO_LATENCY_BUDGET_MS,
+         )
+     if RECORD_DIR:
+         # 再生時に同じ条件で start_session できるよう、オプションも残す
+         cs.recorder = SessionRecorder(RECORD_DIR, sid, meta=options, max_pending_bytes=RECORD_MAX_PENDING_MB * 1024 * 1024)
+     cs.task = asyncio.create_task(handle_session(cs))
+     session_log.info(
+         "session_started", sid, codec=cs.encoder.codec, container=cs.writer.container,
+         input_rate=cs.input_resampler.in_rate, output_rate=out_rate,
+     )
+     # ack で合意した音声フォーマットを返す
+     return {
+         **cs.encoder.describe(out_rate),
+         **cs.writer.describe(),
+         "input_rate": cs.input_resampler.in_rate,
+         # 最初のフレーム間隔・品質（以降の変更は video_control イベントで届く）
+         "video": cs.video_control.settings() if cs.video_control else None,
+         # 0 ならすぐ開始。1 以上なら順番待ち（以降の変化は session_queued、開始は session_admitted で届く）
+         "queue_position": cs.ticket.position,
+     }
+
+
+# 受け入れ制御でのクライアントの単位（送信元IP）
+# マルチプロセス構成ではルーターが付ける X-Forwarded-For を使う（単体起動ではクライアントが偽れるので使わない）
+def client_key(sid):
+    environ = sio.get_environ(sid) or {}
+    if WORKER_ID is not None and (forwarded := environ.get("HTTP_X_FORWARDED_FOR")):
+        return forwarded.split(",")[0].strip()
+    client = (environ.get("asgi.scope") or {}).get("client")
+    return client[0] if client else sid
+
+
+# クライアントが希望するコーデック（"codec" または優先順の "codecs"）から使えるものを選ぶ
+def negotiate_codec(data):
+    if not isinstance(data, dict):
+        return CODEC_PCM
+    wanted = data.get("codecs") or [data.get("codec")]
+    for codec in wanted:
+        if codec in SUPPORTED_CODECS:
+            return codec
+    return CODEC_PCM
+
+# 送り方（"wav" はターンごとにヘッダー付き、"raw" はヘッダーなし）。指定がなければ wav
+def negotiate_container(data):
+    container = data.get("container") if isinstance(data, dict) else None
+    return container if container in SUPPORTED_CONTAINERS else CONTAINER_WAV
+
+# 音声チャンクをgeminiに送信するイベント（バイナリ添付 / 旧base64 JSONの両方を受け付ける）
 @sio.event
 async def send_audio_chunk(sid, data):
-    session = session_map.get(sid)
-    if not session:
+    cs = session_manager.get(sid)
+    if not cs or not cs.framer:
+        return
+
+    try:
+        mime_type, seq, audio = await decode_media_async(data, "audio/pcm", PAYLOAD_LIMITS, PAYLOAD_OFFLOAD_BYTES)
+    except PayloadError as e:
+        metrics.INVALID_PAYLOADS.labels("audio").inc()
+        media_log.warning("invalid_payload", sid, media="audio", error=str(e))
+        return
+    if cs.closed:
+        # スレッドでデコードしている間にセッションが閉じられた
+        return
+
+    if not cs.ingress["audio"].take(len(audio)):
+        metrics.INGRESS_THROTTLED.labels("audio").inc()
+        media_log.info("ingress_throttled", sid, media="audio", bytes=len(audio))
         return
 
-    audio = base64.b64decode(data["data"])
-    await session.send(input={"mime_type": "audio/pcm", "data": audio})
-    print(f"[send_audio_chunk] {sid} 音声チャンク送信完了")
+    cs.touch()
+    metrics.INGRESS_AUDIO_BYTES.inc(len(audio))
+    metrics.INGRESS_AUDIO_CHUNKS.inc()
+    # チャンクごとのログは間引いて出す（LOG_SAMPLE で変更できる）
+    media_log.info("audio_chunk", sid, seq=seq, bytes=len(audio))
+    if cs.recorder:
+        cs.recorder.record(AUDIO_IN, audio)
+    # 送信はフレーマーがまとめて行う
+    await cs.framer.push(cs.input_resampler.process(audio))
         
-# 画像フレームを受geminiに送信するイベント
+# 画像フレームをgeminiに送信するイベント
 @sio.event
 async def send_image_frame(sid, data):
-    session = session_map.get(sid)
-    if not session:
+    cs = session_manager.get(sid)
+    if not cs or not cs.gate or not cs.normalizer:
+        return
+
+    try:
+        mime_type, seq, image = await decode_media_async(data, "image/jpeg", PAYLOAD_LIMITS, PAYLOAD_OFFLOAD_BYTES)
+    except PayloadError as e:
+        metrics.INVALID_PAYLOADS.labels("image").inc()
+        media_log.warning("invalid_payload", sid, media="image", error=str(e))
+        return
+    if cs.closed:
+        return
+
+    if not cs.ingress["image"].take():
+        metrics.INGRESS_THROTTLED.labels("image").inc()
+        media_log.info("ingress_throttled", sid, media="image", bytes=len(image))
+        return
+
+    cs.touch()
+    metrics.INGRESS_IMAGE_BYTES.inc(len(image))
+    metrics.INGRESS_IMAGE_CHUNKS.inc()
+    media_log.info("image_frame", sid, seq=seq, bytes=len(image))
+    if cs.recorder:
+        cs.recorder.record(IMAGE_IN, image)
+    # 前回送った画面とほぼ同じなら送らない
+    if not await cs.gate.admit(image):
         return
 
-    image = base64.b64decode(data["data"])
-    await session.send(input={"mime_type": "image/jpeg", "data": image})
-    print(f"[send_image_frame] {sid} 画像フレーム送信完了")
+    # 縮小・送信はノーマライザーが別プロセスで行う（処理待ちの古いフレームは捨てられる）
+    cs.normalizer.submit(image)
 
 # geminiセッション終了イベント
 @sio.event
 async def end_session(sid, data):
-    session = session_map.get(sid)
-    if session:
-        await session.close()
-        print(f"[end_session] セッション {sid} を終了しました")
+    if await session_manager.close(sid, "(end_session)"):
+        session_log.info("session_ended", sid)
 
 
 @sio.event
 async def disconnect(sid):
-    print(f"❌ クライアント {sid} が切断しました")
+    # end_session なしで切断された場合も、Gemini接続とタスクを必ず片付ける
+    await session_manager.close(sid, "(切断)")
+    session_log.info("client_disconnected", sid)
 
 
-# サーバー起動
+# サーバー起動（WORKERS=N ならルーター + N ワーカーのマルチプロセス構成）
 if __name__ == "__main__":
-    uvicorn.run(socket_app, host="0.0.0.0", port=8080)
+    if WORKER_ID is not None:
+        uvicorn.run(socket_app, uds=worker_socket_path(CLUSTER_DIR, WORKER_ID))
+    elif int(os.getenv("WORKERS", "1")) > 1:
+        run_cluster(int(os.getenv("WORKERS")), host="0.0.0.0", port=8080, script=os.path.abspath(__file__))
+    else:
+        uvicorn.run(socket_app, host="0.0.0.0", port=8080)
     
  # uvicorn geminiSession:socket_app --host 0.0.0.0 --port 8080 --reload
\ No newline at end of file
@@ -0,0 +1,64 @@
+import argparse
+import time
+
+import numpy as np
+
+from services.audio import AudioEncoder, ima_adpcm_to_pcm, mulaw_to_pcm
+
+# ------------------------------------------------------------------
+# 下り音声コーデックのエンコード速度（1コアあたり MB/s、入力PCM換算）と音質（SNR）
+#
+#   python -m sandbox.benchCodec --seconds 60
+# ------------------------------------------------------------------
+
+SAMPLE_RATE = 24000
+
+
+def make_signal(seconds):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    voice = np.sin(2 * np.pi * 180 * t) + 0.5 * np.sin(2 * np.pi * 720 * t) + 0.2 * np.sin(2 * np.pi * 2900 * t)
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 2.5 * t)
+    return (0.25 * 32767 * envelope * voice / 1.7).astype("<i2")
+
+
+def snr_db(reference, decoded):
+    reference = reference.astype(np.float64)
+    decoded = decoded[:reference.size].astype(np.float64)
+    return 10 * np.log10(np.sum(reference ** 2) / max(np.sum((reference - decoded) ** 2), 1e-9))
+
+
+def bench(codec, pcm, chunk_bytes):
+    encoder = AudioEncoder(codec)
+    chunks = [pcm[i:i + chunk_bytes] for i in range(0, len(pcm), chunk_bytes)]
+    out = bytearray()
+    start = time.process_time()
+    for chunk in chunks:
+        out += encoder.encode(chunk)
+    out += encoder.flush()
+    cpu = time.process_time() - start
+    return bytes(out), len(pcm) / 1e6 / cpu
+
+
+def main(args):
+    signal = make_signal(args.seconds)
+    pcm = signal.tobytes()
+    print(f"入力: {args.seconds}s / {len(pcm) / 1e6:.1f}MB (24kHz int16)")
+    for chunk_ms in args.chunk_ms:
+        chunk_bytes = SAMPLE_RATE * chunk_ms // 1000 * 2
+        print(f"チャンク {chunk_ms}ms")
+        for codec in ("mulaw", "adpcm"):
+            encoded, mb_per_s = bench(codec, pcm, chunk_bytes)
+            decoded = mulaw_to_pcm(encoded) if codec == "mulaw" else ima_adpcm_to_pcm(encoded)
+            print(
+                f"  {codec:<6} {mb_per_s:8.1f} MB/s/core  size={len(encoded) / len(pcm):.3f}"
+                f"  SNR={snr_db(signal, np.frombuffer(decoded, dtype='<i2')):.1f}dB"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=60)
+    parser.add_argument("--chunk-ms", type=int, action="append", help="1回の encode に渡す長さ（ms）。複数指定可")
+    args = parser.parse_args()
+    args.chunk_ms = args.chunk_ms or [200, 1000, 10000]
+    main(args)
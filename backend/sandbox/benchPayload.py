@@ -0,0 +1,145 @@
+import argparse
+import asyncio
+import base64
+import os
+import time
+
+from socketio import packet
+
+from services.payload import decode_media, decode_media_async, encode_media, inspect_media, PayloadError
+from utils.loopMonitor import LoopLagMonitor
+
+# ------------------------------------------------------------------
+# base64 JSON とバイナリ添付の受信コスト比較
+# サーバー側で1イベントごとに行う処理（Socket.IOパケットのデコード + decode_media）を計測する
+#
+#   python -m sandbox.benchPayload --size 2048 --size 150000
+#
+# --loop-lag: 大きな画像（base64 JSON）を受けている間のイベントループの遅延を、
+#             イベントループ上でデコードする場合（decode_media）とスレッドに逃がす場合（decode_media_async）で比べる
+#
+#   python -m sandbox.benchPayload --loop-lag --size 4000000 --frames 40
+# ------------------------------------------------------------------
+
+
+def wire_base64(event, mime_type, data):
+    payload = {"mime_type": mime_type, "data": base64.b64encode(data).decode()}
+    return packet.Packet(packet.EVENT, data=[event, payload]).encode()
+
+
+def wire_binary(event, mime_type, seq, data):
+    payload = encode_media(mime_type, seq, data)
+    return packet.Packet(packet.EVENT, data=[event, payload]).encode()
+
+
+def receive(encoded):
+    """サーバーがテキストフレーム + バイナリ添付を受けてイベント引数を復元するまで"""
+    if isinstance(encoded, list):
+        pkt = packet.Packet(encoded_packet=encoded[0])
+        for attachment in encoded[1:]:
+            pkt.add_attachment(attachment)
+    else:
+        pkt = packet.Packet(encoded_packet=encoded)
+    return pkt.data[1]
+
+
+def wire_bytes(encoded):
+    if isinstance(encoded, list):
+        return sum(len(part) for part in encoded)
+    return len(encoded)
+
+
+def bench(label, encoded, size, mime_type, iterations):
+    latencies = []
+    cpu_start = time.process_time()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        decode_media(receive(encoded), mime_type)
+        latencies.append(time.perf_counter() - start)
+    cpu = time.process_time() - cpu_start
+    latencies.sort()
+    mb = size * iterations / 1e6
+    print(
+        f"  {label:<7} wire={wire_bytes(encoded):>9,}B  cpu/MB={cpu / mb * 1000:8.3f}ms"
+        f"  p50={latencies[len(latencies) // 2] * 1e6:8.1f}us  p99={latencies[int(len(latencies) * 0.99)] * 1e6:8.1f}us"
+    )
+
+
+async def bench_loop_lag(label, payloads, interval, decode):
+    """interval 秒ごとに届くペイロードをデコードしながら、5ms 間隔でループの遅延を測る"""
+    monitor = LoopLagMonitor(interval=0.005).start()
+    await asyncio.sleep(0.1)
+    started = time.perf_counter()
+    tasks = []
+    for payload in payloads:
+        tasks.append(asyncio.create_task(decode(payload)))
+        await asyncio.sleep(interval)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    summary = monitor.summary()
+    print(
+        f"  {label:<22} lag p50={summary['p50_ms']:6.2f}ms  p99={summary['p99_ms']:7.2f}ms"
+        f"  max={summary['max_ms']:7.2f}ms  elapsed={elapsed:5.2f}s"
+    )
+
+
+def synthetic_payload(mime_type, size):
+    """ランダムなバイト列。payload の形式チェックを通るよう、画像は JPEG の先頭マーカーを付ける"""
+    if mime_type == "image/jpeg":
+        return b"\xff\xd8\xff\xe0" + os.urandom(size - 4)
+    return os.urandom(size)
+
+
+async def main_loop_lag(args):
+    interval = args.interval_ms / 1000
+    for size in args.size:
+        jpeg = synthetic_payload("image/jpeg", size)
+        payloads = [{"mime_type": "image/jpeg", "data": base64.b64encode(jpeg).decode()} for _ in range(args.frames)]
+        print(f"image/jpeg base64 {size:,}B x {args.frames}（{args.interval_ms}ms ごと）")
+
+        async def inline(payload):
+            decode_media(payload, "image/jpeg", limits={})
+
+        async def offloaded(payload):
+            await decode_media_async(payload, "image/jpeg", limits={})
+
+        await bench_loop_lag("before: ループでデコード", payloads, interval, inline)
+        await bench_loop_lag("after:  スレッドでデコード", payloads, interval, offloaded)
+
+    # 上限を超えるペイロードは、文字数を見るだけでデコードせずに弾く
+    huge = {"mime_type": "image/jpeg", "data": "A" * (100 * 1024 * 1024)}
+    start = time.perf_counter()
+    try:
+        inspect_media(huge, "image/jpeg")
+    except PayloadError as e:
+        print(f"100MB の base64: {(time.perf_counter() - start) * 1e6:.1f}us で拒否（{e}）")
+    start = time.perf_counter()
+    base64.b64decode(huge["data"])
+    print(f"  （上限なしでデコードした場合: {(time.perf_counter() - start) * 1000:.1f}ms）")
+
+
+def main(args):
+    for size in args.size:
+        mime_type = "audio/pcm" if size < 16384 else "image/jpeg"
+        data = synthetic_payload(mime_type, size)
+        iterations = max(args.mb * 1_000_000 // size, 100)
+        print(f"{mime_type} {size:,}B x {iterations}")
+        bench("base64", wire_base64("send_image_frame", mime_type, data), size, mime_type, iterations)
+        bench("binary", wire_binary("send_image_frame", mime_type, 1, data), size, mime_type, iterations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, action="append", help="ペイロードサイズ（バイト）。複数指定可")
+    parser.add_argument("--mb", type=int, default=200, help="サイズごとに処理する合計MB")
+    parser.add_argument("--loop-lag", action="store_true", help="大きなペイロードの受信中のループ遅延を比べる")
+    parser.add_argument("--frames", type=int, default=40, help="--loop-lag で送るペイロードの数")
+    parser.add_argument("--interval-ms", type=int, default=50, help="--loop-lag でペイロードが届く間隔")
+    args = parser.parse_args()
+    if args.loop_lag:
+        args.size = args.size or [1_000_000, 4_000_000]
+        asyncio.run(main_loop_lag(args))
+    else:
+        args.size = args.size or [2048, 32000, 150000]
+        main(args)
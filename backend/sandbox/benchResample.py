@@ -0,0 +1,57 @@
+import argparse
+import time
+
+import numpy as np
+
+from services.resampler import Resampler
+
+# ------------------------------------------------------------------
+# レート変換のCPUコスト（音声1秒あたりのCPU時間）と、チャンク分割の影響
+# 「一括変換と一致」が yes なら、チャンクの境目で波形が変わっていない（クリックが出ない）
+#
+#   python -m sandbox.benchResample --seconds 30
+# ------------------------------------------------------------------
+
+CONVERSIONS = [
+    # 上り: 端末の録音レート → Gemini
+    (48000, 16000),
+    (44100, 16000),
+    # 下り: Gemini → 端末の再生レート
+    (24000, 16000),
+    (24000, 44100),
+    (24000, 48000),
+]
+
+
+def make_signal(rate, seconds):
+    t = np.arange(int(rate * seconds)) / rate
+    voice = np.sin(2 * np.pi * 180 * t) + 0.5 * np.sin(2 * np.pi * 720 * t) + 0.2 * np.sin(2 * np.pi * 2900 * t)
+    return (0.25 * 32767 * voice / 1.7).astype("<i2").tobytes()
+
+
+def bench(in_rate, out_rate, pcm, chunk_ms):
+    chunk_bytes = in_rate * chunk_ms // 1000 * 2
+    resampler = Resampler(in_rate, out_rate)
+    chunks = [pcm[i:i + chunk_bytes] for i in range(0, len(pcm), chunk_bytes)]
+    start = time.process_time()
+    out = b"".join(resampler.process(chunk) for chunk in chunks)
+    return out, time.process_time() - start
+
+
+def main(args):
+    print(f"入力: {args.seconds}s / チャンク {args.chunk_ms}ms")
+    for in_rate, out_rate in CONVERSIONS:
+        pcm = make_signal(in_rate, args.seconds)
+        chunked, cpu = bench(in_rate, out_rate, pcm, args.chunk_ms)
+        whole = Resampler(in_rate, out_rate).process(pcm)
+        print(
+            f"  {in_rate:>5} -> {out_rate:>5}  {cpu / args.seconds * 1000:6.2f} ms CPU / ストリーム秒"
+            f"  ({args.seconds / cpu:5.0f} ストリーム/コア)  一括変換と一致: {'yes' if chunked == whole else 'no'}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--chunk-ms", type=int, default=100, help="1回の process に渡す長さ（ms）")
+    main(parser.parse_args())
@@ -0,0 +1,353 @@
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+import aiohttp
+import numpy as np
+import socketio
+from PIL import Image
+
+from services.payload import encode_media
+from utils.loopMonitor import LoopLagMonitor, percentiles_ms
+
+# ------------------------------------------------------------------
+# geminiSession の負荷試験
+# N 台のスマホを模した Socket.IO クライアントが start_session を呼び、
+# 音声（連続）と JPEG（300ms ごと）をアプリと同じレートで送り続ける。
+#
+#   python -m services.mockLive --port 9100
+#   GEMINI_MOCK_URL=ws://localhost:9100 MAX_SESSIONS_PER_CLIENT=0 MAX_UPSTREAM_SESSIONS=1000 python geminiSession.py
+#   （全クライアントが同じIPから来るので、受け入れ制御の上限を外しておく）
+#   python -m sandbox.loadTest --clients 200 --duration 60
+#
+# ワーカー数でどれだけ伸びるか（マルチコアのマシンで）:
+#   python -m services.mockLive --port 9100
+#   GEMINI_MOCK_URL=ws://localhost:9100 python -m sandbox.loadTest --sweep-workers 1,2,4 --clients 200 --duration 60
+#   ワーカー数ごとに geminiSession.py を WORKERS=N で起動し直して同じ負荷をかけ、結果を並べる。
+#   --clients はワーカー1つでは遅延が伸び始める数にしておく。モックも1プロセスなので、
+#   モックの CPU が張り付いていないか（top など）も見ること
+# ------------------------------------------------------------------
+
+def make_speech_chunk(chunk_bytes, index, sample_rate):
+    """発話を模した振幅変調付きのサイン波"""
+    n = chunk_bytes // 2
+    t = (np.arange(n) + index * n) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    wave = 0.4 * envelope * np.sin(2 * np.pi * 220 * t)
+    return (wave * 32767).astype("<i2").tobytes()
+
+
+def make_jpeg(width, height, quality):
+    noise = np.random.default_rng(0).integers(0, 255, (height // 8, width // 8, 3), dtype=np.uint8)
+    img = Image.fromarray(noise).resize((width, height))
+    image_io = io.BytesIO()
+    img.save(image_io, format="jpeg", quality=quality)
+    return image_io.getvalue()
+
+
+class ClientStats:
+    def __init__(self):
+        self.sent_chunks = 0
+        self.sent_bytes = 0
+        self.sent_frames = 0
+        self.recv_events = 0
+        self.recv_bytes = 0
+        self.latencies = []
+        self.missed = 0
+        self.turns = 0
+        self.video_controls = 0
+        self.interruptions = 0
+        self.errors = 0
+        # 受け入れ制御で断られたか、順番待ちした時間（秒）
+        self.rejected = False
+        self.queue_wait = None
+
+
+class LoadClient:
+    def __init__(self, index, args, speech, silence, jpeg):
+        self.index = index
+        self.args = args
+        self.speech = speech
+        self.silence = silence
+        self.jpeg = jpeg
+        self.stats = ClientStats()
+        self.sio = socketio.AsyncClient(reconnection=False)
+        # 発話終了（無音の送信開始）時刻。最初の gemini_response で応答時間を確定する
+        self.utterance_end = None
+        self.seq = 0
+        # サーバーの video_control に従うときの送信間隔（秒）と品質
+        self.frame_interval = args.frame_interval_ms / 1000
+        self.quality = args.jpeg_quality
+        self.sio.on("gemini_response", self.on_response)
+        self.sio.on("gemini_response_end", self.on_response_end)
+        self.sio.on("gemini_interrupted", self.on_interrupted)
+        self.sio.on("session_admitted", self.on_admitted)
+        self.sio.on("session_rejected", self.on_rejected)
+        self.sio.on("session_error", self.on_session_error)
+        self._admitted = asyncio.Event()
+        if args.adaptive:
+            self.sio.on("video_control", self.on_video_control)
+
+    async def on_response(self, data):
+        self.stats.recv_events += 1
+        self.stats.recv_bytes += len(data) if isinstance(data, (bytes, bytearray)) else 0
+        if self.utterance_end is not None:
+            self.stats.latencies.append(time.perf_counter() - self.utterance_end)
+            self.utterance_end = None
+
+    async def on_response_end(self, data):
+        self.stats.turns += 1
+
+    async def on_interrupted(self, data):
+        self.stats.interruptions += 1
+        # 戻り値が ack になり、サーバー側で割り込みが届くまでの時間を測れる
+        return True
+
+    async def on_admitted(self, data):
+        self.stats.queue_wait = data["waited_ms"] / 1000
+        self._admitted.set()
+
+    async def on_rejected(self, data):
+        self.stats.rejected = True
+        self._admitted.set()
+
+    async def on_session_error(self, data):
+        self.stats.errors += 1
+        print(f"[client {self.index}] セッションエラー: {data.get('reason')}")
+
+    async def on_video_control(self, settings):
+        self.stats.video_controls += 1
+        self.frame_interval = settings["interval_ms"] / 1000
+        self.quality = settings["quality"]
+
+    def _payload(self, mime_type, data):
+        self.seq += 1
+        if self.args.binary:
+            return encode_media(mime_type, self.seq, data)
+        return {"mime_type": mime_type, "data": base64.b64encode(data).decode()}
+
+    def _audio_payload(self, chunk):
+        return self._payload("audio/pcm", chunk)
+
+    def _image_payload(self):
+        return self._payload("image/jpeg", self.jpeg(self.quality))
+
+    async def stream_audio(self, deadline):
+        chunk_sec = self.args.chunk_bytes / 2 / self.args.input_rate
+        speech_chunks = max(int(self.args.speech_ms / 1000 / chunk_sec), 1)
+        pause_chunks = max(int(self.args.pause_ms / 1000 / chunk_sec), 1)
+        cycle = speech_chunks + pause_chunks
+        next_at = time.perf_counter()
+        i = 0
+        while next_at < deadline:
+            pos = i % cycle
+            if pos < speech_chunks:
+                chunk = self.speech[pos % len(self.speech)]
+            else:
+                chunk = self.silence
+                if pos == speech_chunks:
+                    if self.utterance_end is not None:
+                        self.stats.missed += 1
+                    self.utterance_end = time.perf_counter()
+            await self.sio.emit("send_audio_chunk", self._audio_payload(chunk))
+            self.stats.sent_chunks += 1
+            self.stats.sent_bytes += len(chunk)
+            i += 1
+            next_at += chunk_sec
+            await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+
+    async def stream_frames(self, deadline):
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            payload = self._image_payload()
+            await self.sio.emit("send_image_frame", payload)
+            self.stats.sent_frames += 1
+            self.stats.sent_bytes += len(payload) if isinstance(payload, bytes) else len(payload["data"]) * 3 // 4
+            next_at += self.frame_interval
+            await asyncio.sleep(max(next_at - time.perf_counter(), 0))
+
+    async def run(self, start_at, deadline):
+        await asyncio.sleep(max(start_at - time.perf_counter(), 0))
+        try:
+            await self.sio.connect(self.args.url, transports=["websocket"])
+            ack = await self.sio.call("start_session", {
+                "codec": self.args.codec,
+                "container": self.args.container,
+                "input_rate": self.args.input_rate,
+                "output_rate": self.args.output_rate,
+            }, timeout=10)
+            if ack.get("error"):
+                self.stats.rejected = True
+                return
+            if ack.get("queue_position"):
+                # 順番待ちの間に送っても捨てられるので、受け入れられてから送り始める
+                try:
+                    await asyncio.wait_for(self._admitted.wait(), max(deadline - time.perf_counter(), 0))
+                except asyncio.TimeoutError:
+                    return
+                if self.stats.rejected:
+                    return
+            else:
+                self.stats.queue_wait = 0.0
+            await asyncio.sleep(self.args.warmup_ms / 1000)
+            tasks = [self.stream_audio(deadline)]
+            if self.args.frame_interval_ms > 0:
+                tasks.append(self.stream_frames(deadline))
+            await asyncio.gather(*tasks)
+            await self.sio.emit("end_session", {})
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"[client {self.index}] エラー: {e}")
+        finally:
+            await self.sio.disconnect()
+
+
+async def fetch_server_stats(url):
+    try:
+        async with aiohttp.ClientSession() as http:
+            async with http.get(f"{url}/stats", timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                return await resp.json()
+    except Exception as e:
+        return {"error": str(e)}
+
+
+async def run_load(args):
+    chunk_samples = args.chunk_bytes // 2
+    speech = [make_speech_chunk(args.chunk_bytes, i, args.input_rate) for i in range(16)]
+    silence = bytes(chunk_samples * 2)
+    # video_control で品質が変わるので、品質ごとに1度だけ作る
+    jpegs = {}
+    jpeg = lambda quality: jpegs.get(quality) or jpegs.setdefault(quality, make_jpeg(args.width, args.height, quality))
+
+    monitor = LoopLagMonitor().start()
+    now = time.perf_counter()
+    deadline = now + args.ramp + args.duration
+    clients = [LoadClient(i, args, speech, silence, jpeg) for i in range(args.clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        c.run(now + args.ramp * i / max(args.clients, 1), deadline) for i, c in enumerate(clients)
+    ))
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+
+    latencies = [lat for c in clients for lat in c.stats.latencies]
+    total = lambda name: sum(getattr(c.stats, name) for c in clients)
+    report = {
+        "clients": args.clients,
+        "elapsed_s": round(elapsed, 2),
+        "first_response_latency": {**percentiles_ms(latencies), "samples": len(latencies), "missed": total("missed")},
+        "throughput": {
+            "audio_chunks_per_s": round(total("sent_chunks") / elapsed, 1),
+            "image_frames_per_s": round(total("sent_frames") / elapsed, 1),
+            "upstream_mb_per_s": round(total("sent_bytes") / elapsed / 1e6, 3),
+            "responses_per_s": round(total("recv_events") / elapsed, 1),
+            "turns_per_s": round(total("turns") / elapsed, 2),
+            "interruptions": total("interruptions"),
+            "downstream_mb_per_s": round(total("recv_bytes") / elapsed / 1e6, 3),
+        },
+        "video_control": {
+            "events": total("video_controls"),
+            "final_interval_ms": percentiles_ms([c.frame_interval for c in clients]),
+            "final_quality": sorted(c.quality for c in clients)[len(clients) // 2] if clients else None,
+        },
+        "admission": {
+            "rejected": total("rejected"),
+            "queued": sum(bool(c.stats.queue_wait) for c in clients),
+            "queue_wait": percentiles_ms([c.stats.queue_wait for c in clients if c.stats.queue_wait is not None]),
+        },
+        "errors": total("errors"),
+        "client_loop_lag": monitor.summary(),
+        "server": await fetch_server_stats(args.url),
+    }
+    return report
+
+
+async def wait_until_ready(url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            try:
+                async with http.get(f"{url}/stats", timeout=aiohttp.ClientTimeout(total=1)) as resp:
+                    if resp.status == 200:
+                        return
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{timeout}秒待ってもサーバーが起動しませんでした")
+
+
+async def sweep_workers(args):
+    """ワーカー数ごとにサーバーを起動し直して同じ負荷をかける（サーバーは --url のポート 8080 で起動する）"""
+    backend = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    for workers in args.sweep_workers:
+        env = dict(os.environ, WORKERS=str(workers))
+        # 全クライアントが同じIPから来るので、受け入れ制御の上限を外す（環境変数で指定があればそちら）
+        env.setdefault("MAX_SESSIONS_PER_CLIENT", "0")
+        env.setdefault("MAX_UPSTREAM_SESSIONS", str(args.clients * 2))
+        server = subprocess.Popen(
+            [sys.executable, "geminiSession.py"], cwd=backend, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            await wait_until_ready(args.url)
+            report = await run_load(args)
+        finally:
+            server.terminate()
+            try:
+                await asyncio.to_thread(server.wait, 30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        latency = report["first_response_latency"]
+        results.append({
+            "workers": workers,
+            "latency_p50_ms": latency.get("p50_ms"),
+            "latency_p95_ms": latency.get("p95_ms"),
+            "missed": latency["missed"],
+            "responses_per_s": report["throughput"]["responses_per_s"],
+            "turns_per_s": report["throughput"]["turns_per_s"],
+            "errors": report["errors"],
+            "rejected": report["admission"]["rejected"],
+        })
+        print(json.dumps(results[-1], ensure_ascii=False), flush=True)
+    print(json.dumps({"clients": args.clients, "duration_s": args.duration, "sweep": results}, indent=2, ensure_ascii=False))
+
+
+async def main(args):
+    if args.sweep_workers:
+        await sweep_workers(args)
+    else:
+        print(json.dumps(await run_load(args), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--clients", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="ストリーミング時間（秒）")
+    parser.add_argument("--ramp", type=float, default=5, help="全クライアントが接続し終えるまでの時間（秒）")
+    parser.add_argument("--warmup-ms", type=int, default=1000, help="start_session 後、送信開始までの待ち時間")
+    parser.add_argument("--chunk-bytes", type=int, default=2048, help="AudioRecord の1コールバックあたりのバイト数")
+    parser.add_argument("--speech-ms", type=int, default=2000)
+    parser.add_argument("--pause-ms", type=int, default=2500)
+    parser.add_argument("--frame-interval-ms", type=int, default=300, help="0 で画像送信なし")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--jpeg-quality", type=int, default=85)
+    parser.add_argument("--binary", action="store_true", help="base64 JSONの代わりにバイナリ添付で送る")
+    parser.add_argument("--adaptive", action="store_true", help="video_control に従って画像の送信間隔・品質を変える")
+    parser.add_argument("--codec", default="pcm", choices=["pcm", "mulaw", "adpcm"], help="gemini_response のコーデック")
+    parser.add_argument("--container", default="wav", choices=["wav", "raw"], help="gemini_response の送り方")
+    parser.add_argument("--input-rate", type=int, default=16000, help="送る音声のサンプリングレート")
+    parser.add_argument("--output-rate", type=int, default=24000, help="gemini_response のサンプリングレート")
+    parser.add_argument(
+        "--sweep-workers", type=lambda value: [int(n) for n in value.split(",")],
+        help="カンマ区切りのワーカー数（例: 1,2,4）。それぞれ geminiSession.py を WORKERS=N で起動して負荷をかける",
+    )
+    asyncio.run(main(parser.parse_args()))
@@ -4,9 +4,14 @@ import uvicorn
 from google import genai
 import base64
 import asyncio
+import itertools
 from dotenv import load_dotenv
 import os
 
+from services.mockLive import MockLiveClient
+from services.mediaQueue import MediaQueue, pump, DROP_OLDEST
+from utils.debugUtils import play_client_pcm, show_image
+
 
 load_dotenv()
 
@@ -15,69 +20,149 @@ sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*", max_http
 app = FastAPI()
 socket_app = socketio.ASGIApp(sio, app)
 
-# GenAI API 初期化
-client = genai.Client(api_key=os.getenv("API_KEY"), http_options={'api_version': 'v1alpha'})
+# GenAI API 初期化（GEMINI_MOCK_URL が設定されていればローカルのモックサーバーに接続する）
+if mock_url := os.getenv("GEMINI_MOCK_URL"):
+    client = MockLiveClient(mock_url)
+else:
+    client = genai.Client(api_key=os.getenv("API_KEY"), http_options={'api_version': 'v1alpha'})
 model_id = "gemini-2.0-flash-live-001"
 config = {"response_modalities": ["TEXT"]}
-        
+# 受け取った音声・画像をサーバー側で再生・表示するか（デバッグ用）
+DEBUG_SINKS = os.getenv("DEBUG_SINKS", "1") == "1"
+# 再生・表示待ちの上限（溢れたら古いものから捨てる）
+DEBUG_QUEUE_SIZE = int(os.getenv("DEBUG_QUEUE_SIZE", "20"))
+
+# 再生・表示はブロックするので、イベントループではなく別スレッドで1つずつ行う
+debug_queue = MediaQueue(DEBUG_QUEUE_SIZE, DROP_OLDEST)
+
+
+async def run_debug_sink(item):
+    sink, data = item
+    await asyncio.to_thread(sink, data)
+
+
+# sid ごとの Live セッション（切断まで使い回す）
+text_sessions = {}
+# クライアントが request_id を付けなかったときの採番
+request_ids = itertools.count(1)
+
+
+class TextSession:
+    """sid ごとに開いたままにする TEXT モードの Live セッション
+
+    chat_test は受け付けた順にキューに入れ、1つの Live セッションで1ターンずつ処理する
+    （Live API は1セッションで同時に1ターンしか扱えず、応答中に次のターンを送ると中断されるため）。
+    応答には request_id を付けるので、クライアントは複数のリクエストを待たずに送ってよい。
+    """
+
+    def __init__(self, sid):
+        self.sid = sid
+        self._requests = asyncio.Queue()
+        self._task = asyncio.create_task(self._run(), name=f"text_session:{sid}")
+        self.connects = 0
+        self.completed = 0
+        # 処理中のリクエストがあるか / その応答をクライアントへ送り始めたか（送り始めたらやり直さない）
+        self._busy = False
+        self._responded = False
+
+    def submit(self, request_id, data):
+        """キューに入れ、自分より前にあるリクエスト（処理中を含む）の数を返す"""
+        self._requests.put_nowait((request_id, data))
+        return self._requests.qsize() - 1 + self._busy
+
+    async def _next(self):
+        self._busy = False
+        request = await self._requests.get()
+        self._busy = True
+        return request
+
+    async def _run(self):
+        request = await self._next()
+        retry = True
+        while True:
+            try:
+                async with client.aio.live.connect(model=model_id, config=config) as session:
+                    self.connects += 1
+                    print(f"🔗 {self.sid} のLiveセッションを開きました（{self.connects}回目）")
+                    while True:
+                        self._responded = False
+                        await self._handle(session, *request)
+                        self.completed += 1
+                        retry = True
+                        request = await self._next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[Geminiセッションエラー] {e}")
+                # 使い回していた接続が切れていた（タイムアウトなど）なら、つなぎ直して1回だけやり直す
+                if retry and not self._responded:
+                    retry = False
+                    continue
+                await sio.emit("gemini_text_error", {"request_id": request[0], "error": str(e)}, to=self.sid)
+                retry = True
+                request = await self._next()
+
+    async def _handle(self, session, request_id, data):
+        for message in data.get("realtime_input", []):
+            if message["mime_type"] == "audio/pcm":
+                decoded_sound_data = base64.b64decode(message["data"])
+                if DEBUG_SINKS:
+                    await debug_queue.put((play_client_pcm, decoded_sound_data))
+                await session.send(input={"mime_type": "audio/pcm", "data": decoded_sound_data})
+
+            elif message["mime_type"] == "image/jpeg":
+                decoded_image_data = base64.b64decode(message["data"])
+                if DEBUG_SINKS:
+                    await debug_queue.put((show_image, decoded_image_data))
+                await session.send(input={"mime_type": "image/jpeg", "data": decoded_image_data})
+
+        # テキストがあればそれを、なければ送った音声・画像までを1ターンとして応答を求める
+        await session.send(input=data.get("text") or None, end_of_turn=True)
+
+        # receive() は turn_complete までの1ターン分を返す
+        async for response in session.receive():
+            if response.text:
+                self._responded = True
+                await sio.emit("gemini_text", {"request_id": request_id, "text": response.text}, to=self.sid)
+        await sio.emit("gemini_text_end", {"request_id": request_id}, to=self.sid)
+
+    async def close(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+@app.on_event("startup")
+async def on_startup():
+    asyncio.create_task(pump(debug_queue, run_debug_sink, "debug_sink"))
+
+
 @sio.event
 async def connect(sid, environ):
     print(f"✅ クライアント {sid} が接続しました")
 
 # チャットイベントのハンドラ
+# data: {"request_id"?: ..., "text"?: "...", "realtime_input"?: [{"mime_type": ..., "data": "<base64>"}]}
+# 応答: gemini_text {"request_id", "text"} を複数回 → gemini_text_end {"request_id"}
 @sio.event
 async def chat_test(sid, data):
-    try:
-        
-        async with client.aio.live.connect(model=model_id, config=config) as session:
-
-            async def send_to_gemini():
-                try:
-                    for message in data["realtime_input"]:
-                        if message["mime_type"] == "audio/pcm":
-                            decoded_sound_data = base64.b64decode(message["data"])
-                            play_pcm(decoded_sound_data)
-                            await session.send(input={"mime_type": "audio/pcm", "data": decoded_sound_data})
-                            print(f"音声チャンクを送信しました: {decoded_sound_data[:50]}")
-                        
-                        elif message["mime_type"] == "image/jpeg":
-                            decoded_image_data = base64.b64decode(message["data"])
-                            show_image(decoded_image_data)
-                            await session.send(input={"mime_type": "image/jpeg", "data": decoded_image_data})
-                            print(f"画像チャンクを送信しました: {decoded_image_data[:50]}")
-                    
-                except Exception as e:
-                    print(f"[Gemini送信エラー] {e}")
-
-            async def receive_from_gemini():
-                try:
-                    async for response in session.receive():
-                        if response.text:
-                            print(f"[Gemini応答]: {response.text}")
-                            await sio.emit("gemini_text", response.text, to=sid)
-                except Exception as e:
-                    print(f"[Gemini受信エラー] {e}")
-                finally:
-                    await session.close()
-
-            send_task = asyncio.create_task(send_to_gemini())
-            receive_task = asyncio.create_task(receive_from_gemini())
-            await asyncio.gather(send_task, receive_task)
-
-    except Exception as e:
-        print(f"[Geminiセッションエラー] {e}")
-    finally:
-        print("🔚 セッション終了")
-
+    session = text_sessions.get(sid)
+    if session is None:
+        session = text_sessions[sid] = TextSession(sid)
+    request_id = data.get("request_id") or next(request_ids)
+    waiting = session.submit(request_id, data)
+    # ack ですぐに request_id を返し、応答は待たない
+    return {"request_id": request_id, "waiting": waiting}
 
 
 @sio.event
 async def disconnect(sid):
+    if session := text_sessions.pop(sid, None):
+        await session.close()
     print(f"❌ クライアント {sid} が切断しました")
-    
+
 
 # サーバー起動
 if __name__ == "__main__":
     uvicorn.run(socket_app, host="0.0.0.0", port=8080)
 
-# uvicorn main2:socket_app --host 0.0.0.0 --port 8080 --reload
\ No newline at end of file
+# uvicorn sandbox.main2:socket_app --host 0.0.0.0 --port 8080 --reload
@@ -0,0 +1,231 @@
+import argparse
+import asyncio
+import json
+import time
+
+import socketio
+
+from services.mockLive import MockLiveClient, SEND_SAMPLE_RATE
+from services.payload import encode_media
+from services.recorder import Recording, AUDIO_IN, IMAGE_IN, RESPONSE, RESPONSE_END
+from services.resampler import Resampler
+from utils.loopMonitor import LoopLagMonitor, percentiles_ms
+
+# ------------------------------------------------------------------
+# 録画したセッション（services/recorder.py）の再生
+# 録画の send_audio_chunk / send_image_frame を、録画時と同じ間隔（--speed 1）
+# または待ち時間なし（--speed 0）で送り直し、応答の出始めを録画時と比べる。
+#
+#   python -m sandbox.replay recordings/*.rec --url http://localhost:8080
+#   python -m sandbox.replay recordings/*.rec --target mock --url ws://localhost:9100 --speed 0
+#   python -m sandbox.replay recordings/a.rec --clients 50        # 1本の録画を50クライアントで
+# ------------------------------------------------------------------
+
+MODEL_ID = "gemini-2.0-flash-live-001"
+
+
+def response_onsets(recording):
+    """録画内の各ターンで最初の gemini_response が届いた時刻（秒）"""
+    onsets = []
+    in_turn = False
+    for t, kind, _ in recording.frames(RESPONSE, RESPONSE_END):
+        if kind == RESPONSE and not in_turn:
+            onsets.append(t)
+            in_turn = True
+        elif kind == RESPONSE_END:
+            in_turn = False
+    return onsets
+
+
+class ReplayStats:
+    def __init__(self):
+        self.sent_chunks = 0
+        self.sent_frames = 0
+        self.sent_bytes = 0
+        self.recv_events = 0
+        self.recv_bytes = 0
+        self.onsets = []
+        self.errors = 0
+
+
+class Replayer:
+    """1本の録画を1クライアントとして再生する。送信・受信の方法はサブクラスが決める"""
+
+    def __init__(self, index, recording, args):
+        self.index = index
+        self.recording = recording
+        self.args = args
+        self.stats = ReplayStats()
+        self.expected_turns = len(response_onsets(recording))
+        self._started = None
+        self._in_turn = False
+        self._turns_done = asyncio.Event()
+        self._turns = 0
+
+    def elapsed(self):
+        """再生開始からの時間を録画の時間軸に直したもの"""
+        return (time.perf_counter() - self._started) * (self.args.speed or 1)
+
+    def on_response(self, nbytes):
+        self.stats.recv_events += 1
+        self.stats.recv_bytes += nbytes
+        if not self._in_turn:
+            self.stats.onsets.append(self.elapsed())
+            self._in_turn = True
+
+    def on_turn_end(self):
+        self._in_turn = False
+        self._turns += 1
+        if self._turns >= self.expected_turns:
+            self._turns_done.set()
+
+    async def stream(self):
+        """録画の時刻どおりに送る。--speed 0 なら待たずに送る"""
+        speed = self.args.speed
+        for t, kind, data in self.recording.frames(AUDIO_IN, IMAGE_IN):
+            if speed:
+                # 前のフレームからの sleep ではなく開始時刻基準で待つので、遅れが積み重ならない
+                await asyncio.sleep(max(self._started + t / speed - time.perf_counter(), 0))
+            if kind == AUDIO_IN:
+                await self.send_audio(data)
+                self.stats.sent_chunks += 1
+            else:
+                await self.send_image(data)
+                self.stats.sent_frames += 1
+            self.stats.sent_bytes += len(data)
+
+    async def run(self):
+        try:
+            await self.open()
+            self._started = time.perf_counter()
+            await self.stream()
+            # 最後の発話への応答を待つ
+            if not self.expected_turns:
+                return
+            try:
+                await asyncio.wait_for(self._turns_done.wait(), self.args.tail_s)
+            except asyncio.TimeoutError:
+                pass
+        except Exception as e:
+            self.stats.errors += 1
+            print(f"[replay {self.index}] エラー: {e}")
+        finally:
+            await self.close()
+
+
+class ServerReplayer(Replayer):
+    """geminiSession に Socket.IO クライアントとして送る"""
+
+    async def open(self):
+        self.sio = socketio.AsyncClient(reconnection=False)
+        self.sio.on("gemini_response", lambda data: self.on_response(len(data)))
+        self.sio.on("gemini_response_end", lambda data: self.on_turn_end())
+        await self.sio.connect(self.args.url, transports=["websocket"])
+        # 録画時と同じコーデック・レートで始める
+        await self.sio.call("start_session", self.recording.meta, timeout=10)
+        self.seq = 0
+
+    async def send_audio(self, data):
+        self.seq += 1
+        await self.sio.emit("send_audio_chunk", encode_media("audio/pcm", self.seq, data))
+
+    async def send_image(self, data):
+        self.seq += 1
+        await self.sio.emit("send_image_frame", encode_media("image/jpeg", self.seq, data))
+
+    async def close(self):
+        if self.sio.connected:
+            await self.sio.emit("end_session", {})
+            await self.sio.disconnect()
+
+
+class MockReplayer(Replayer):
+    """サーバーを通さず、モックの Gemini Live に直接送る（モデル側だけの負荷・遅延を見る）"""
+
+    async def open(self):
+        self._connection = MockLiveClient(self.args.url).aio.live.connect(
+            model=MODEL_ID, config={"response_modalities": ["AUDIO"]},
+        )
+        self.session = await self._connection.__aenter__()
+        # サーバーと同じく、端末のレートから Gemini のレートへ変換してから送る
+        self.resampler = Resampler(self.recording.meta.get("input_rate") or SEND_SAMPLE_RATE, SEND_SAMPLE_RATE)
+        self._receiver = asyncio.create_task(self.receive())
+
+    async def receive(self):
+        while True:
+            async for response in self.session.receive():
+                if data := response.data:
+                    self.on_response(len(data))
+                if response.server_content and response.server_content.turn_complete:
+                    self.on_turn_end()
+
+    async def send_audio(self, data):
+        if pcm := self.resampler.process(data):
+            await self.session.send(input={"mime_type": "audio/pcm", "data": pcm})
+
+    async def send_image(self, data):
+        await self.session.send(input={"mime_type": "image/jpeg", "data": bytes(data)})
+
+    async def close(self):
+        if hasattr(self, "_receiver"):
+            self._receiver.cancel()
+            await asyncio.gather(self._receiver, return_exceptions=True)
+        if hasattr(self, "_connection"):
+            await self._connection.__aexit__(None, None, None)
+
+
+async def main(args):
+    recordings = [Recording(path) for path in args.recordings]
+    for recording in recordings:
+        print(json.dumps(recording.summary(), ensure_ascii=False))
+
+    replayer_class = MockReplayer if args.target == "mock" else ServerReplayer
+    clients = args.clients or len(recordings)
+    replayers = [replayer_class(i, recordings[i % len(recordings)], args) for i in range(clients)]
+
+    monitor = LoopLagMonitor().start()
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        r.run() for r in replayers
+    ))
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+
+    # 各ターンの応答の出始めが、録画時より何秒遅れたか（--speed 0 では参考値）
+    drifts = []
+    for r in replayers:
+        recorded = response_onsets(r.recording)
+        drifts.extend(replayed - original for original, replayed in zip(recorded, r.stats.onsets))
+
+    total = lambda name: sum(getattr(r.stats, name) for r in replayers)
+    report = {
+        "target": args.target,
+        "speed": args.speed,
+        "clients": clients,
+        "elapsed_s": round(elapsed, 2),
+        "turns": {"recorded": sum(r.expected_turns for r in replayers), "replayed": sum(len(r.stats.onsets) for r in replayers)},
+        "onset_drift": {**percentiles_ms(drifts), "samples": len(drifts)},
+        "throughput": {
+            "audio_chunks_per_s": round(total("sent_chunks") / elapsed, 1),
+            "image_frames_per_s": round(total("sent_frames") / elapsed, 1),
+            "upstream_mb_per_s": round(total("sent_bytes") / elapsed / 1e6, 3),
+            "responses_per_s": round(total("recv_events") / elapsed, 1),
+            "downstream_mb_per_s": round(total("recv_bytes") / elapsed / 1e6, 3),
+        },
+        "errors": total("errors"),
+        "client_loop_lag": monitor.summary(),
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    for recording in recordings:
+        recording.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recordings", nargs="+", help="録画ファイル（.rec）")
+    parser.add_argument("--target", default="server", choices=["server", "mock"], help="送り先（mock はモックの Gemini Live に直接）")
+    parser.add_argument("--url", default="http://localhost:8080", help="server なら http://..., mock なら ws://...")
+    parser.add_argument("--speed", type=float, default=1.0, help="録画時に対する再生速度。0 で待たずに送る")
+    parser.add_argument("--clients", type=int, default=0, help="同時に再生する数（録画を順に割り当てる。0 なら録画の数）")
+    parser.add_argument("--tail-s", type=float, default=10, help="送り終えてから残りの応答を待つ最大時間")
+    asyncio.run(main(parser.parse_args()))
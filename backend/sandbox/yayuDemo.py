@@ -7,6 +7,8 @@ import websockets
 from google import genai
 import base64
 
+from services.toolRegistry import ToolRegistry, Param
+
 # Load API key from environment
 os.environ['GOOGLE_API_KEY'] = ''
 MODEL = "gemini-2.0-flash-exp"  # use your model ID
@@ -18,37 +20,28 @@ client = genai.Client(
 )
 
 
+# Tools are declared once here; the function_declarations sent to Gemini are generated
+# from these schemas (see services/toolRegistry.py).
+registry = ToolRegistry(default_timeout=5.0)
+
+
 # Mock function for set_light_values
+@registry.tool(
+    "Set the brightness and color temperature of a room light.",
+    params=[
+        Param("brightness", "NUMBER", "Light level from 0 to 100. Zero is off and 100 is full brightness"),
+        Param("color_temp", "STRING", "Color temperature of the light fixture, which can be `daylight`, `cool` or `warm`.",
+              enum=("daylight", "cool", "warm")),
+    ],
+    timeout=2.0,
+)
 def set_light_values(brightness, color_temp):
 
     return {
-        "brightness": brightness,
+        "brightness": int(brightness),
         "colorTemperature": color_temp,
     }
 
-# Define the tool (function)
-tool_set_light_values = {
-    "function_declarations": [
-        {
-            "name": "set_light_values",
-            "description": "Set the brightness and color temperature of a room light.",
-            "parameters": {
-                "type": "OBJECT",
-                "properties": {
-                    "brightness": {
-                        "type": "NUMBER",
-                        "description": "Light level from 0 to 100. Zero is off and 100 is full brightness"
-                    },
-                    "color_temp": {
-                        "type": "STRING",
-                        "description": "Color temperature of the light fixture, which can be `daylight`, `cool` or `warm`."
-                    }
-                },
-                "required": ["brightness", "color_temp"]
-            }
-        }
-    ]
-}
 
 async def gemini_session_handler(client_websocket: websockets.WebSocketServerProtocol):
     """Handles the interaction with Gemini API within a websocket session.
@@ -61,7 +54,7 @@ async def gemini_session_handler(client_websocket: websockets.WebSocketServerPro
         config_data = json.loads(config_message)
         config = config_data.get("setup", {})
         
-        config["tools"] = [tool_set_light_values]
+        config["tools"] = registry.tools()
         
         async with client.aio.live.connect(model=MODEL, config=config) as session:
             print("Connected to Gemini API")
@@ -90,6 +83,31 @@ async def gemini_session_handler(client_websocket: websockets.WebSocketServerPro
 
 
 
+            # In-flight tool calls: the tasks running each tool_call, and each function call by id
+            tool_tasks = set()
+            tool_calls = {}
+
+            async def run_tool_call(tool_call):
+                """Runs every function call in one tool_call concurrently and replies once with all results."""
+                for function_call in tool_call.function_calls:
+                    tool_calls[function_call.id] = asyncio.create_task(
+                        registry.call(function_call.name, function_call.args, function_call.id)
+                    )
+                calls = [tool_calls[function_call.id] for function_call in tool_call.function_calls]
+                results = await asyncio.gather(*calls, return_exceptions=True)
+                for function_call in tool_call.function_calls:
+                    tool_calls.pop(function_call.id, None)
+                # Cancelled calls are not answered
+                function_responses = [result for result in results if isinstance(result, dict)]
+                if not function_responses:
+                    return
+                try:
+                    print(f"function_responses: {function_responses}")
+                    await session.send(function_responses)
+                    await client_websocket.send(json.dumps({"text": json.dumps(function_responses)}))
+                except Exception as e:
+                    print(f"Error sending function responses: {e}")
+
             async def receive_from_gemini():
                 """Receives responses from the Gemini API and forwards them to the client, looping until turn is complete."""
                 try:
@@ -101,41 +119,20 @@ async def gemini_session_handler(client_websocket: websockets.WebSocketServerPro
                                 #print(f"response: {response}")
                                 if response.server_content is None:
                                     if response.tool_call is not None:
-                                          #handle the tool call
-                                           print(f"Tool call received: {response.tool_call}")
-
-                                           function_calls = response.tool_call.function_calls
-                                           function_responses = []
-
-                                           for function_call in function_calls:
-                                                 name = function_call.name
-                                                 args = function_call.args
-                                                 # Extract the numeric part from Gemini's function call ID
-                                                 call_id = function_call.id
-
-                                                 # Validate function name
-                                                 if name == "set_light_values":
-                                                      try:
-                                                          result = set_light_values(int(args["brightness"]), args["color_temp"])
-                                                          function_responses.append(
-                                                             {
-                                                                 "name": name,
-                                                                 #"response": {"result": "The light is broken."},
-                                                                 "response": {"result": result},
-                                                                 "id": call_id  
-                                                             }
-                                                          ) 
-                                                          await client_websocket.send(json.dumps({"text": json.dumps(function_responses)}))
-                                                          print("Function executed")
-                                                      except Exception as e:
-                                                          print(f"Error executing function: {e}")
-                                                          continue
-
-
-                                           # Send function response back to Gemini
-                                           print(f"function_responses: {function_responses}")
-                                           await session.send(function_responses)
-                                           continue
+                                        # Run the tools in the background so a slow tool never blocks this loop
+                                        print(f"Tool call received: {response.tool_call}")
+                                        tool_task = asyncio.create_task(run_tool_call(response.tool_call))
+                                        tool_tasks.add(tool_task)
+                                        tool_task.add_done_callback(tool_tasks.discard)
+                                        continue
+
+                                    cancellation = getattr(response, "tool_call_cancellation", None)
+                                    if cancellation is not None:
+                                        # Gemini no longer needs these results (e.g. the user interrupted)
+                                        for call_id in cancellation.ids or []:
+                                            if call_task := tool_calls.pop(call_id, None):
+                                                call_task.cancel()
+                                        continue
 
                                     #print(f'Unhandled server message! - {response}')
                                     #continue
@@ -176,7 +173,11 @@ async def gemini_session_handler(client_websocket: websockets.WebSocketServerPro
             send_task = asyncio.create_task(send_to_gemini())
             # Launch receive loop as a background task
             receive_task = asyncio.create_task(receive_from_gemini())
-            await asyncio.gather(send_task, receive_task)
+            try:
+                await asyncio.gather(send_task, receive_task)
+            finally:
+                for tool_task in list(tool_tasks) + list(tool_calls.values()):
+                    tool_task.cancel()
 
 
     except Exception as e:
@@ -0,0 +1,190 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+# ------------------------------------------------------------------
+# Gemini セッションの受け入れ制御
+# 同時に開く Gemini 接続の数を max_sessions で抑え、溢れた start_session は順番待ちにする。
+# 全員を少しずつ遅くするのではなく、受け入れた人のレイテンシを守り、残りには待ち順を伝える。
+#
+# - 1クライアント（IP など）あたりのセッション数（受け入れ済み + 待ち）は max_per_client まで
+# - 待ち行列はクライアントごとに分け、順番に1つずつ受け入れる（1人が大量に並んでも他の人が待たされない）
+# - 待ちが max_waiting を超える、または wait_timeout 秒待っても入れなければ断る（0 なら待ち続ける）
+#
+#   ticket = admission.enter(client_key)       # 断るなら AdmissionRejected
+#   await ticket.wait(notify)                 # 待ち順が変わるたびに notify(position, waiting)
+#   ...
+#   ticket.release()                          # 何度呼んでもよい
+# ------------------------------------------------------------------
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Ticket:
+    def __init__(self, controller, client):
+        self._controller = controller
+        self.client = client
+        self.created = time.monotonic()
+        self.admitted = False
+        self.released = False
+        # 待ち順（1 が次に入る）。受け入れ済みなら 0
+        self.position = 0
+        self._wake = asyncio.Event()
+
+    async def wait(self, notify=None):
+        """受け入れられるまで待つ。待ち順が変わるたびに notify(position, waiting) を呼ぶ"""
+        wait_timeout = self._controller.wait_timeout
+        notified = None
+        while not self.admitted:
+            # notify の emit 中に受け入れられることがあるので、起こされた印は先に消しておく
+            self._wake.clear()
+            if notify and self.position != notified:
+                notified = self.position
+                await notify(self.position, self._controller.waiting)
+            if self.admitted:
+                break
+            remaining = max(self.created + wait_timeout - time.monotonic(), 0) if wait_timeout else None
+            try:
+                await asyncio.wait_for(self._wake.wait(), remaining)
+            except asyncio.TimeoutError:
+                if not self.admitted:
+                    self._controller.timed_out += 1
+                    self.release()
+                    raise AdmissionRejected("timeout")
+        return time.monotonic() - self.created
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, max_sessions=50, max_per_client=4, max_waiting=100, wait_timeout=60.0):
+        self.max_sessions = max_sessions
+        self.max_per_client = max_per_client
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.active = 0
+        # クライアント → 待っている Ticket（先頭のクライアントから順に1つずつ受け入れる）
+        self._waiting = OrderedDict()
+        # クライアント → 受け入れ済み + 待ちの数
+        self._per_client = {}
+
+        self.admitted_total = 0
+        self.queued_total = 0
+        self.rejected = {}
+        self.timed_out = 0
+
+    @property
+    def waiting(self):
+        return sum(len(queue) for queue in self._waiting.values())
+
+    def enter(self, client):
+        """空きがあればすぐ受け入れ、なければ待ち行列に入れた Ticket を返す"""
+        if self.max_per_client and self._per_client.get(client, 0) >= self.max_per_client:
+            self._reject("per_client_limit")
+        if self.active < self.max_sessions and not self._waiting:
+            ticket = Ticket(self, client)
+            self._admit(ticket)
+        else:
+            if self.waiting >= self.max_waiting:
+                self._reject("queue_full")
+            ticket = Ticket(self, client)
+            self._waiting.setdefault(client, deque()).append(ticket)
+            self.queued_total += 1
+            self._renumber()
+        self._per_client[client] = self._per_client.get(client, 0) + 1
+        return ticket
+
+    def _reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise AdmissionRejected(reason)
+
+    def _admit(self, ticket):
+        ticket.admitted = True
+        ticket.position = 0
+        self.active += 1
+        self.admitted_total += 1
+        ticket._wake.set()
+
+    def _release(self, ticket):
+        count = self._per_client.get(ticket.client, 0) - 1
+        if count > 0:
+            self._per_client[ticket.client] = count
+        else:
+            self._per_client.pop(ticket.client, None)
+
+        if ticket.admitted:
+            self.active -= 1
+        else:
+            queue = self._waiting.get(ticket.client)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._waiting[ticket.client]
+
+        while self._waiting and self.active < self.max_sessions:
+            client, queue = next(iter(self._waiting.items()))
+            self._admit(queue.popleft())
+            if queue:
+                # 次は別のクライアントの番
+                self._waiting.move_to_end(client)
+            else:
+                del self._waiting[client]
+        self._renumber()
+
+    def _renumber(self):
+        """受け入れられる順（クライアントを順に回る）で待ち順を付け直し、変わった Ticket を起こす"""
+        queues = list(self._waiting.values())
+        position = 0
+        for depth in range(max((len(queue) for queue in queues), default=0)):
+            for queue in queues:
+                if depth < len(queue):
+                    position += 1
+                    ticket = queue[depth]
+                    if ticket.position != position:
+                        ticket.position = position
+                        ticket._wake.set()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "max_sessions": self.max_sessions,
+            "waiting": self.waiting,
+            "waiting_clients": len(self._waiting),
+            "admitted_total": self.admitted_total,
+            "queued_total": self.queued_total,
+            "rejected": dict(self.rejected),
+            "timed_out": self.timed_out,
+        }
+
+
+class TokenBucket:
+    """rate / 秒で溜まり、burst まで貯められるトークン。受信チャンクの流量制限に使う"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self.passed = 0
+        self.throttled = 0
+
+    def take(self, amount=1):
+        now = time.monotonic()
+        self._tokens = min(self._tokens + (now - self._updated) * self.rate, self.burst)
+        self._updated = now
+        if amount > self._tokens:
+            self.throttled += 1
+            return False
+        self._tokens -= amount
+        self.passed += 1
+        return True
+
+    def stats(self):
+        return {"rate": self.rate, "burst": self.burst, "passed": self.passed, "throttled": self.throttled}
@@ -1,13 +1,343 @@
-import io
-import wave
+import struct
 import numpy as np
 
-async def pcm_to_wav_bytes(pcm_bytes, sample_rate=24000, channels=1, bits_per_sample=16):
-    with io.BytesIO() as wav_io:
-        with wave.open(wav_io, 'wb') as wav_file:
-            wav_file.setnchannels(channels)
-            wav_file.setsampwidth(bits_per_sample // 8)
-            wav_file.setframerate(sample_rate)
-            wav_file.writeframes(pcm_bytes)
-        wav_bytes = wav_io.getvalue()
-    return wav_bytes
\ No newline at end of file
+# ------------------------------------------------------------------
+# クライアントへ返す音声のコーデック
+#   pcm   : 16bit リニアPCM（そのまま）
+#   mulaw : G.711 μ-law 8bit（1/2）
+#   adpcm : IMA-ADPCM 4bit（約1/4）ブロック単位で独立にデコードできる
+# ------------------------------------------------------------------
+
+CODEC_PCM = "pcm"
+CODEC_MULAW = "mulaw"
+CODEC_ADPCM = "adpcm"
+SUPPORTED_CODECS = (CODEC_PCM, CODEC_MULAW, CODEC_ADPCM)
+
+# WAVの fmt チャンクのフォーマットタグ
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_MULAW = 0x0007
+WAVE_FORMAT_IMA_ADPCM = 0x0011
+
+# クライアントへの送り方
+#   wav : ターンの最初のチャンクにだけ WAV ヘッダーを付け、以降はデータだけを送る。
+#         ターンの終わりに長さを確定したヘッダーを送るので、クライアントは先頭を書き換える
+#   raw : ヘッダーなし（形式は start_session の応答で伝える）
+CONTAINER_WAV = "wav"
+CONTAINER_RAW = "raw"
+SUPPORTED_CONTAINERS = (CONTAINER_WAV, CONTAINER_RAW)
+
+# 長さが未確定のヘッダーに入れる値（ストリーミング再生するプレイヤーはこれを「最後まで」と扱う）
+STREAMING_SIZE = 0xFFFFFFFF
+
+# IMA-ADPCM の1ブロックのバイト数（モノラル: 4バイトのヘッダー + 4bit × (N-1) サンプル）
+# エンコードはブロック内のサンプル数だけループするので、小さめにして1回あたりの処理時間を抑える
+ADPCM_BLOCK_ALIGN = 64
+
+
+def pcm_to_wav_bytes(pcm_bytes, sample_rate=24000, channels=1, bits_per_sample=16):
+    """PCM 全体を1つの WAV にする（ヘッダーを前に付けるだけ）"""
+    return wav_header(CODEC_PCM, sample_rate, len(pcm_bytes), channels, bits_per_sample=bits_per_sample) + pcm_bytes
+
+
+# ---------------------------- μ-law ----------------------------
+
+def _build_mulaw_tables():
+    # ITU-T G.711 の参照実装（14bitに落としてから符号化）と同じ結果になるようにする
+    bias, clip = 0x84, 8159
+    x = np.arange(-32768, 32768, dtype=np.int32) >> 2
+    mask = np.where(x < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(x), clip) + (bias >> 2)
+    segment = np.searchsorted(np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF]), magnitude)
+    code = np.where(segment >= 8, 0x7F, (segment << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    encode = (code ^ mask).astype(np.uint8)
+    # int16 をそのまま uint16 として引けるよう並べ替える（0..32767, -32768..-1）
+    encode = np.roll(encode, -32768)
+
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    magnitude = ((((u & 0x0F) << 3) + bias) << exponent) - bias
+    decode = np.where(u & 0x80, -magnitude, magnitude).astype(np.int16)
+    return encode, decode
+
+
+_MULAW_ENCODE, _MULAW_DECODE = _build_mulaw_tables()
+
+
+def pcm_to_mulaw(pcm_bytes):
+    samples = np.frombuffer(pcm_bytes, dtype="<i2")
+    return _MULAW_ENCODE[samples.view(np.uint16)].tobytes()
+
+
+def mulaw_to_pcm(mulaw_bytes):
+    return _MULAW_DECODE[np.frombuffer(mulaw_bytes, dtype=np.uint8)].astype("<i2").tobytes()
+
+
+# ---------------------------- IMA-ADPCM ----------------------------
+
+_STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767,
+], dtype=np.int32)
+_INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2, dtype=np.int32)
+
+
+def adpcm_samples_per_block(block_align=ADPCM_BLOCK_ALIGN):
+    return (block_align - 4) * 2 + 1
+
+
+def _build_adpcm_tables():
+    # 量子化（ステップ番号 × 差分の大きさ → 4bitコードの下位3bit）と、
+    # 復号側の増分・次のステップ番号（ステップ番号 × 4bitコード）を事前に計算しておく
+    step = _STEP_TABLE[:, None]
+    diff = np.arange(65536, dtype=np.int32)[None, :]
+    code = (diff >= step).astype(np.uint8) * 4
+    diff = diff - (code >> 2) * step
+    half = step >> 1
+    bit = diff >= half
+    code |= bit.astype(np.uint8) * 2
+    diff = diff - bit * half
+    code |= (diff >= (step >> 2)).astype(np.uint8)
+
+    codes = np.arange(16, dtype=np.int32)[None, :]
+    delta = (step >> 3) + (codes & 4 > 0) * step + (codes & 2 > 0) * (step >> 1) + (codes & 1) * (step >> 2)
+    delta = np.where(codes & 8, -delta, delta).astype(np.int32)
+    next_index = np.clip(np.arange(89)[:, None] + _INDEX_TABLE[None, :], 0, 88).astype(np.int32)
+    return code.ravel(), delta.ravel(), next_index.ravel()
+
+
+_ADPCM_QUANT, _ADPCM_DELTA, _ADPCM_NEXT = _build_adpcm_tables()
+
+
+def _initial_step_index(blocks):
+    """ブロック先頭付近の振幅変化から初期ステップを推定する（ブロック間の依存をなくすため）"""
+    head = np.abs(np.diff(blocks[:, :9], axis=1)).mean(axis=1)
+    return np.clip(np.searchsorted(_STEP_TABLE, head * 2), 0, 88).astype(np.int32)
+
+
+def pcm_to_ima_adpcm(pcm_bytes, block_align=ADPCM_BLOCK_ALIGN):
+    """int16 PCM を IMA-ADPCM ブロック列に変換する
+
+    ブロックごとに予測値とステップを持つので、全ブロックを同時に（ベクトル演算で）
+    1サンプルずつ進める。サンプル数がブロック長で割り切れない場合は最後の値で埋める。
+    """
+    spb = adpcm_samples_per_block(block_align)
+    samples = np.frombuffer(pcm_bytes, dtype="<i2").astype(np.int32)
+    if not samples.size:
+        return b""
+    nblocks = -(-samples.size // spb)
+    padded = np.empty(nblocks * spb, dtype=np.int32)
+    padded[:samples.size] = samples
+    padded[samples.size:] = samples[-1]
+    # サンプル位置ごとに全ブロックの値が連続して並ぶよう転置しておく
+    columns = np.ascontiguousarray(padded.reshape(nblocks, spb).T)
+
+    predictor = columns[0].copy()
+    index = _initial_step_index(columns[:9].T)
+    header_index = index.copy()
+    codes = np.empty((spb - 1, nblocks), dtype=np.uint8)
+
+    for i in range(1, spb):
+        diff = columns[i] - predictor
+        code = _ADPCM_QUANT[(index << 16) | np.abs(diff)]
+        code |= (diff < 0).view(np.uint8) << 3
+        flat = (index << 4) | code
+        predictor += _ADPCM_DELTA[flat]
+        np.clip(predictor, -32768, 32767, out=predictor)
+        index = _ADPCM_NEXT[flat]
+        codes[i - 1] = code
+
+    out = np.empty((nblocks, block_align), dtype=np.uint8)
+    out[:, 0:2] = columns[0].astype("<i2").view(np.uint8).reshape(nblocks, 2)
+    out[:, 2] = header_index
+    out[:, 3] = 0
+    # 1バイトに2サンプル、先のサンプルが下位4bit
+    out[:, 4:] = (codes[0::2] | (codes[1::2] << 4)).T
+    return out.tobytes()
+
+
+def ima_adpcm_to_pcm(adpcm_bytes, block_align=ADPCM_BLOCK_ALIGN):
+    spb = adpcm_samples_per_block(block_align)
+    raw = np.frombuffer(adpcm_bytes, dtype=np.uint8).reshape(-1, block_align)
+    predictor = raw[:, 0:2].copy().view("<i2")[:, 0].astype(np.int32)
+    index = raw[:, 2].astype(np.int32)
+    codes = np.empty((raw.shape[0], spb - 1), dtype=np.int32)
+    codes[:, 0::2] = raw[:, 4:] & 0x0F
+    codes[:, 1::2] = raw[:, 4:] >> 4
+
+    out = np.empty((raw.shape[0], spb), dtype=np.int32)
+    out[:, 0] = predictor
+    for i in range(spb - 1):
+        code = codes[:, i]
+        step = _STEP_TABLE[index]
+        vpdiff = (step >> 3) + (code & 4 > 0) * step + (code & 2 > 0) * (step >> 1) + (code & 1) * (step >> 2)
+        predictor = np.clip(np.where(code & 8, predictor - vpdiff, predictor + vpdiff), -32768, 32767)
+        index = np.clip(index + _INDEX_TABLE[code], 0, 88)
+        out[:, i + 1] = predictor
+    return out.astype("<i2").tobytes()
+
+
+# ---------------------------- エンコーダー / WAVヘッダー ----------------------------
+
+class AudioEncoder:
+    """セッションごとのエンコーダー。ADPCM はブロックに満たない端数を次回まで持ち越す"""
+
+    def __init__(self, codec=CODEC_PCM, block_align=ADPCM_BLOCK_ALIGN):
+        if codec not in SUPPORTED_CODECS:
+            raise ValueError(f"未対応のコーデック: {codec}")
+        self.codec = codec
+        self.block_align = block_align
+        self._block_bytes = adpcm_samples_per_block(block_align) * 2
+        self._pending = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def encode(self, pcm_bytes):
+        self.bytes_in += len(pcm_bytes)
+        if self.codec == CODEC_PCM:
+            out = bytes(pcm_bytes)
+        elif self.codec == CODEC_MULAW:
+            out = pcm_to_mulaw(pcm_bytes)
+        else:
+            self._pending += pcm_bytes
+            usable = len(self._pending) - len(self._pending) % self._block_bytes
+            if not usable:
+                return b""
+            out = pcm_to_ima_adpcm(bytes(self._pending[:usable]), self.block_align)
+            del self._pending[:usable]
+        self.bytes_out += len(out)
+        return out
+
+    def flush(self):
+        """持ち越している端数を（最後の値で埋めて）出力する"""
+        if not self._pending:
+            return b""
+        out = pcm_to_ima_adpcm(bytes(self._pending), self.block_align)
+        self._pending.clear()
+        self.bytes_out += len(out)
+        return out
+
+    def reset(self):
+        self._pending.clear()
+
+    def describe(self, sample_rate):
+        """start_session の応答でクライアントに伝える内容"""
+        info = {"codec": self.codec, "sample_rate": sample_rate, "channels": 1}
+        if self.codec == CODEC_ADPCM:
+            info["block_align"] = self.block_align
+            info["samples_per_block"] = adpcm_samples_per_block(self.block_align)
+        return info
+
+    def stats(self):
+        return {
+            "codec": self.codec,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0,
+        }
+
+
+def wav_header(codec, sample_rate, data_bytes=None, channels=1, block_align=ADPCM_BLOCK_ALIGN, bits_per_sample=16):
+    """コーデックに合ったフォーマットタグを持つ WAV ヘッダーを作る
+
+    data_bytes が None なら長さ未確定（ストリーミング用）のヘッダーになる。
+    どちらでもヘッダーの長さは同じなので、後から先頭を上書きして確定できる。
+    """
+    if codec == CODEC_PCM:
+        frame_bytes = channels * bits_per_sample // 8
+        fmt = struct.pack("<HHIIHH", WAVE_FORMAT_PCM, channels, sample_rate, sample_rate * frame_bytes, frame_bytes, bits_per_sample)
+        samples = None
+    elif codec == CODEC_MULAW:
+        fmt = struct.pack("<HHIIHHH", WAVE_FORMAT_MULAW, channels, sample_rate, sample_rate * channels, channels, 8, 0)
+        samples = data_bytes // channels if data_bytes is not None else 0
+    elif codec == CODEC_ADPCM:
+        spb = adpcm_samples_per_block(block_align)
+        byte_rate = sample_rate * block_align // spb
+        fmt = struct.pack("<HHIIHHHH", WAVE_FORMAT_IMA_ADPCM, channels, sample_rate, byte_rate, block_align, 4, 2, spb)
+        samples = data_bytes // block_align * spb if data_bytes is not None else 0
+    else:
+        raise ValueError(f"未対応のコーデック: {codec}")
+
+    fact = b"fact" + struct.pack("<II", 4, samples) if samples is not None else b""
+    data_size = STREAMING_SIZE if data_bytes is None else data_bytes
+    body = b"WAVE" + b"fmt " + struct.pack("<I", len(fmt)) + fmt + fact + b"data" + struct.pack("<I", data_size)
+    riff_size = STREAMING_SIZE if data_bytes is None else len(body) + data_bytes
+    return b"RIFF" + struct.pack("<I", riff_size) + body
+
+
+def encoded_to_wav_bytes(data, codec, sample_rate=24000, block_align=ADPCM_BLOCK_ALIGN):
+    return wav_header(codec, sample_rate, len(data), block_align=block_align) + data
+
+
+class WavStreamWriter:
+    """セッションごとのストリーミング出力
+
+    以前のデータを保持・コピーせず、渡されたチャンクをそのまま返す。
+    wav ではターンの最初のチャンクにだけ長さ未確定のヘッダーを付け、
+    finalize() で長さを確定したヘッダー（同じバイト数）を返す。
+    """
+
+    def __init__(self, codec=CODEC_PCM, sample_rate=24000, container=CONTAINER_WAV, block_align=ADPCM_BLOCK_ALIGN):
+        if container not in SUPPORTED_CONTAINERS:
+            raise ValueError(f"未対応のコンテナ: {container}")
+        self.codec = codec
+        self.sample_rate = sample_rate
+        self.container = container
+        self.block_align = block_align
+        self.turn_bytes = 0
+        self._header_sent = False
+
+        self.turns = 0
+        self.aborted_turns = 0
+        self.chunks = 0
+        self.bytes_out = 0
+
+    def write(self, data):
+        """送るバイト列を返す（wav でターンの最初なら先頭にヘッダーが付く）"""
+        if not data:
+            return b""
+        self.chunks += 1
+        self.turn_bytes += len(data)
+        if self.container == CONTAINER_WAV and not self._header_sent:
+            self._header_sent = True
+            data = wav_header(self.codec, self.sample_rate, block_align=self.block_align) + data
+        self.bytes_out += len(data)
+        return data
+
+    def finalize(self):
+        """ターンを終える。wav なら長さを確定したヘッダーを返す（音声がなかったターンや raw では None）"""
+        header = None
+        if self._header_sent:
+            header = wav_header(self.codec, self.sample_rate, self.turn_bytes, block_align=self.block_align)
+        if self.turn_bytes:
+            self.turns += 1
+        self.turn_bytes = 0
+        self._header_sent = False
+        return header
+
+    def abort(self):
+        """ターンを途中で打ち切る（割り込み時）。次の write() は新しいヘッダーから始める"""
+        if self.turn_bytes:
+            self.aborted_turns += 1
+        self.turn_bytes = 0
+        self._header_sent = False
+
+    def describe(self):
+        info = {"container": self.container}
+        if self.container == CONTAINER_WAV:
+            info["header_bytes"] = len(wav_header(self.codec, self.sample_rate, block_align=self.block_align))
+        return info
+
+    def stats(self):
+        return {
+            "container": self.container,
+            "turns": self.turns,
+            "aborted_turns": self.aborted_turns,
+            "chunks": self.chunks,
+            "bytes_out": self.bytes_out,
+            "turn_bytes": self.turn_bytes,
+        }
@@ -0,0 +1,98 @@
+import asyncio
+
+# ------------------------------------------------------------------
+# 受信した 16kHz int16 PCM を固定長フレームに詰め直してから Gemini に送る
+# AudioRecord のコールバック単位（サイズはまちまち）で送ると、小さな
+# WebSocket 書き込みが大量に発生するため。
+# Gemini から届く細切れの 24kHz PCM をまとめて emit する用途にも使う
+# ------------------------------------------------------------------
+
+SAMPLE_WIDTH = 2
+
+
+class PcmFramer:
+    """サイズしきい値（frame_ms 分）または期限（max_delay_ms）のどちらかで送信する"""
+
+    def __init__(self, send, sample_rate=16000, frame_ms=100, max_delay_ms=None, frame_bytes=None):
+        self._send = send
+        self.frame_bytes = frame_bytes or sample_rate * frame_ms // 1000 * SAMPLE_WIDTH
+        self.frame_bytes -= self.frame_bytes % SAMPLE_WIDTH
+        self.max_delay = (max_delay_ms if max_delay_ms is not None else frame_ms) / 1000
+        self._buf = bytearray()
+        self._timer = None
+        # 送信順序を保つため、送信は常にロックの中で行う
+        self._lock = asyncio.Lock()
+
+        self.chunks_in = 0
+        self.frames_sent = 0
+        self.bytes_coalesced = 0
+        self.deadline_flushes = 0
+        self.bytes_discarded = 0
+
+    async def push(self, pcm):
+        self.chunks_in += 1
+        self._buf += pcm
+        if len(self._buf) >= self.frame_bytes:
+            # 残りは今回のチャンクの一部なので、期限もここから数え直す
+            self._cancel_timer()
+        while len(self._buf) >= self.frame_bytes:
+            frame = bytes(self._buf[:self.frame_bytes])
+            del self._buf[:self.frame_bytes]
+            await self._emit(frame)
+
+        if self._buf and self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after(self.max_delay))
+
+    async def _flush_after(self, delay):
+        await asyncio.sleep(delay)
+        self._timer = None
+        if self._buf:
+            self.deadline_flushes += 1
+            await self.flush()
+
+    async def flush(self):
+        """バッファに残っている分をサンプル境界で切って送る"""
+        self._cancel_timer()
+        size = len(self._buf) - len(self._buf) % SAMPLE_WIDTH
+        if size:
+            frame = bytes(self._buf[:size])
+            del self._buf[:size]
+            await self._emit(frame)
+
+    async def _emit(self, frame):
+        async with self._lock:
+            await self._send(frame)
+        self.frames_sent += 1
+        self.bytes_coalesced += len(frame)
+
+    async def discard(self):
+        """バッファに残っている分を送らずに捨て、捨てたバイト数を返す
+
+        送信中のフレームがあれば送り終わるまで待つので、戻った後に古いフレームが送られることはない。
+        """
+        self._cancel_timer()
+        dropped = len(self._buf)
+        self._buf.clear()
+        async with self._lock:
+            pass
+        self.bytes_discarded += dropped
+        return dropped
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def close(self):
+        self._cancel_timer()
+        self._buf.clear()
+
+    def stats(self):
+        return {
+            "chunks_in": self.chunks_in,
+            "frames_sent": self.frames_sent,
+            "bytes_coalesced": self.bytes_coalesced,
+            "deadline_flushes": self.deadline_flushes,
+            "bytes_discarded": self.bytes_discarded,
+            "buffered_bytes": len(self._buf),
+        }
@@ -0,0 +1,369 @@
+import asyncio
+import itertools
+import os
+import pickle
+import re
+import signal
+import struct
+import subprocess
+import sys
+import tempfile
+from urllib.parse import parse_qs, urlsplit
+
+from socketio.async_manager import AsyncManager
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+from utils.structuredLog import get_logger, setup_logging, shutdown_logging
+
+# ------------------------------------------------------------------
+# マルチプロセス構成（WORKERS=N で起動）
+#
+#   クライアント ──TCP──▶ ルーター（親プロセス） ──unix socket──▶ ワーカー i（uvicorn）
+#
+# - sid の先頭にワーカー番号を入れる（"3.xxxx"）。ルーターはHTTPリクエストの
+#   sid を見て持ち主のワーカーへつなぐ（sid がなければ接続数の少ないワーカーへ）
+#   TCP接続ごとではなくリクエストごとに振り分けるため、WebSocket 以外のリクエストには
+#   Connection: close を付けて keep-alive で別の sid のリクエストが同じ接続に乗らないようにする
+# - 他のワーカーが持つ sid への emit などは、親プロセスのブローカー（unix socket）経由で届ける
+#   自分が持つ sid への emit はブローカーを通さない
+# ------------------------------------------------------------------
+
+log = get_logger("cluster")
+
+# ブローカーのフレーム: 長さ(4) + 宛先ワーカー(1) + pickle したメッセージ
+FRAME = struct.Struct("<IB")
+BROADCAST = 0xFF
+MAX_WORKERS = BROADCAST
+
+# engine.io の generate_id は 15 バイトを base64url にした 20 文字
+_SID_RE = re.compile(r"^(\d+)\.[A-Za-z0-9_-]{20}$")
+
+
+def worker_socket_path(run_dir, worker_id):
+    return os.path.join(run_dir, f"worker{worker_id}.sock")
+
+
+def broker_socket_path(run_dir):
+    return os.path.join(run_dir, "broker.sock")
+
+
+def owner_of(sid):
+    """sid を持っているワーカーの番号（このクラスタの sid でなければ None）"""
+    if not isinstance(sid, str):
+        return None
+    match = _SID_RE.match(sid)
+    return int(match.group(1)) if match else None
+
+
+def pin_sids(server, worker_id):
+    """engine.io / Socket.IO の sid にワーカー番号を付ける"""
+    generate = server.eio.generate_id
+    server.eio.generate_id = lambda: f"{worker_id}.{generate()}"
+
+
+# ---------------------------- ワーカー側 ----------------------------
+
+class LocalPubSubManager(AsyncPubSubManager):
+    """親プロセスのブローカーを pub/sub の代わりに使う Socket.IO マネージャー"""
+
+    name = "localpubsub"
+
+    def __init__(self, broker_path, worker_id, channel="socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.broker_path = broker_path
+        self.worker_id = worker_id
+        self._reader = None
+        self._writer = None
+        self._connecting = asyncio.Lock()
+
+        self.local_emits = 0
+        self.published = 0
+        self.received = 0
+
+    async def _connect(self):
+        async with self._connecting:
+            if self._writer is None:
+                self._reader, self._writer = await asyncio.open_unix_connection(self.broker_path)
+                # 最初のフレームで自分の番号を名乗る
+                self._writer.write(FRAME.pack(0, self.worker_id))
+                await self._writer.drain()
+
+    async def emit(self, event, data, namespace=None, room=None, skip_sid=None, callback=None, to=None, **kwargs):
+        room = to or room
+        if owner_of(room) == self.worker_id:
+            # 自分が持っている sid 宛て：他のワーカーに知らせる必要はない
+            self.local_emits += 1
+            return await AsyncManager.emit(
+                self, event, data, namespace=namespace, room=room, skip_sid=skip_sid, callback=callback,
+            )
+        return await super().emit(
+            event, data, namespace=namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs,
+        )
+
+    async def _publish(self, data):
+        # sid 宛てならそのワーカーにだけ送り、部屋・全体宛てなら全ワーカーへ
+        target = None
+        if data.get("method") in ("emit", "disconnect", "enter_room", "leave_room"):
+            target = owner_of(data.get("room") or data.get("sid"))
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        if self._writer is None:
+            await self._connect()
+        self._writer.write(FRAME.pack(len(payload), BROADCAST if target is None else target) + payload)
+        await self._writer.drain()
+        self.published += 1
+
+    async def _listen(self):
+        if self._reader is None:
+            await self._connect()
+        while True:
+            size, _ = FRAME.unpack(await self._reader.readexactly(FRAME.size))
+            message = pickle.loads(await self._reader.readexactly(size))
+            self.received += 1
+            yield message
+
+    def stats(self):
+        return {
+            "worker_id": self.worker_id,
+            "local_emits": self.local_emits,
+            "published": self.published,
+            "received": self.received,
+        }
+
+
+# ---------------------------- 親プロセス側 ----------------------------
+
+class Broker:
+    """ワーカー間のメッセージを宛先のワーカー（または送信元以外の全ワーカー）へ転送する"""
+
+    def __init__(self, path):
+        self.path = path
+        self._workers = {}
+        self._server = None
+        self.forwarded = 0
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._handle, self.path)
+
+    async def _handle(self, reader, writer):
+        worker_id = None
+        try:
+            _, worker_id = FRAME.unpack(await reader.readexactly(FRAME.size))
+            self._workers[worker_id] = writer
+            while True:
+                header = await reader.readexactly(FRAME.size)
+                size, target = FRAME.unpack(header)
+                frame = header + await reader.readexactly(size)
+                if target == BROADCAST:
+                    peers = [w for wid, w in self._workers.items() if wid != worker_id]
+                else:
+                    peers = [self._workers[target]] if target in self._workers else []
+                for peer in peers:
+                    peer.write(frame)
+                    await peer.drain()
+                self.forwarded += 1
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self._workers.get(worker_id) is writer:
+                del self._workers[worker_id]
+            writer.close()
+
+    def close(self):
+        if self._server:
+            self._server.close()
+
+
+class StickyRouter:
+    """HTTPリクエストの sid で振り分け、以降はバイト列をそのまま中継する
+
+    WebSocket へのアップグレードはその接続ごと1つのワーカーにつなぐ。それ以外（ポーリングなど）は
+    Connection: close にして1リクエストで接続を閉じさせ、次のリクエストはまた sid で振り分ける。
+    Socket.IO 以外のリクエスト（/stats, /metrics など）は ?worker=N で宛先を選べる。
+    """
+
+    def __init__(self, run_dir, workers, drain_timeout=5.0):
+        self.run_dir = run_dir
+        self.workers = workers
+        # クライアントが送信側だけ閉じた後、ワーカーの応答を待つ秒数
+        self.drain_timeout = drain_timeout
+        self._connections = set()
+        self.active = [0] * workers
+        self.routed_by_sid = 0
+        self.routed_new = 0
+        self.closed_after_request = 0
+        self._round_robin = itertools.cycle(range(workers))
+
+    def _pick(self, target):
+        path = urlsplit(target)
+        query = parse_qs(path.query)
+        owner = owner_of(query.get("sid", [None])[0])
+        if owner is not None and owner < self.workers:
+            self.routed_by_sid += 1
+            return owner
+        if "worker" in query and query["worker"][0].isdigit() and int(query["worker"][0]) < self.workers:
+            return int(query["worker"][0])
+        self.routed_new += 1
+        # 接続数が最も少ないワーカー（同数なら順番）
+        fewest = min(self.active)
+        for _ in range(self.workers):
+            candidate = next(self._round_robin)
+            if self.active[candidate] == fewest:
+                return candidate
+        return 0
+
+    async def handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        upstream = None
+        worker = None
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            request_line, _, rest = head.partition(b"\r\n")
+            parts = request_line.split(b" ")
+            if len(parts) != 3:
+                return
+            worker = self._pick(parts[1].decode("latin-1"))
+            self.active[worker] += 1
+            # 送信元のアドレスをワーカーに伝える（ワーカーは unix socket 越しにしか見えないため）
+            peer = writer.get_extra_info("peername")
+            forwarded = f"X-Forwarded-For: {peer[0]}\r\n".encode() if peer else b""
+            up_reader, upstream = await asyncio.open_unix_connection(worker_socket_path(self.run_dir, worker))
+            if not _is_upgrade(rest):
+                rest = _force_close(rest)
+                self.closed_after_request += 1
+            upstream.write(request_line + b"\r\n" + forwarded + rest)
+            await self._relay(reader, upstream, up_reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, FileNotFoundError):
+            pass
+        except asyncio.CancelledError:
+            # close() で止めた。asyncio.start_server のコールバックはキャンセルされたタスクを想定していないので、普通に終える
+            pass
+        finally:
+            self._connections.discard(task)
+            if worker is not None:
+                self.active[worker] -= 1
+            for w in (upstream, writer):
+                if w is not None:
+                    w.close()
+
+    async def _relay(self, reader, upstream, up_reader, writer):
+        """どちらかの向きが終わったら、もう一方も止める（両方の EOF を待つと、片側が残った接続が漏れる）"""
+        to_worker = asyncio.create_task(_pipe(reader, upstream))
+        to_client = asyncio.create_task(_pipe(up_reader, writer))
+        try:
+            done, _ = await asyncio.wait((to_worker, to_client), return_when=asyncio.FIRST_COMPLETED)
+            if to_client not in done:
+                # クライアントが送信側だけ閉じた：送った分の応答はしばらく待って返す
+                await asyncio.wait((to_client,), timeout=self.drain_timeout)
+        finally:
+            for pipe in (to_worker, to_client):
+                pipe.cancel()
+            await asyncio.gather(to_worker, to_client, return_exceptions=True)
+
+    async def close(self):
+        """中継中の接続を全て閉じる"""
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+
+def _header_lines(headers):
+    return headers[:-4].split(b"\r\n") if headers.endswith(b"\r\n\r\n") else headers.split(b"\r\n")
+
+
+def _is_upgrade(headers):
+    for line in _header_lines(headers):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"connection" and b"upgrade" in value.lower():
+            return True
+    return False
+
+
+def _force_close(headers):
+    """Connection / Keep-Alive ヘッダーを Connection: close に置き換える（レスポンス後にワーカーが接続を閉じる）"""
+    lines = [
+        line for line in _header_lines(headers)
+        if line and line.partition(b":")[0].strip().lower() not in (b"connection", b"keep-alive")
+    ]
+    return b"".join(line + b"\r\n" for line in lines) + b"Connection: close\r\n\r\n"
+
+
+async def _pipe(reader, writer):
+    try:
+        while data := await reader.read(65536):
+            writer.write(data)
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        if writer.can_write_eof():
+            try:
+                writer.write_eof()
+            except OSError:
+                pass
+
+
+async def _supervise(workers, host, port, script):
+    run_dir = tempfile.mkdtemp(prefix="live-cluster-")
+    broker = Broker(broker_socket_path(run_dir))
+    await broker.start()
+    router = StickyRouter(run_dir, workers)
+
+    env = dict(os.environ, CLUSTER_DIR=run_dir)
+    # 画像処理のプロセスプールはワーカーで分け合う
+    env.setdefault("IMAGE_WORKERS", str(max((os.cpu_count() or 1) // workers, 1)))
+    procs = {}
+    stopping = asyncio.Event()
+
+    def spawn(worker_id):
+        procs[worker_id] = subprocess.Popen([sys.executable, script], env=dict(env, WORKER_ID=str(worker_id)))
+        log.info("worker_started", worker=worker_id, pid=procs[worker_id].pid)
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+    # ワーカーの unix socket ができるまで待ってから受け付ける
+    while not all(os.path.exists(worker_socket_path(run_dir, i)) for i in range(workers)):
+        await asyncio.sleep(0.1)
+    server = await asyncio.start_server(router.handle, host, port, limit=65536)
+    log.info("cluster_listening", host=host, port=port, workers=workers, run_dir=run_dir)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    try:
+        while not stopping.is_set():
+            # 落ちたワーカーは作り直す（そのワーカーのセッションは失われ、クライアントは再接続する）
+            for worker_id, proc in list(procs.items()):
+                if proc.poll() is not None:
+                    log.warning("worker_exited", worker=worker_id, code=proc.returncode)
+                    spawn(worker_id)
+            try:
+                await asyncio.wait_for(stopping.wait(), 1.0)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        server.close()
+        await router.close()
+        broker.close()
+        for proc in procs.values():
+            proc.terminate()
+        for proc in procs.values():
+            try:
+                await asyncio.to_thread(proc.wait, 10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        for name in os.listdir(run_dir):
+            os.unlink(os.path.join(run_dir, name))
+        os.rmdir(run_dir)
+
+
+def run_cluster(workers, host, port, script):
+    """ルーターとブローカーをこのプロセスで動かし、script をワーカーとして workers 個起動する"""
+    if not 1 <= workers < MAX_WORKERS:
+        raise ValueError(f"ワーカー数は 1〜{MAX_WORKERS - 1} にしてください: {workers}")
+    setup_logging()
+    try:
+        asyncio.run(_supervise(workers, host, port, script))
+    finally:
+        shutdown_logging()
@@ -0,0 +1,86 @@
+import asyncio
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+# ------------------------------------------------------------------
+# カメラフレームの間引き
+# 300ms ごとに届く JPEG のうち、前回送ったフレームとほぼ同じものは送らない。
+# 判定には dHash（縮小グレースケール画像の横方向の明暗差 64bit）を使う。
+# ------------------------------------------------------------------
+
+HASH_SIZE = 8
+
+
+def dhash(jpeg_bytes, hash_size=HASH_SIZE):
+    img = Image.open(io.BytesIO(jpeg_bytes))
+    # JPEG はデコード時に 1/2〜1/8 に縮小できるので、フル解像度では展開しない
+    img.draft("L", (hash_size * 8, hash_size * 8))
+    pixels = np.asarray(img.convert("L").resize((hash_size + 1, hash_size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class FrameGate:
+    """最小送信間隔とハッシュ距離のしきい値でフレームを通すか決める"""
+
+    def __init__(self, threshold=5, min_interval_ms=1000, max_skip_ms=10000):
+        # ハミング距離がこの値以下なら「同じ画面」とみなす（0〜64）
+        self.threshold = threshold
+        self.min_interval = min_interval_ms / 1000
+        # 画面が変わらなくても、この間隔ごとには送る（0 なら無効）
+        self.max_skip = max_skip_ms / 1000
+        self._last_hash = None
+        self._last_sent = 0.0
+
+        self.frames_in = 0
+        self.frames_sent = 0
+        self.skipped_interval = 0
+        self.skipped_duplicate = 0
+        self.hash_errors = 0
+
+    async def admit(self, jpeg_bytes):
+        self.frames_in += 1
+        now = time.monotonic()
+        elapsed = now - self._last_sent
+        if elapsed < self.min_interval:
+            self.skipped_interval += 1
+            return False
+
+        try:
+            frame_hash = await asyncio.to_thread(dhash, jpeg_bytes)
+        except Exception:
+            # 判定できないフレームはそのまま通す
+            self.hash_errors += 1
+            frame_hash = None
+
+        if (
+            frame_hash is not None
+            and self._last_hash is not None
+            and hamming(frame_hash, self._last_hash) <= self.threshold
+            and not (self.max_skip and elapsed >= self.max_skip)
+        ):
+            self.skipped_duplicate += 1
+            return False
+
+        self._last_hash = frame_hash
+        self._last_sent = now
+        self.frames_sent += 1
+        return True
+
+    def stats(self):
+        skipped = self.skipped_interval + self.skipped_duplicate
+        return {
+            "frames_in": self.frames_in,
+            "frames_sent": self.frames_sent,
+            "skipped_interval": self.skipped_interval,
+            "skipped_duplicate": self.skipped_duplicate,
+            "skip_ratio": round(skipped / self.frames_in, 3) if self.frames_in else 0.0,
+            "hash_errors": self.hash_errors,
+        }
@@ -0,0 +1,106 @@
+import asyncio
+
+# ------------------------------------------------------------------
+# カメラフレームの送信間隔・JPEG品質の調整（AIMD）
+# 上り（Gemini への送信）が詰まり始めたら、フレームレートを大きく（乗算で）下げて品質も下げ、
+# 余裕があれば少しずつ（加算で）戻す。音声を優先し、音声の遅れが予算内に収まるよう映像を削る。
+#
+# 詰まりの判定:
+#   - 音声の遅れ（audio_in キューに溜まっている音声の長さ + 送信にかかっている時間
+#     + イベントループの遅延）が予算を超えた
+#   - 画像の送信に、今の送信間隔より長くかかっている
+#   - 画像がキューや正規化待ちで捨てられた
+# ------------------------------------------------------------------
+
+
+class FrameRateController:
+    def __init__(self, min_interval_ms=300, max_interval_ms=5000, min_quality=30, max_quality=70,
+                 audio_budget_ms=200, increase_fps=0.25, decrease_factor=0.5, quality_step=10, smoothing=0.3):
+        self.max_rate = 1000 / min_interval_ms
+        self.min_rate = 1000 / max_interval_ms
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.audio_budget_ms = audio_budget_ms
+        self.increase_fps = increase_fps
+        self.decrease_factor = decrease_factor
+        self.quality_step = quality_step
+        self.smoothing = smoothing
+
+        # 端末の今の送信間隔（300ms）・品質から始める
+        self.rate = self.max_rate
+        self.quality = max_quality
+        # 送信時間の指数移動平均（秒）
+        self.audio_send = 0.0
+        self.image_send = 0.0
+        self.audio_delay_ms = 0.0
+        self._last_dropped = 0
+        # 最後にクライアントへ伝えた値（最初は端末がもともと使っている設定）
+        self._notified = self.settings()
+
+        self.increases = 0
+        self.decreases = 0
+        self.notifications = 0
+
+    @property
+    def notified_interval_ms(self):
+        """クライアントに最後に伝えた送信間隔"""
+        return self._notified["interval_ms"]
+
+    def observe_audio_send(self, seconds):
+        self.audio_send += self.smoothing * (seconds - self.audio_send)
+
+    def observe_image_send(self, seconds):
+        self.image_send += self.smoothing * (seconds - self.image_send)
+
+    @property
+    def interval_ms(self):
+        return round(1000 / self.rate)
+
+    def settings(self):
+        return {"interval_ms": self.interval_ms, "quality": self.quality}
+
+    def update(self, queued_audio_ms, dropped_frames, loop_lag_ms=0.0):
+        """定期的に呼ぶ。クライアントに伝えるべき変化があれば新しい設定を返す"""
+        self.audio_delay_ms = queued_audio_ms + self.audio_send * 1000 + loop_lag_ms
+        dropped = dropped_frames - self._last_dropped
+        self._last_dropped = dropped_frames
+
+        if self.audio_delay_ms > self.audio_budget_ms or self.image_send * 1000 > self.interval_ms or dropped > 0:
+            self.rate = max(self.rate * self.decrease_factor, self.min_rate)
+            self.quality = max(self.quality - self.quality_step, self.min_quality)
+            self.decreases += 1
+        elif self.rate < self.max_rate:
+            # 先にフレームレートを戻し、戻りきってから品質を戻す
+            self.rate = min(self.rate + self.increase_fps, self.max_rate)
+            self.increases += 1
+        elif self.quality < self.max_quality:
+            self.quality = min(self.quality + self.quality_step // 2, self.max_quality)
+            self.increases += 1
+
+        # 間隔が1割以上、または品質が変わったときだけ知らせる（細かい変化でイベントを増やさない）
+        settings = self.settings()
+        last = self._notified
+        if (abs(settings["interval_ms"] - last["interval_ms"]) < last["interval_ms"] * 0.1
+                and settings["quality"] == last["quality"]):
+            return None
+        self._notified = settings
+        self.notifications += 1
+        return settings
+
+    async def run(self, period, sample, notify):
+        """period 秒ごとに sample() = (溜まっている音声のms, 捨てた画像の累計, ループ遅延のms) で更新し、変化を notify する"""
+        while True:
+            await asyncio.sleep(period)
+            if settings := self.update(*sample()):
+                await notify(settings)
+
+    def stats(self):
+        return {
+            **self.settings(),
+            "audio_delay_ms": round(self.audio_delay_ms, 1),
+            "audio_send_ms": round(self.audio_send * 1000, 2),
+            "image_send_ms": round(self.image_send * 1000, 2),
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "notifications": self.notifications,
+        }
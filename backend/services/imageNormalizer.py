@@ -0,0 +1,110 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from utils.structuredLog import get_logger
+
+# ------------------------------------------------------------------
+# 受信した JPEG を長辺 max_edge に縮小し、指定品質で再エンコードする
+# デコードはCPUを食うのでプロセスプールで行い、Socket.IOのイベントループを止めない
+# ------------------------------------------------------------------
+
+log = get_logger("media")
+
+_pool = None
+
+
+def get_pool(workers=None):
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def normalize_jpeg(data, max_edge=1024, quality=70):
+    """プロセスプール側で実行される。元より大きくなる場合は元データを返す"""
+    img = Image.open(io.BytesIO(data))
+    original_edge = max(img.size)
+    # 縮小後のサイズに近い解像度で DCT 段階からデコードする
+    img.draft("RGB", (max_edge, max_edge))
+    img = img.convert("RGB")
+    img.thumbnail([max_edge, max_edge])
+
+    image_io = io.BytesIO()
+    img.save(image_io, format="jpeg", quality=quality)
+    result = image_io.getvalue()
+    if len(result) >= len(data) and original_edge <= max_edge:
+        return data
+    return result
+
+
+class FrameNormalizer:
+    """セッションごとに1枚ずつ正規化する。処理待ちの古いフレームは新しいフレームで置き換える"""
+
+    def __init__(self, send, max_edge=1024, quality=70, pool=None, sid=None):
+        self._send = send
+        self.sid = sid
+        self.max_edge = max_edge
+        self.quality = quality
+        self._pool = pool
+        self._pending = None
+        self._worker = None
+
+        self.frames_in = 0
+        self.frames_out = 0
+        self.dropped_stale = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def submit(self, jpeg_bytes):
+        self.frames_in += 1
+        if self._pending is not None:
+            self.dropped_stale += 1
+        self._pending = jpeg_bytes
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        pool = self._pool or get_pool()
+        try:
+            while self._pending is not None:
+                frame, self._pending = self._pending, None
+                try:
+                    normalized = await loop.run_in_executor(pool, normalize_jpeg, frame, self.max_edge, self.quality)
+                except Exception as e:
+                    self.errors += 1
+                    log.warning("image_normalize_failed", sid=self.sid, error=repr(e))
+                    continue
+                self.bytes_in += len(frame)
+                self.bytes_out += len(normalized)
+                await self._send(normalized)
+                self.frames_out += 1
+        finally:
+            self._worker = None
+
+    def close(self):
+        self._pending = None
+        if self._worker is not None:
+            self._worker.cancel()
+
+    def stats(self):
+        return {
+            "frames_in": self.frames_in,
+            "frames_out": self.frames_out,
+            "dropped_stale": self.dropped_stale,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
@@ -0,0 +1,175 @@
+import asyncio
+import contextlib
+import json
+import time
+from collections import deque
+
+from utils.loopMonitor import percentiles_ms
+from utils.structuredLog import get_logger
+
+# ------------------------------------------------------------------
+# Gemini Live 接続の事前確立プール
+# start_session のたびに TLS + setup を待たないよう、model / config ごとに
+# 接続を開いたまま待機させておき、すぐに貸し出す。
+# Live のセッションは会話ごとに使い捨てなので、返却時には閉じて補充する。
+# ------------------------------------------------------------------
+
+log = get_logger("pool")
+
+
+class _PooledConnection:
+    def __init__(self, session):
+        self.session = session
+        self.created = time.monotonic()
+        self.leased = asyncio.Event()
+        self.released = asyncio.Event()
+
+
+class TimedSession:
+    """最初の send までの時間を計測するためのラッパー"""
+
+    def __init__(self, session, started, on_first_send):
+        self._session = session
+        self._started = started
+        self._on_first_send = on_first_send
+
+    async def send(self, *args, **kwargs):
+        await self._session.send(*args, **kwargs)
+        if self._on_first_send:
+            self._on_first_send(time.monotonic() - self._started)
+            self._on_first_send = None
+
+    def __getattr__(self, name):
+        return getattr(self._session, name)
+
+
+class LiveConnectionPool:
+    def __init__(self, client, size=2, max_idle=480, retry_delay=5.0, max_retry_delay=120.0):
+        self._client = client
+        self.size = size
+        # サーバー側でアイドル切断される前に自分から閉じる（秒）
+        self.max_idle = max_idle
+        # 接続に失敗したら retry_delay から倍々に（max_retry_delay まで）待って開き直す
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._idle = {}
+        self._warming = {}
+        # model / config ごとの連続失敗回数
+        self._failures = {}
+        self._holders = set()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.connect_errors = 0
+        self.close_errors = 0
+        self._first_send = deque(maxlen=1024)
+
+    @staticmethod
+    def _key(model, config):
+        return model, json.dumps(config, sort_keys=True)
+
+    def warm(self, model, config):
+        """待機中 + 接続中の数が size になるまで接続を開く"""
+        key = self._key(model, config)
+        idle = self._idle.setdefault(key, deque())
+        missing = self.size - len(idle) - self._warming.get(key, 0)
+        for _ in range(max(missing, 0)):
+            self._warming[key] = self._warming.get(key, 0) + 1
+            task = asyncio.create_task(self._hold(key, model, config))
+            self._holders.add(task)
+            task.add_done_callback(self._holders.discard)
+
+    async def _hold(self, key, model, config):
+        warming = True
+        try:
+            async with self._client.aio.live.connect(model=model, config=config) as session:
+                conn = _PooledConnection(session)
+                self._warming[key] -= 1
+                warming = False
+                self._failures.pop(key, None)
+                self._idle[key].append(conn)
+                try:
+                    await asyncio.wait_for(conn.leased.wait(), self.max_idle)
+                except asyncio.TimeoutError:
+                    pass
+                if not conn.leased.is_set():
+                    # 貸し出されないまま期限切れ：閉じて入れ替える
+                    if conn in self._idle[key]:
+                        self._idle[key].remove(conn)
+                    self.expired += 1
+                    self.warm(model, config)
+                    return
+                # 貸し出し中はこのタスクが接続を保持し、返却されたら閉じる
+                await conn.released.wait()
+        except Exception as e:
+            if not warming:
+                # つながった後（待機中・貸し出し後に閉じるとき）の失敗は接続の失敗ではないので、補充を遅らせない
+                self.close_errors += 1
+                log.warning("pooled_connection_close_failed", error=repr(e))
+                return
+            self.connect_errors += 1
+            failures = self._failures[key] = self._failures.get(key, 0) + 1
+            delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+            log.warning("prewarm_failed", error=repr(e), failures=failures, retry_in_s=delay)
+            # 待っている間も接続中として数え、start_session の warm() が重ねて開かないようにする
+            await asyncio.sleep(delay)
+            self._warming[key] -= 1
+            warming = False
+            self.warm(model, config)
+        finally:
+            if warming:
+                self._warming[key] -= 1
+
+    def _take(self, key):
+        idle = self._idle.get(key)
+        while idle:
+            conn = idle.popleft()
+            conn.leased.set()
+            if time.monotonic() - conn.created < self.max_idle:
+                return conn
+            # 期限切れ間近のものは使わずに閉じさせる
+            conn.released.set()
+            self.expired += 1
+        return None
+
+    @contextlib.asynccontextmanager
+    async def session(self, model, config):
+        """プールから接続を借りる。空なら通常どおり接続する"""
+        started = time.monotonic()
+        conn = self._take(self._key(model, config))
+        if self.size:
+            self.warm(model, config)
+
+        if conn is not None:
+            self.hits += 1
+            try:
+                yield TimedSession(conn.session, started, self._first_send.append)
+            finally:
+                conn.released.set()
+            return
+
+        self.misses += 1
+        async with self._client.aio.live.connect(model=model, config=config) as session:
+            yield TimedSession(session, started, self._first_send.append)
+
+    async def close(self):
+        for task in list(self._holders):
+            task.cancel()
+        await asyncio.gather(*self._holders, return_exceptions=True)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": self.size,
+            "idle": sum(len(idle) for idle in self._idle.values()),
+            "warming": sum(self._warming.values()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "expired": self.expired,
+            "connect_errors": self.connect_errors,
+            "close_errors": self.close_errors,
+            "retrying": sum(1 for failures in self._failures.values() if failures),
+            "time_to_first_send": percentiles_ms(self._first_send),
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+from utils.structuredLog import get_logger
+
+# ------------------------------------------------------------------
+# セッションごとの上限付きキュー
+# 送り先（Gemini / クライアント）が詰まったときに、メモリを際限なく使わないよう
+# メディアの種類ごとに「満杯時にどうするか」を決めておく
+# ------------------------------------------------------------------
+
+DROP_OLDEST = "drop_oldest"  # 一番古いものを捨てて入れる（映像向け）
+DROP_NEWEST = "drop_newest"  # 新しく来たものを捨てる
+BLOCK = "block"              # 空くまで待つ。block_timeout を過ぎたら新しいものを捨てる（音声向け）
+
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+log = get_logger("media")
+
+
+class MediaQueue:
+    def __init__(self, maxsize, policy=BLOCK, block_timeout=1.0, drop_counter=None):
+        if policy not in POLICIES:
+            raise ValueError(f"未対応のポリシー: {policy}")
+        self._queue = asyncio.Queue(maxsize)
+        self.policy = policy
+        self.block_timeout = block_timeout
+        # 指定されていれば、捨てるたびに /metrics 用のカウンターも増やす
+        self._drop_counter = drop_counter
+
+        self.put_total = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.blocked_seconds = 0.0
+        self.high_water = 0
+        # pump の send が失敗して捨てた数
+        self.send_failed = 0
+
+    async def put(self, item):
+        """入れられたら True、ポリシーにより捨てたら False"""
+        self.put_total += 1
+        queue = self._queue
+        if queue.full():
+            if self.policy == DROP_OLDEST:
+                queue.get_nowait()
+                self._drop()
+            elif self.policy == DROP_NEWEST:
+                self._drop()
+                return False
+            else:
+                self.blocked += 1
+                start = time.monotonic()
+                try:
+                    await asyncio.wait_for(queue.put(item), self.block_timeout)
+                except asyncio.TimeoutError:
+                    self._drop()
+                    return False
+                finally:
+                    self.blocked_seconds += time.monotonic() - start
+                self._update_high_water()
+                return True
+        queue.put_nowait(item)
+        self._update_high_water()
+        return True
+
+    def _drop(self):
+        self.dropped += 1
+        if self._drop_counter is not None:
+            self._drop_counter.inc()
+
+    def _update_high_water(self):
+        size = self._queue.qsize()
+        if size > self.high_water:
+            self.high_water = size
+
+    async def get(self):
+        return await self._queue.get()
+
+    def get_nowait(self):
+        return self._queue.get_nowait()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def empty(self):
+        return self._queue.empty()
+
+    def clear(self):
+        """溜まっているものを全て捨て、捨てた数を返す"""
+        count = 0
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            count += 1
+        return count
+
+    def stats(self):
+        return {
+            "size": self._queue.qsize(),
+            "maxsize": self._queue.maxsize,
+            "policy": self.policy,
+            "high_water": self.high_water,
+            "put_total": self.put_total,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "blocked_seconds": round(self.blocked_seconds, 3),
+            "send_failed": self.send_failed,
+        }
+
+
+async def pump(queue, send, name="", sid=None):
+    """キューから取り出して send に渡し続ける（セッション終了時にキャンセルされる）
+
+    send が失敗したらその1件だけ捨てて続ける（ポンプが止まると、以降の put が全て詰まって捨てられる）
+    """
+    while True:
+        item = await queue.get()
+        try:
+            await send(item)
+        except Exception as e:
+            queue.send_failed += 1
+            log.error("pump_send_failed", sid, exc_info=True, queue=name, error=repr(e))
@@ -0,0 +1,264 @@
+import argparse
+import asyncio
+import base64
+import contextlib
+import itertools
+import json
+import math
+import random
+import time
+
+import numpy as np
+import websockets
+from google.genai import types
+
+# ------------------------------------------------------------------
+# Gemini Live API のローカル代替（負荷試験・オフライン開発用）
+#
+# サーバー:  python -m services.mockLive --port 9100 --latency-ms 300
+# 利用側:    GEMINI_MOCK_URL=ws://localhost:9100 uvicorn geminiSession:socket_app ...
+# ------------------------------------------------------------------
+
+RECEIVE_SAMPLE_RATE = 24000
+SEND_SAMPLE_RATE = 16000
+
+
+# ---------------------------- クライアント側 ----------------------------
+
+def _to_camel(key):
+    head, *rest = key.split("_")
+    return head + "".join(word.capitalize() for word in rest)
+
+
+def _camelize(value):
+    if isinstance(value, dict):
+        return {_to_camel(k): _camelize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_camelize(v) for v in value]
+    return value
+
+
+class MockLiveSession:
+    """genai の AsyncSession と同じ send / receive / close を持つセッション"""
+
+    def __init__(self, ws):
+        self._ws = ws
+
+    async def send(self, *, input=None, end_of_turn=False):
+        if isinstance(input, dict) and "mime_type" in input:
+            data = input["data"]
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                data = base64.b64encode(data).decode()
+            message = {"realtimeInput": {"mediaChunks": [{"mimeType": input["mime_type"], "data": data}]}}
+        elif isinstance(input, str):
+            message = {"clientContent": {"turns": [{"role": "user", "parts": [{"text": input}]}], "turnComplete": end_of_turn}}
+        elif input is None:
+            message = {"clientContent": {"turnComplete": True}}
+        else:
+            message = _camelize(input)
+        await self._ws.send(json.dumps(message))
+
+    async def receive(self):
+        # SDK と同様に、1ターン分（turn_complete まで）を返す
+        while True:
+            raw = await self._ws.recv()
+            response = types.LiveServerMessage.model_validate_json(raw)
+            yield response
+            if response.server_content and response.server_content.turn_complete:
+                break
+
+    async def close(self):
+        await self._ws.close()
+
+
+class _MockLive:
+    def __init__(self, url):
+        self._url = url
+
+    @contextlib.asynccontextmanager
+    async def connect(self, *, model, config=None):
+        setup = {"model": model}
+        config = dict(config or {})
+        modalities = config.pop("response_modalities", None)
+        if modalities:
+            setup["generationConfig"] = {"responseModalities": modalities}
+        setup.update(_camelize(config))
+        async with websockets.connect(self._url, max_size=None) as ws:
+            await ws.send(json.dumps({"setup": setup}))
+            await ws.recv()  # setupComplete
+            yield MockLiveSession(ws)
+
+
+class _MockAio:
+    def __init__(self, url):
+        self.live = _MockLive(url)
+
+
+class MockLiveClient:
+    """genai.Client の代わりに使う。client.aio.live.connect(...) だけを提供する"""
+
+    def __init__(self, url):
+        self.aio = _MockAio(url)
+
+
+# ---------------------------- サーバー側 ----------------------------
+
+def synth_pcm(duration_ms, sample_rate=RECEIVE_SAMPLE_RATE, freq=440.0, phase=0):
+    """テスト用のサイン波 int16 PCM を作る"""
+    n = sample_rate * duration_ms // 1000
+    t = (np.arange(n) + phase) / sample_rate
+    wave = 0.3 * np.sin(2 * math.pi * freq * t)
+    return (wave * 32767).astype("<i2").tobytes()
+
+
+class MockLiveServer:
+    def __init__(self, latency_ms=300, jitter_ms=50, reply_ms=1500, fragment_ms=40,
+                 stream_speed=4.0, eos_ms=600, voice_threshold=500, with_text=False, barge_in=True, drop_every_s=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.reply_ms = reply_ms
+        self.fragment_ms = fragment_ms
+        self.stream_speed = stream_speed
+        self.eos_ms = eos_ms
+        self.voice_threshold = voice_threshold
+        self.with_text = with_text
+        # 応答中に話し始めたら応答を打ち切る（interrupted → turnComplete を送る）
+        self.barge_in = barge_in
+        # 0 より大きければ、接続ごとにおよそこの秒数で通信を断ち切る（つなぎ直しの試験用）
+        self.drop_every_s = drop_every_s
+        self.connections = 0
+        self.replies = 0
+        self.interruptions = 0
+        self.drops = 0
+        self.resumed = 0
+        # 発行したセッション再開ハンドル
+        self._handles = set()
+        self._handle_ids = itertools.count(1)
+
+    async def handler(self, ws):
+        self.connections += 1
+        setup = json.loads(await ws.recv()).get("setup", {})
+        modalities = setup.get("generationConfig", {}).get("responseModalities", ["AUDIO"])
+        resumption = setup.get("sessionResumption")
+        if resumption is not None and (handle := resumption.get("handle")):
+            if handle not in self._handles:
+                # 実際の API と同じく、知らないハンドルでは setup を受け付けない
+                await ws.close(1008, "invalid session resumption handle")
+                self.connections -= 1
+                return
+            self.resumed += 1
+        await ws.send(json.dumps({"setupComplete": {}}))
+
+        state = {"in_speech": False, "last_audio": 0.0, "reply": None, "stop": None}
+
+        async def issue_handle():
+            # ターンの区切りごとに、その時点から再開できるハンドルを渡す
+            if resumption is not None:
+                handle = f"mock-{next(self._handle_ids)}"
+                self._handles.add(handle)
+                await ws.send(json.dumps({"sessionResumptionUpdate": {"newHandle": handle, "resumable": True}}))
+
+        async def reply(stop):
+            try:
+                delay = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+                await asyncio.sleep(max(delay, 0) / 1000)
+                await self._stream_reply(ws, modalities, stop)
+                await issue_handle()
+            finally:
+                state["reply"] = None
+
+        def end_of_speech():
+            state["in_speech"] = False
+            if state["reply"] is None:
+                state["stop"] = asyncio.Event()
+                state["reply"] = asyncio.create_task(reply(state["stop"]))
+
+        async def watchdog():
+            # 無音チャンクが届かない（クライアント側で間引かれた）場合も発話終了とみなす
+            while True:
+                await asyncio.sleep(self.eos_ms / 4000)
+                if state["in_speech"] and time.monotonic() - state["last_audio"] > self.eos_ms / 1000:
+                    end_of_speech()
+
+        async def drop():
+            # close せずに通信を断つ（クライアントには異常切断として見える）
+            await asyncio.sleep(self.drop_every_s * random.uniform(0.5, 1.5))
+            self.drops += 1
+            ws.transport.abort()
+
+        watchdog_task = asyncio.create_task(watchdog())
+        drop_task = asyncio.create_task(drop()) if self.drop_every_s > 0 else None
+        try:
+            await issue_handle()
+            async for raw in ws:
+                message = json.loads(raw)
+                if "realtimeInput" in message:
+                    for chunk in message["realtimeInput"].get("mediaChunks", []):
+                        if not chunk["mimeType"].startswith("audio/pcm"):
+                            continue
+                        pcm = np.frombuffer(base64.b64decode(chunk["data"]), dtype="<i2")
+                        voiced = pcm.size and np.sqrt(np.mean(pcm.astype(np.float32) ** 2)) > self.voice_threshold
+                        if voiced:
+                            if self.barge_in and state["reply"] is not None and not state["in_speech"]:
+                                state["stop"].set()
+                            state["in_speech"] = True
+                            state["last_audio"] = time.monotonic()
+                        elif state["in_speech"]:
+                            end_of_speech()
+                elif message.get("clientContent", {}).get("turnComplete"):
+                    end_of_speech()
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            watchdog_task.cancel()
+            if drop_task:
+                drop_task.cancel()
+            if state["reply"]:
+                state["reply"].cancel()
+            self.connections -= 1
+
+    async def _stream_reply(self, ws, modalities, stop=None):
+        self.replies += 1
+        if "TEXT" in modalities or self.with_text:
+            await ws.send(json.dumps({"serverContent": {"modelTurn": {"parts": [{"text": "モック応答です。"}]}}}))
+        if "AUDIO" in modalities:
+            interval = self.fragment_ms / 1000 / self.stream_speed
+            samples = RECEIVE_SAMPLE_RATE * self.fragment_ms // 1000
+            for i in range(self.reply_ms // self.fragment_ms):
+                if stop is not None and stop.is_set():
+                    # 実際の API と同じく interrupted の後に turnComplete を送る
+                    self.interruptions += 1
+                    await ws.send(json.dumps({"serverContent": {"interrupted": True}}))
+                    break
+                pcm = synth_pcm(self.fragment_ms, phase=i * samples)
+                part = {"inlineData": {"mimeType": f"audio/pcm;rate={RECEIVE_SAMPLE_RATE}", "data": base64.b64encode(pcm).decode()}}
+                await ws.send(json.dumps({"serverContent": {"modelTurn": {"parts": [part]}}}))
+                await asyncio.sleep(interval)
+        await ws.send(json.dumps({"serverContent": {"turnComplete": True}}))
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.handler, host, port, max_size=None):
+            print(f"モックGemini Liveサーバー起動: ws://{host}:{port}")
+            await asyncio.Future()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=int, default=300, help="発話終了から応答開始までの遅延")
+    parser.add_argument("--jitter-ms", type=int, default=50)
+    parser.add_argument("--reply-ms", type=int, default=1500, help="応答音声の長さ")
+    parser.add_argument("--fragment-ms", type=int, default=40, help="応答PCMフラグメントの長さ")
+    parser.add_argument("--stream-speed", type=float, default=4.0, help="実時間に対する応答送信速度")
+    parser.add_argument("--eos-ms", type=int, default=600, help="音声が途切れてから発話終了とみなすまでの時間")
+    parser.add_argument("--with-text", action="store_true", help="AUDIOモードでもテキストを返す")
+    parser.add_argument("--no-barge-in", action="store_true", help="応答中に話し始めても応答を打ち切らない")
+    parser.add_argument("--drop-every-s", type=float, default=0, help="接続ごとにおよそこの秒数で通信を断ち切る（0 で無効）")
+    args = parser.parse_args()
+    server = MockLiveServer(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, reply_ms=args.reply_ms,
+        fragment_ms=args.fragment_ms, stream_speed=args.stream_speed, eos_ms=args.eos_ms,
+        with_text=args.with_text, barge_in=not args.no_barge_in, drop_every_s=args.drop_every_s,
+    )
+    asyncio.run(server.serve(args.host, args.port))
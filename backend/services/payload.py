@@ -0,0 +1,156 @@
+import asyncio
+import base64
+import binascii
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# ------------------------------------------------------------------
+# send_audio_chunk / send_image_frame のペイロード形式
+#
+# 新形式（バイナリ添付）: [version:u8][mime:u8][seq:u32 LE] + 生データ
+# 旧形式（JSON）       : {"mime_type": "...", "data": "<base64>"}
+#
+# 受信時はデコードする前に、サイズ（base64 なら文字数から計算）をメディアごとの上限と比べ、
+# 先頭のバイト（JPEG の FF D8 FF）を確かめてから本体をデコードする。
+# 大きいペイロードのデコードはスレッドで行い、イベントループ（他のセッション）を止めない。
+# ------------------------------------------------------------------
+
+HEADER = struct.Struct("<BBI")
+HEADER_SIZE = HEADER.size
+VERSION = 1
+
+MIME_CODES = {
+    1: "audio/pcm",
+    2: "image/jpeg",
+}
+MIME_IDS = {mime: code for code, mime in MIME_CODES.items()}
+
+# メディアごとのデコード後のサイズ上限（バイト）
+MAX_BYTES = {
+    "audio/pcm": 256 * 1024,
+    "image/jpeg": 8 * 1024 * 1024,
+}
+# これより大きいペイロードはスレッドでデコードする
+OFFLOAD_BYTES = 256 * 1024
+# base64 は C の中で GIL を持ったままデコードされるので、スレッドでもこの文字数ずつ区切って
+# 他のスレッド（イベントループ）に GIL を譲る機会を作る（4 の倍数）
+B64_SLICE_CHARS = 256 * 1024
+
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+_executor = None
+
+
+class PayloadError(ValueError):
+    pass
+
+
+def encode_media(mime_type, seq, data):
+    """バイナリ形式のフレームを作る（クライアント・負荷試験用）"""
+    return HEADER.pack(VERSION, MIME_IDS[mime_type], seq & 0xFFFFFFFF) + bytes(data)
+
+
+def _parse(payload, default_mime):
+    """(mime_type, seq, 本体, 本体が base64 か) に分ける。本体はまだデコードしない"""
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        if len(payload) < HEADER_SIZE:
+            raise PayloadError("バイナリヘッダーが短すぎます")
+        version, mime_id, seq = HEADER.unpack_from(payload)
+        if version != VERSION:
+            raise PayloadError(f"未対応のバージョン: {version}")
+        mime_type = MIME_CODES.get(mime_id)
+        if mime_type is None:
+            raise PayloadError(f"未対応のmime: {mime_id}")
+        return mime_type, seq, memoryview(payload)[HEADER_SIZE:], False
+
+    if isinstance(payload, dict):
+        data = payload.get("data")
+        mime_type = payload.get("mime_type", default_mime)
+        seq = payload.get("seq")
+        # dict 内にバイナリ添付が入っている場合はそのまま使う
+        if isinstance(data, (bytes, bytearray)):
+            return mime_type, seq, data, False
+        if isinstance(data, str):
+            return mime_type, seq, data, True
+
+    raise PayloadError(f"不正なペイロード: {type(payload).__name__}")
+
+
+def inspect_media(payload, expected_mime, limits=MAX_BYTES):
+    """デコードせずにメディアの種類・サイズ・先頭のバイトを確かめ、(mime_type, seq, 本体, base64か, サイズ) を返す"""
+    mime_type, seq, body, encoded = _parse(payload, expected_mime)
+    if mime_type != expected_mime:
+        raise PayloadError(f"{expected_mime} のイベントに {mime_type} が届きました")
+
+    # base64 の場合は文字数からデコード後のサイズを出す（改行などが混じっていれば実際はこれより小さい）
+    size = len(body) // 4 * 3 - body[-2:].count("=") if encoded else len(body)
+    limit = limits.get(mime_type)
+    if limit and size > limit:
+        raise PayloadError(f"{mime_type} が上限を超えています: {size:,}B > {limit:,}B")
+    if not size:
+        raise PayloadError("データが空です")
+
+    if mime_type == "image/jpeg":
+        try:
+            head = base64.b64decode(body[:4]) if encoded else bytes(body[:3])
+        except (binascii.Error, ValueError):
+            raise PayloadError("base64 として読めません")
+        if head[:3] != JPEG_MAGIC:
+            raise PayloadError("JPEG ではありません（先頭が FF D8 FF ではない）")
+    return mime_type, seq, body, encoded, size
+
+
+def _decode_body(body, encoded):
+    if not encoded:
+        return bytes(body)
+    try:
+        if len(body) <= B64_SLICE_CHARS:
+            return base64.b64decode(body)
+        out = bytearray()
+        for start in range(0, len(body), B64_SLICE_CHARS):
+            out += base64.b64decode(body[start:start + B64_SLICE_CHARS])
+        return bytes(out)
+    except (binascii.Error, ValueError):
+        if len(body) > B64_SLICE_CHARS:
+            # 改行入りなどで4文字単位の区切りがずれた場合は、まとめてデコードし直す
+            try:
+                return base64.b64decode(body)
+            except (binascii.Error, ValueError):
+                pass
+        raise PayloadError("base64 として読めません")
+
+
+def _check_decoded(mime_type, data):
+    # 16bit PCM なので奇数バイトは途中で切れている
+    if mime_type == "audio/pcm" and len(data) % 2:
+        raise PayloadError(f"PCM の長さが奇数です: {len(data)}B")
+    return data
+
+
+def decode_media(payload, default_mime, limits=MAX_BYTES):
+    """ペイロードを (mime_type, seq, data) に変換する。旧形式の seq は None"""
+    mime_type, seq, body, encoded, _ = inspect_media(payload, default_mime, limits)
+    return mime_type, seq, _check_decoded(mime_type, _decode_body(body, encoded))
+
+
+async def decode_media_async(payload, default_mime, limits=MAX_BYTES, offload_bytes=OFFLOAD_BYTES):
+    """decode_media と同じ。offload_bytes を超えるものはスレッドでデコードする"""
+    mime_type, seq, body, encoded, size = inspect_media(payload, default_mime, limits)
+    if size > offload_bytes:
+        data = await asyncio.get_running_loop().run_in_executor(_get_executor(), _decode_body, body, encoded)
+    else:
+        data = _decode_body(body, encoded)
+    return mime_type, seq, _check_decoded(mime_type, data)
+
+
+def _get_executor():
+    # 大きいペイロードが一度に届いても CPU を取り合いすぎないよう、スレッドは少なめにする
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="payload")
+    return _executor
+
+
+def max_buffer_size(limits=MAX_BYTES, margin=64 * 1024):
+    """AsyncServer の max_http_buffer_size に使う値（base64 JSON で最大のメディアが届く大きさ + 余白）"""
+    return max(limits.values()) * 4 // 3 + margin
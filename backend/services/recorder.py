@@ -0,0 +1,227 @@
+import json
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import time
+
+import numpy as np
+
+from utils.structuredLog import get_logger
+
+# ------------------------------------------------------------------
+# セッションの録画（負荷試験・レイテンシ調査の再現用）
+#
+#   RECORD_DIR=recordings python geminiSession.py
+#   python -m sandbox.replay recordings/<sid>.rec
+#
+# 1セッションにつき2ファイルを追記だけで書く:
+#   <sid>.rec : ファイルヘッダー + [長さ:u32][種類:u8][経過時間 µs:u64] + データ ...
+#   <sid>.idx : 1フレームにつき固定長 24 バイト（.rec 内の位置・経過時間・長さ・種類）
+# .idx は numpy でそのままメモリマップでき、途中で落ちても .rec から作り直せる。
+# ファイルへの書き込みは別スレッドで行い、イベントループではキューに入れるだけにする。
+# ------------------------------------------------------------------
+
+log = get_logger("recorder")
+
+MAGIC = b"LREC"
+VERSION = 1
+# マジック・バージョン・録画開始時刻（UNIX 秒）
+FILE_HEADER = struct.Struct("<4sBxxxd")
+FRAME = struct.Struct("<IBQ")
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("t_us", "<u8"), ("length", "<u4"), ("kind", "u1"), ("pad", "V3")])
+
+# フレームの種類
+META = 0          # start_session のオプション（JSON）
+AUDIO_IN = 1      # send_audio_chunk の PCM（リサンプル前）
+IMAGE_IN = 2      # send_image_frame の JPEG（間引き・縮小前）
+RESPONSE = 3      # gemini_response（エンコード済み）
+RESPONSE_END = 4  # gemini_response_end（wav のときは確定したヘッダー）
+
+KIND_NAMES = {META: "meta", AUDIO_IN: "audio_in", IMAGE_IN: "image_in", RESPONSE: "response", RESPONSE_END: "response_end"}
+
+_SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+class _WriterThread:
+    """全セッションの録画を1本のスレッドで書き出す。溜まりすぎたら捨てて数える"""
+
+    def __init__(self, max_pending_bytes):
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.written_frames = 0
+        self.dropped_frames = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="recorder", daemon=True)
+        self._thread.start()
+
+    def put(self, recorder, kind, t_us, data):
+        size = len(data)
+        if self.pending_bytes + size > self.max_pending_bytes:
+            self.dropped_frames += 1
+            recorder.dropped += 1
+            return
+        # pending_bytes は両方のスレッドから更新するが、目安なので厳密さは要らない
+        self.pending_bytes += size
+        self._queue.put_nowait((recorder, kind, t_us, data))
+
+    def close(self, recorder):
+        self._queue.put_nowait((recorder, None, 0, b""))
+
+    def _run(self):
+        while True:
+            recorder, kind, t_us, data = self._queue.get()
+            try:
+                if kind is None:
+                    recorder._close_files()
+                    continue
+                recorder._append(kind, t_us, data)
+                self.written_frames += 1
+            except OSError:
+                log.error("record_write_failed", recorder.sid, exc_info=True, path=recorder.path)
+            finally:
+                self.pending_bytes -= len(data)
+
+    def stats(self):
+        return {
+            "pending_bytes": self.pending_bytes,
+            "written_frames": self.written_frames,
+            "dropped_frames": self.dropped_frames,
+        }
+
+
+_writer = None
+
+
+def _get_writer(max_pending_bytes):
+    global _writer
+    if _writer is None:
+        _writer = _WriterThread(max_pending_bytes)
+    return _writer
+
+
+def recorder_stats():
+    return _writer.stats() if _writer else None
+
+
+class SessionRecorder:
+    """1セッション分の録画。record() はイベントループから呼び、書き込みは別スレッドで行う"""
+
+    def __init__(self, directory, sid, meta=None, max_pending_bytes=64 * 1024 * 1024):
+        os.makedirs(directory, exist_ok=True)
+        self.sid = sid
+        base = os.path.join(directory, f"{_SAFE_NAME.sub('_', sid)}-{int(time.time())}")
+        self.path = base + ".rec"
+        self.index_path = base + ".idx"
+        self._start = time.monotonic()
+        self._log = open(self.path, "wb")
+        self._index = open(self.index_path, "wb")
+        self._log.write(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self._offset = FILE_HEADER.size
+        self._writer = _get_writer(max_pending_bytes)
+        self.frames = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.closed = False
+        self.record(META, json.dumps(meta or {}, ensure_ascii=False).encode())
+
+    def record(self, kind, data):
+        if self.closed:
+            return
+        self.frames += 1
+        self.bytes += len(data)
+        self._writer.put(self, kind, int((time.monotonic() - self._start) * 1e6), bytes(data))
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._writer.close(self)
+
+    # 以下は書き込みスレッドから呼ばれる
+    def _append(self, kind, t_us, data):
+        self._log.write(FRAME.pack(len(data), kind, t_us))
+        self._log.write(data)
+        self._index.write(struct.pack("<QQIB3x", self._offset, t_us, len(data), kind))
+        self._offset += FRAME.size + len(data)
+
+    def _close_files(self):
+        self._log.close()
+        self._index.close()
+
+    def stats(self):
+        return {"path": self.path, "frames": self.frames, "bytes": self.bytes, "dropped": self.dropped}
+
+
+class RecordingError(ValueError):
+    pass
+
+
+class Recording:
+    """録画を読む。.rec と .idx をメモリマップし、フレームはコピーせず memoryview で返す"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.started_at = FILE_HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION:
+            raise RecordingError(f"録画ファイルではありません: {path}")
+        self.index = self._load_index(os.path.splitext(path)[0] + ".idx")
+        meta = self.frames_of(META)
+        self.meta = json.loads(bytes(self.payload(meta[0]))) if len(meta) else {}
+
+    def _load_index(self, index_path):
+        if os.path.exists(index_path) and os.path.getsize(index_path) >= INDEX_DTYPE.itemsize:
+            index = np.memmap(index_path, dtype=INDEX_DTYPE, mode="r",
+                              shape=(os.path.getsize(index_path) // INDEX_DTYPE.itemsize,))
+            # 書き込み途中で止まった場合、.rec に収まっているところまでを使う
+            end = index["offset"] + FRAME.size + index["length"]
+            return index[: int(np.searchsorted(end > len(self._mmap), True))]
+        return self.rebuild_index()
+
+    def rebuild_index(self):
+        """.idx がない・壊れているときに .rec を先頭から読んで作り直す（末尾の書きかけは捨てる）"""
+        entries = []
+        offset = FILE_HEADER.size
+        while offset + FRAME.size <= len(self._mmap):
+            length, kind, t_us = FRAME.unpack_from(self._mmap, offset)
+            if offset + FRAME.size + length > len(self._mmap):
+                break
+            entries.append((offset, t_us, length, kind, b""))
+            offset += FRAME.size + length
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def duration(self):
+        return float(self.index["t_us"][-1]) / 1e6 if len(self.index) else 0.0
+
+    def payload(self, entry):
+        start = int(entry["offset"]) + FRAME.size
+        return memoryview(self._mmap)[start:start + int(entry["length"])]
+
+    def frames_of(self, *kinds):
+        return self.index[np.isin(self.index["kind"], kinds)]
+
+    def frames(self, *kinds):
+        """(経過秒, 種類, データ) を時刻順に返す。kinds を省略すると全て"""
+        entries = self.frames_of(*kinds) if kinds else self.index
+        for entry in entries:
+            yield int(entry["t_us"]) / 1e6, int(entry["kind"]), self.payload(entry)
+
+    def summary(self):
+        counts = {}
+        for kind, name in KIND_NAMES.items():
+            entries = self.frames_of(kind)
+            if len(entries):
+                counts[name] = {"frames": len(entries), "bytes": int(entries["length"].sum())}
+        return {"path": self.path, "duration_s": round(self.duration, 3), "meta": self.meta, "frames": counts}
+
+    def close(self):
+        # memoryview が残っていると閉じられないので、index を先に手放す
+        self.index = None
+        self._mmap.close()
@@ -0,0 +1,112 @@
+import functools
+from math import gcd
+
+import numpy as np
+
+# ------------------------------------------------------------------
+# チャンク間で状態を持つサンプリングレート変換（ポリフェーズ窓付きsinc）
+# 端末の録音レート（44.1k / 48k など）→ Gemini の 16kHz、
+# Gemini の 24kHz → 端末の再生レート の両方で使う。
+# 直前の入力を履歴として持ち越すので、チャンクの境目でもクリックが出ない。
+# ------------------------------------------------------------------
+
+# 受け付けるレートの範囲（Hz）
+MIN_RATE = 8000
+MAX_RATE = 96000
+
+
+@functools.lru_cache(maxsize=16)
+def _polyphase_filter(up, down, taps, beta):
+    """L 倍アップサンプル後のレートで設計したローパスを、位相ごとの (up, taps) 行列に並べ替える"""
+    # ナイキストの低い方で切り、少し手前から落とす
+    cutoff = 0.95 / max(up, down)
+    n = np.arange(up * taps) - (up * taps - 1) / 2
+    h = cutoff * np.sinc(cutoff * n) * np.kaiser(up * taps, beta) * up
+    # 位相 p の k 番目のタップ = h[p + k * up]。入力 x[i - k] に掛ける
+    return np.ascontiguousarray(h.reshape(taps, up).T, dtype=np.float32)
+
+
+class Resampler:
+    """int16 モノラル PCM のバイト列を受け取り、変換後のバイト列を返す"""
+
+    def __init__(self, in_rate, out_rate, taps=32, beta=8.0):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        g = gcd(in_rate, out_rate)
+        self.up = out_rate // g
+        self.down = in_rate // g
+        self.taps = taps
+        self.passthrough = in_rate == out_rate
+        self._filter = None if self.passthrough else _polyphase_filter(self.up, self.down, taps, beta)
+        # 直前の入力 taps-1 サンプル
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        # 次に出す出力の位置（アップサンプル後の単位、次に来る入力の先頭からの相対位置）
+        self._next = 0
+        self._odd_byte = b""
+
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def process(self, pcm_bytes):
+        self.bytes_in += len(pcm_bytes)
+        if self.passthrough:
+            self.bytes_out += len(pcm_bytes)
+            return pcm_bytes
+        if self._odd_byte:
+            pcm_bytes = self._odd_byte + pcm_bytes
+        usable = len(pcm_bytes) & ~1
+        self._odd_byte = pcm_bytes[usable:]
+        x = np.frombuffer(pcm_bytes, dtype="<i2", count=usable // 2)
+        out = self._convert(x.astype(np.float32))
+        self.bytes_out += len(out)
+        return out
+
+    def _convert(self, x):
+        up, down, taps = self.up, self.down, self.taps
+        n_in = x.size
+        buf = np.concatenate((self._history, x))
+        # 入力 i = t // up が届いている範囲の出力を全て作る
+        count = max(-(-(n_in * up - self._next) // down), 0)
+        if count:
+            t = self._next + down * np.arange(count)
+            phase = t % up
+            # buf 上の位置（履歴の分だけずれる）
+            base = t // up + taps - 1
+            window = buf[base[:, None] - np.arange(taps)]
+            y = np.einsum("ij,ij->i", window, self._filter[phase])
+            out = np.clip(np.rint(y), -32768, 32767).astype("<i2").tobytes()
+        else:
+            out = b""
+        self._next += count * down - n_in * up
+        self._history = buf[buf.size - (taps - 1):].copy()
+        return out
+
+    def flush(self):
+        """フィルターの遅延分（taps/2 入力サンプル）を無音で押し出す"""
+        if self.passthrough:
+            return b""
+        out = self._convert(np.zeros(self.taps // 2, dtype=np.float32))
+        self.bytes_out += len(out)
+        return out
+
+    def reset(self):
+        self._history[:] = 0
+        self._next = 0
+        self._odd_byte = b""
+
+    def stats(self):
+        return {
+            "in_rate": self.in_rate,
+            "out_rate": self.out_rate,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+        }
+
+
+def negotiate_rate(value, default):
+    """クライアントが指定したレートが使える範囲なら採用し、そうでなければ default"""
+    try:
+        rate = int(value)
+    except (TypeError, ValueError):
+        return default
+    return rate if MIN_RATE <= rate <= MAX_RATE else default
@@ -0,0 +1,255 @@
+import asyncio
+import contextlib
+import random
+import time
+from collections import deque
+
+from google.genai.errors import APIError
+from websockets.exceptions import ConnectionClosed
+
+from utils.structuredLog import get_logger
+
+# ------------------------------------------------------------------
+# 切れても自動でつなぎ直す Gemini Live 接続
+# 送信側（キューのポンプ）と受信側（receive_from_gemini）からは1本の接続に見え、
+# Socket.IO 側のセッションはつなぎ直しの間もそのまま残る。
+#
+# - 切断を検知したら指数バックオフ（+ ゆらぎ）でつなぎ直す。つないだ直後に切られる場合（クォータ超過など）も
+#   詰めてつなぎ直さないよう、min_uptime 秒続いた接続が出るまで試行回数を持ち越す
+# - API がセッション再開用のハンドル（session_resumption_update）をくれていれば、それで再開する
+# - 直近 replay_seconds 秒の上り音声と最新の画像を覚えておき、新しい接続に送り直す
+#     再開できたとき   : ハンドルを受け取った時点より後に送った分（サーバーの再開後の状態に入っていない）と、
+#                        切れている間に届いて送れなかった分だけ
+#     再開できないとき : 文脈が失われるので、覚えている音声全部と最新の画像
+# ------------------------------------------------------------------
+
+log = get_logger("upstream")
+
+# 送信でこれらが起きたら接続が切れたとみなす（それ以外は送ったものの問題なので呼び出し元に返す）
+CONNECTION_ERRORS = (ConnectionError, ConnectionClosed, APIError)
+
+
+class UpstreamClosed(Exception):
+    """つなぎ直しを諦めた"""
+
+
+class InputRing:
+    """上り音声の直近 max_bytes 分と、最新の画像を連番付きで持つ"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._audio = deque()
+        self._bytes = 0
+        self.latest_image = None
+        self._seq = 0
+
+    def add_audio(self, frame):
+        self._seq += 1
+        self._audio.append((self._seq, frame))
+        self._bytes += len(frame)
+        while self._bytes > self.max_bytes and len(self._audio) > 1:
+            _, old = self._audio.popleft()
+            self._bytes -= len(old)
+        return self._seq
+
+    def set_image(self, image):
+        self._seq += 1
+        self.latest_image = (self._seq, image)
+        return self._seq
+
+    def after(self, seq):
+        """seq より後に届いたものを届いた順に返す（画像は最新の1枚だけ）"""
+        items = [(s, "audio/pcm", frame) for s, frame in self._audio if s > seq]
+        if self.latest_image and self.latest_image[0] > seq:
+            items.append((self.latest_image[0], "image/jpeg", self.latest_image[1]))
+        items.sort(key=lambda item: item[0])
+        return items
+
+    @property
+    def buffered_bytes(self):
+        return self._bytes
+
+
+class ResilientUpstream:
+    def __init__(self, pool, client, model, config, replay_seconds=5.0,
+                 sample_rate=16000, max_attempts=6, base_delay=0.25, max_delay=8.0, min_uptime=2.0,
+                 on_reconnect=None, metrics=None):
+        self._pool = pool
+        self._client = client
+        self.model = model
+        # config に session_resumption があれば、API が再開用のハンドルを送ってくる
+        self.config = dict(config)
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.min_uptime = min_uptime
+        # つなぎ直した後に呼ばれる（resumed: 再開できたか）。応答の途中だったターンの後始末に使う
+        self.on_reconnect = on_reconnect
+        # 結果・復旧時間の記録先（serverMetrics.observe_reconnect）
+        self._metrics = metrics
+        self._ring = InputRing(int(replay_seconds * sample_rate) * 2)
+
+        self._session = None
+        self._stack = None
+        # 送ってよい状態か（つなぎ直し・再送の間は閉じる）
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._handle = None
+        # 今の接続で最後に送ったものの連番
+        self._sent_seq = 0
+        # 今のハンドルを受け取った時点で送り終えていたものの連番（再開したらこの後から送り直す）
+        self._handle_seq = 0
+        # 今の接続がつながった時刻と、min_uptime 続いた接続がないまま重ねた試行回数
+        self._connected_at = None
+        self._attempts = 0
+
+        self.connects = 0
+        self.reconnects = 0
+        self.resumed = 0
+        self.failed = 0
+        self.replayed_frames = 0
+        self.last_recovery_s = None
+
+    async def __aenter__(self):
+        await self._connect(use_pool=True)
+        self._ready.set()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        self._closed = True
+        self._ready.clear()
+        await self._disconnect()
+
+    async def _connect(self, use_pool=False):
+        stack = contextlib.AsyncExitStack()
+        try:
+            if use_pool:
+                # 最初の接続は事前に開いておいたものを借りる（再開ハンドル付きの設定はプールできない）
+                session = await stack.enter_async_context(self._pool.session(self.model, self.config))
+            else:
+                config = dict(self.config)
+                if self._handle:
+                    config["session_resumption"] = {"handle": self._handle}
+                session = await stack.enter_async_context(self._client.aio.live.connect(model=self.model, config=config))
+        except BaseException:
+            await stack.aclose()
+            raise
+        self._stack, self._session = stack, session
+        self._connected_at = time.monotonic()
+        self.connects += 1
+
+    async def _disconnect(self):
+        stack, self._stack, self._session = self._stack, None, None
+        if stack is not None:
+            with contextlib.suppress(Exception):
+                await stack.aclose()
+
+    async def send(self, *, input=None, end_of_turn=False):
+        """送る。つなぎ直し中なら覚えておくだけで、つながった後にまとめて送る"""
+        seq = None
+        if isinstance(input, dict) and input.get("mime_type") == "audio/pcm":
+            seq = self._ring.add_audio(input["data"])
+        elif isinstance(input, dict) and input.get("mime_type") == "image/jpeg":
+            seq = self._ring.set_image(input["data"])
+        if not self._ready.is_set():
+            return
+        try:
+            await self._session.send(input=input, end_of_turn=end_of_turn)
+        except CONNECTION_ERRORS as e:
+            # 受信側が切断に気づいてつなぎ直す。送れなかった分は覚えているので後で送る
+            log.warning("upstream_send_failed", error=repr(e))
+            self._ready.clear()
+            return
+        if seq is not None:
+            self._sent_seq = seq
+
+    async def responses(self):
+        """接続をまたいで応答を返し続ける。つなぎ直しを諦めたら UpstreamClosed"""
+        while not self._closed:
+            try:
+                async for response in self._session.receive():
+                    if update := response.session_resumption_update:
+                        if update.resumable and update.new_handle:
+                            self._handle = update.new_handle
+                            self._handle_seq = self._sent_seq
+                        continue
+                    if response.go_away is not None:
+                        # まもなく切られるので、先につなぎ直す
+                        raise ConnectionResetError(f"go_away: {response.go_away.time_left}")
+                    yield response
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self._closed:
+                    return
+                await self._reconnect(e)
+
+    async def _reconnect(self, error):
+        dropped_at = time.monotonic()
+        self._ready.clear()
+        uptime = dropped_at - self._connected_at if self._connected_at is not None else 0.0
+        log.warning("upstream_lost", error=repr(error), resumable=self._handle is not None, uptime_s=round(uptime, 1))
+        await self._disconnect()
+
+        if uptime >= self.min_uptime:
+            self._attempts = 0
+        while self._attempts < self.max_attempts:
+            self._attempts += 1
+            attempt = self._attempts
+            if attempt > 1:
+                # 2回目以降（直前の接続がすぐ切れた場合も含む）は待ってから
+                delay = min(self.base_delay * 2 ** (attempt - 2), self.max_delay)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+            resuming = self._handle is not None
+            try:
+                await self._connect()
+                await self._replay(resuming)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._disconnect()
+                log.warning("upstream_reconnect_failed", attempt=attempt, resuming=resuming, error=repr(e))
+                # ハンドルが無効になっていることがあるので、次は新しいセッションで試す
+                self._handle = None
+                continue
+
+            self.reconnects += 1
+            self.resumed += resuming
+            self.last_recovery_s = time.monotonic() - dropped_at
+            if self._metrics:
+                self._metrics("resumed" if resuming else "new", self.last_recovery_s)
+            log.info("upstream_recovered", attempt=attempt, resumed=resuming, recovery_ms=round(self.last_recovery_s * 1000))
+            if self.on_reconnect:
+                await self.on_reconnect(resuming)
+            return
+
+        self.failed += 1
+        if self._metrics:
+            self._metrics("failed", time.monotonic() - dropped_at)
+        raise UpstreamClosed(f"{self.max_attempts} 回つなぎ直せませんでした: {error!r}")
+
+    async def _replay(self, resumed):
+        # 再送している間に届いた分も取りこぼさないよう、追いつくまで繰り返してから送信を再開する
+        seq = self._handle_seq if resumed else 0
+        while items := self._ring.after(seq):
+            for seq, mime_type, data in items:
+                await self._session.send(input={"mime_type": mime_type, "data": data})
+                self.replayed_frames += 1
+        self._sent_seq = max(seq, self._sent_seq)
+        self._ready.set()
+
+    def stats(self):
+        return {
+            "connected": self._ready.is_set(),
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "resumed": self.resumed,
+            "failed": self.failed,
+            "replayed_frames": self.replayed_frames,
+            "replay_buffer_bytes": self._ring.buffered_bytes,
+            "has_resumption_handle": self._handle is not None,
+            "last_recovery_ms": round(self.last_recovery_s * 1000) if self.last_recovery_s is not None else None,
+        }
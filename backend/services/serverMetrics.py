@@ -0,0 +1,158 @@
+import time
+
+from utils.metrics import Registry
+
+# ------------------------------------------------------------------
+# /metrics で公開するサーバーのメトリクス定義
+# direction は音声・画像の流れる区間:
+#   ingress    : クライアント → サーバー
+#   upstream   : サーバー → Gemini
+#   gemini     : Gemini → サーバー
+#   downstream : サーバー → クライアント（gemini_response）
+# ------------------------------------------------------------------
+
+registry = Registry(prefix="live_")
+
+ACTIVE_SESSIONS = registry.gauge("active_sessions", "開いているセッション数")
+MEDIA_BYTES = registry.counter("media_bytes_total", "区間・メディアごとのバイト数", ("direction", "media"))
+MEDIA_CHUNKS = registry.counter("media_chunks_total", "区間・メディアごとのチャンク数", ("direction", "media"))
+
+TIME_TO_FIRST_AUDIO = registry.histogram(
+    "time_to_first_audio_seconds",
+    "発話の終わり（最後に発話と判定した受信音声）から、応答の最初の音声が届くまでの時間",
+)
+GAP_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+CHUNK_GAP = registry.histogram("response_chunk_gap_seconds", "1ターン内で Gemini から届く音声チャンクの間隔", buckets=GAP_BUCKETS)
+
+INTERRUPTIONS = registry.counter("interruptions_total", "ユーザーの割り込み（server_content.interrupted）で打ち切った応答の数")
+DISCARDED_AUDIO_BYTES = registry.counter("discarded_audio_bytes_total", "割り込みで送らずに捨てた応答音声のバイト数")
+INTERRUPTION_LATENCY = registry.histogram(
+    "interruption_latency_seconds",
+    "interrupted を受けてからクライアントに届くまでの時間（emitted: 送信完了 / acked: クライアントの ack 受信）",
+    ("stage",), buckets=GAP_BUCKETS,
+)
+INTERRUPTION_EMITTED = INTERRUPTION_LATENCY.labels("emitted")
+INTERRUPTION_ACKED = INTERRUPTION_LATENCY.labels("acked")
+
+UPSTREAM_RECONNECTS = registry.counter(
+    "upstream_reconnects_total", "Gemini 接続が切れた後のつなぎ直し（resumed: セッション再開 / new: 新しいセッション / failed: 諦めた）", ("result",),
+)
+UPSTREAM_RECOVERY_TIME = registry.histogram(
+    "upstream_recovery_seconds", "Gemini 接続が切れてから、つなぎ直して溜まった入力を送り終えるまでの時間",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+
+ADMISSION_SESSIONS = registry.gauge("admission_sessions", "受け入れ制御の状態ごとのセッション数（active: Gemini 接続あり / waiting: 順番待ち）", ("state",))
+ADMISSION_WAIT = registry.histogram(
+    "admission_wait_seconds", "start_session から受け入れられるまでの待ち時間",
+    buckets=(0.001, 0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0),
+)
+ADMISSION_REJECTED = registry.counter("admission_rejected_total", "受け入れを断った start_session の数", ("reason",))
+INVALID_PAYLOADS = registry.counter("invalid_payloads_total", "サイズ超過・形式不正で捨てた受信ペイロードの数", ("media",))
+INGRESS_THROTTLED = registry.counter("ingress_throttled_total", "流量制限を超えて捨てた受信チャンクの数", ("media",))
+
+PLAYBACK_LATENCY = registry.histogram(
+    "playback_latency_seconds", "デバッグ再生で、応答音声をジッターバッファに書いてから再生されるまでの時間",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+PLAYBACK_EVENTS = registry.counter("playback_events_total", "デバッグ再生の underrun（発話途中の途切れ）/ overrun（溢れて捨てた）", ("kind",))
+
+LOOP_LAG = registry.histogram("event_loop_lag_seconds", "イベントループの遅延", buckets=GAP_BUCKETS)
+QUEUE_DEPTH = registry.gauge("queue_depth", "全セッション合計のキューの長さ", ("queue",))
+QUEUE_DROPPED = registry.counter("queue_dropped_total", "キューのポリシーにより捨てた数（全セッション合計）", ("queue",))
+TASKS = registry.gauge("tasks", "asyncio タスク数（all: ループ全体 / session: セッションの子タスク）", ("kind",))
+
+# チャンクごとに使う子は先に作っておく
+INGRESS_AUDIO_BYTES = MEDIA_BYTES.labels("ingress", "audio")
+INGRESS_AUDIO_CHUNKS = MEDIA_CHUNKS.labels("ingress", "audio")
+INGRESS_IMAGE_BYTES = MEDIA_BYTES.labels("ingress", "image")
+INGRESS_IMAGE_CHUNKS = MEDIA_CHUNKS.labels("ingress", "image")
+UPSTREAM_AUDIO_BYTES = MEDIA_BYTES.labels("upstream", "audio")
+UPSTREAM_AUDIO_CHUNKS = MEDIA_CHUNKS.labels("upstream", "audio")
+UPSTREAM_IMAGE_BYTES = MEDIA_BYTES.labels("upstream", "image")
+UPSTREAM_IMAGE_CHUNKS = MEDIA_CHUNKS.labels("upstream", "image")
+GEMINI_AUDIO_BYTES = MEDIA_BYTES.labels("gemini", "audio")
+GEMINI_AUDIO_CHUNKS = MEDIA_CHUNKS.labels("gemini", "audio")
+DOWNSTREAM_AUDIO_BYTES = MEDIA_BYTES.labels("downstream", "audio")
+DOWNSTREAM_AUDIO_CHUNKS = MEDIA_CHUNKS.labels("downstream", "audio")
+AUDIO_IN_DROPPED = QUEUE_DROPPED.labels("audio_in")
+VIDEO_IN_DROPPED = QUEUE_DROPPED.labels("video_in")
+AUDIO_OUT_DROPPED = QUEUE_DROPPED.labels("audio_out")
+
+
+class SessionMetrics:
+    """セッションごとのレイテンシ計測（記録先は全セッション共通のヒストグラム。sid ラベルは付けない）"""
+
+    def __init__(self):
+        # 最後に発話と判定した音声を受信した時刻（応答の最初の音声で計測したら None に戻す）
+        self._speech_ended = None
+        # ターン内で最後に音声を受け取った時刻（ターンの最初は None）
+        self._last_response = None
+        # 割り込みを受けた時刻（クライアントの ack までの時間を測る）
+        self._interrupted_at = None
+
+    def speech(self):
+        """発話を含む音声を受信したときに呼ぶ"""
+        self._speech_ended = time.monotonic()
+
+    def upstream_audio(self, nbytes):
+        UPSTREAM_AUDIO_BYTES.inc(nbytes)
+        UPSTREAM_AUDIO_CHUNKS.inc()
+
+    def response_audio(self, nbytes):
+        GEMINI_AUDIO_BYTES.inc(nbytes)
+        GEMINI_AUDIO_CHUNKS.inc()
+        now = time.monotonic()
+        if self._last_response is None:
+            if self._speech_ended is not None:
+                TIME_TO_FIRST_AUDIO.observe(now - self._speech_ended)
+                self._speech_ended = None
+        else:
+            gap = now - self._last_response
+            CHUNK_GAP.observe(gap)
+        self._last_response = now
+
+    def turn_complete(self):
+        self._last_response = None
+
+    def interrupted(self, discarded_bytes):
+        INTERRUPTIONS.inc()
+        DISCARDED_AUDIO_BYTES.inc(discarded_bytes)
+        self._last_response = None
+        self._interrupted_at = time.perf_counter()
+
+    def interruption_emitted(self):
+        if self._interrupted_at is not None:
+            INTERRUPTION_EMITTED.observe(time.perf_counter() - self._interrupted_at)
+
+    def interruption_acked(self, *args):
+        """gemini_interrupted の ack コールバック"""
+        if self._interrupted_at is not None:
+            INTERRUPTION_ACKED.observe(time.perf_counter() - self._interrupted_at)
+            self._interrupted_at = None
+
+
+def observe_reconnect(result, seconds):
+    UPSTREAM_RECONNECTS.labels(result).inc()
+    if result != "failed":
+        UPSTREAM_RECOVERY_TIME.observe(seconds)
+
+
+def bind_collectors(session_manager, all_tasks, admission=None):
+    """出力時に値を集計するゲージを、セッションの管理側につなぐ"""
+
+    def queue_totals(key):
+        totals = {}
+        for session in session_manager:
+            for name, queue in session.queues.items():
+                totals[(name,)] = totals.get((name,), 0) + key(queue)
+        return totals
+
+    ACTIVE_SESSIONS.set_collector(lambda: {(): len(session_manager)})
+    if admission is not None:
+        ADMISSION_SESSIONS.set_collector(lambda: {("active",): admission.active, ("waiting",): admission.waiting})
+    QUEUE_DEPTH.set_collector(lambda: queue_totals(lambda queue: queue.qsize()))
+    TASKS.set_collector(lambda: {
+        ("all",): len(all_tasks()),
+        ("session",): sum(not task.done() for session in session_manager for task in session.tasks.values()),
+    })
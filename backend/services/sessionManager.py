@@ -0,0 +1,187 @@
+import asyncio
+import time
+
+from utils.structuredLog import get_logger
+
+# ------------------------------------------------------------------
+# クライアント（Socket.IOのsid）ごとのセッション状態とライフサイクル管理
+# Geminiセッション・関連タスク・パイプライン部品をまとめて1か所で持ち、
+# 切断・アイドル・終了のどの経路でも全て片付ける
+# ------------------------------------------------------------------
+
+log = get_logger("session")
+
+
+class ClientSession:
+    def __init__(self, sid):
+        self.sid = sid
+        self.created = time.monotonic()
+        self.last_activity = self.created
+        # Geminiセッション（接続完了後に attach される。切れたらつなぎ直す ResilientUpstream）
+        self.upstream = None
+        # handle_session のタスク
+        self.task = None
+        # 受信・再生・キュー送信などの子タスク
+        self.tasks = {}
+        self.queues = {}
+        self.framer = None
+        self.emit_batcher = None
+        # 応答のターン番号（gemini_response_end / gemini_interrupted に付ける）と、
+        # 割り込まれたターンの turn_complete 待ちか
+        self.turn = 0
+        self.interrupted = False
+        # 端末のレート ⇔ Gemini のレートの変換（start_session で決まる。同じレートなら素通し）
+        self.input_resampler = None
+        self.output_resampler = None
+        # クライアントへ返す音声のエンコーダー（start_session で決まる）
+        self.encoder = None
+        # エンコード済みの音声にヘッダーを付けて送り出す（start_session で決まる）
+        self.writer = None
+        self.vad = None
+        self.gate = None
+        self.normalizer = None
+        # カメラフレームの間隔・品質の調整（ADAPTIVE_VIDEO=1 のとき）
+        self.video_control = None
+        # レイテンシ計測（/metrics の全セッション共通のヒストグラムに記録する）
+        self.metrics = None
+        # RECORD_DIR を指定したときの録画
+        self.recorder = None
+        # 応答音声のデバッグ再生（ジッターバッファの統計を /stats で見る）
+        self.playback = None
+        # 受け入れ制御の Ticket（閉じたら枠を返す）と、受信チャンクの流量制限（メディアごとの TokenBucket）
+        self.ticket = None
+        self.ingress = {}
+        self.closed = False
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def attach(self, upstream):
+        self.upstream = upstream
+        self.touch()
+
+    def spawn(self, name, coro):
+        task = asyncio.create_task(coro, name=f"{name}:{self.sid}")
+        self.tasks[name] = task
+        return task
+
+    def close(self):
+        """子タスクとパイプライン部品を全て止める（何度呼んでもよい）"""
+        self.closed = True
+        for task in self.tasks.values():
+            task.cancel()
+        if self.framer:
+            self.framer.close()
+        if self.emit_batcher:
+            self.emit_batcher.close()
+        if self.normalizer:
+            self.normalizer.close()
+        if self.recorder:
+            self.recorder.close()
+        if self.ticket:
+            self.ticket.release()
+        if self.task and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def snapshot(self):
+        now = time.monotonic()
+        parts = {
+            "upstream": self.upstream,
+            "audio_framing": self.framer,
+            "emit_batching": self.emit_batcher,
+            "input_resampler": self.input_resampler,
+            "output_resampler": self.output_resampler,
+            "encoder": self.encoder,
+            "writer": self.writer,
+            "vad": self.vad,
+            "frame_gate": self.gate,
+            "image_normalizer": self.normalizer,
+            "recorder": self.recorder,
+            "video_control": self.video_control,
+            "playback": self.playback,
+        }
+        return {
+            "age_s": round(now - self.created, 1),
+            "idle_s": round(now - self.last_activity, 1),
+            "connected": self.upstream is not None,
+            "queue_position": self.ticket.position if self.ticket else None,
+            "tasks": sorted(name for name, task in self.tasks.items() if not task.done()),
+            **{name: part.stats() for name, part in parts.items() if part is not None},
+            "queues": {name: queue.stats() for name, queue in self.queues.items()},
+            "ingress": {name: bucket.stats() for name, bucket in self.ingress.items()},
+        }
+
+
+class SessionManager:
+    def __init__(self, idle_timeout=120, reap_interval=10):
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self._sessions = {}
+        self._reaper = None
+
+        self.created_total = 0
+        self.closed_total = 0
+        self.idle_closed = 0
+
+    def start(self):
+        if self._reaper is None and self.idle_timeout:
+            self._reaper = asyncio.create_task(self._reap())
+
+    def create(self, sid):
+        """新しいセッションを登録する。同じ sid の古いセッションは閉じる"""
+        if old := self._sessions.pop(sid, None):
+            old.close()
+            self.closed_total += 1
+        session = ClientSession(sid)
+        self._sessions[sid] = session
+        self.created_total += 1
+        return session
+
+    def get(self, sid):
+        return self._sessions.get(sid)
+
+    def discard(self, session):
+        """handle_session の終了時に呼ぶ。既に別のセッションに置き換わっていれば何もしない"""
+        session.close()
+        if self._sessions.get(session.sid) is session:
+            del self._sessions[session.sid]
+            self.closed_total += 1
+
+    async def close(self, sid, reason=""):
+        session = self._sessions.get(sid)
+        if session is None:
+            return False
+        log.info("session_closing", sid, reason=reason)
+        self.discard(session)
+        if session.task and session.task is not asyncio.current_task():
+            await asyncio.gather(session.task, return_exceptions=True)
+        return True
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            now = time.monotonic()
+            for sid, session in list(self._sessions.items()):
+                if now - session.last_activity > self.idle_timeout:
+                    self.idle_closed += 1
+                    await self.close(sid, "(アイドルタイムアウト)")
+
+    async def shutdown(self):
+        if self._reaper:
+            self._reaper.cancel()
+        await asyncio.gather(*(self.close(sid, "(サーバー停止)") for sid in list(self._sessions)))
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __iter__(self):
+        return iter(list(self._sessions.values()))
+
+    def snapshot(self):
+        return {
+            "active": len(self._sessions),
+            "created_total": self.created_total,
+            "closed_total": self.closed_total,
+            "idle_closed": self.idle_closed,
+            "sessions": {sid: session.snapshot() for sid, session in self._sessions.items()},
+        }
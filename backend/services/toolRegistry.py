@@ -0,0 +1,252 @@
+import asyncio
+import functools
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.structuredLog import get_logger
+
+# ------------------------------------------------------------------
+# Live API の tool_call を実行するツールの登録簿
+#
+#   registry = ToolRegistry()
+#
+#   @registry.tool("部屋の照明を設定する", params=[Param("brightness", "NUMBER", "0〜100")], timeout=2.0)
+#   def set_light_values(brightness): ...
+#
+#   config["tools"] = registry.tools()                  # function_declarations を生成
+#   responses = await registry.run(tool_call.function_calls)   # 1つの tool_call 内の呼び出しを並行実行
+#
+# - async 関数はイベントループで、普通の関数はスレッドプールで実行する
+# - ツールごとのタイムアウトを過ぎたら、エラーとしてモデルに返す
+# - idempotent=True のツールは同じ引数の結果を cache_ttl 秒だけ使い回す
+# ------------------------------------------------------------------
+
+log = get_logger("tools")
+
+# スキーマの型 → 引数の変換
+_CONVERTERS = {
+    "STRING": str,
+    "NUMBER": float,
+    "INTEGER": int,
+    "BOOLEAN": lambda value: value if isinstance(value, bool) else str(value).lower() in ("true", "1", "yes"),
+}
+
+
+class ToolError(Exception):
+    pass
+
+
+class Param:
+    def __init__(self, name, type, description="", required=True, enum=None):
+        if type not in _CONVERTERS:
+            raise ValueError(f"未対応の型: {type}")
+        self.name = name
+        self.type = type
+        self.description = description
+        self.required = required
+        self.enum = enum
+
+    def schema(self):
+        schema = {"type": self.type, "description": self.description}
+        if self.enum:
+            schema["enum"] = list(self.enum)
+        return schema
+
+    def convert(self, value):
+        value = _CONVERTERS[self.type](value)
+        if self.enum and value not in self.enum:
+            raise ToolError(f"{self.name} は {', '.join(map(str, self.enum))} のいずれかです: {value}")
+        return value
+
+
+class Tool:
+    def __init__(self, func, name, description, params, timeout, idempotent, cache_ttl):
+        self.func = func
+        self.name = name
+        self.description = description
+        self.params = list(params)
+        self.timeout = timeout
+        self.idempotent = idempotent
+        self.cache_ttl = cache_ttl
+        self.is_async = asyncio.iscoroutinefunction(func)
+
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.cache_hits = 0
+        self.total_seconds = 0.0
+
+    def declaration(self):
+        declaration = {"name": self.name, "description": self.description}
+        if self.params:
+            declaration["parameters"] = {
+                "type": "OBJECT",
+                "properties": {p.name: p.schema() for p in self.params},
+                "required": [p.name for p in self.params if p.required],
+            }
+        return declaration
+
+    def bind(self, args):
+        """モデルから来た引数をスキーマに従って検査・変換する"""
+        args = dict(args or {})
+        bound = {}
+        for param in self.params:
+            if param.name not in args:
+                if param.required:
+                    raise ToolError(f"引数 {param.name} がありません")
+                continue
+            try:
+                bound[param.name] = param.convert(args.pop(param.name))
+            except (TypeError, ValueError) as e:
+                raise ToolError(f"引数 {param.name} が不正です: {e}")
+        if args:
+            raise ToolError(f"未知の引数: {', '.join(args)}")
+        return bound
+
+    def stats(self):
+        executed = self.calls - self.cache_hits
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "cache_hits": self.cache_hits,
+            "avg_ms": round(self.total_seconds / executed * 1000, 2) if executed else None,
+        }
+
+
+class TtlCache:
+    """有効期限付きの LRU。期限切れは取り出し時と、満杯で追い出すときに捨てる"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self.evicted = 0
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            self.evicted += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key, value, ttl):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._purge()
+
+    def _purge(self):
+        now = time.monotonic()
+        for key in [key for key, (expires, _) in self._entries.items() if expires < now]:
+            del self._entries[key]
+            self.evicted += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ToolRegistry:
+    def __init__(self, default_timeout=10.0, max_threads=8, cache_size=256):
+        self.default_timeout = default_timeout
+        self._tools = {}
+        self._cache = TtlCache(cache_size)
+        # 同じ引数で実行中の冪等なツールは、結果を待ち合わせる
+        self._inflight = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="tool")
+
+    def tool(self, description, params=(), name=None, timeout=None, idempotent=False, cache_ttl=0):
+        """関数をツールとして登録するデコレーター"""
+
+        def register(func):
+            tool_name = name or func.__name__
+            if tool_name in self._tools:
+                raise ValueError(f"ツール {tool_name} は登録済みです")
+            self._tools[tool_name] = Tool(
+                func, tool_name, description, params,
+                timeout=timeout or self.default_timeout, idempotent=idempotent, cache_ttl=cache_ttl,
+            )
+            return func
+
+        return register
+
+    def tools(self):
+        """LiveConnectConfig の tools にそのまま渡せる形"""
+        return [{"function_declarations": [tool.declaration() for tool in self._tools.values()]}]
+
+    async def run(self, function_calls):
+        """1つの tool_call に含まれる呼び出しを並行に実行し、function_responses を返す"""
+        return await asyncio.gather(*(self.call(fc.name, fc.args, fc.id) for fc in function_calls))
+
+    async def call(self, name, args, call_id=None):
+        """1つの呼び出しを実行する。失敗・タイムアウトも例外にせず、エラーとしてモデルに返す"""
+        try:
+            result = {"result": await self._invoke(name, args)}
+        except ToolError as e:
+            result = {"error": str(e)}
+        except Exception as e:
+            log.error("tool_failed", tool=name, exc_info=True)
+            result = {"error": f"{type(e).__name__}: {e}"}
+        return {"name": name, "id": call_id, "response": result}
+
+    async def _invoke(self, name, args):
+        tool = self._tools.get(name)
+        if tool is None:
+            raise ToolError(f"未知のツール: {name}")
+        bound = tool.bind(args)
+        tool.calls += 1
+        if not (tool.idempotent and tool.cache_ttl > 0):
+            return await self._execute(tool, bound)
+
+        key = (name, json.dumps(bound, sort_keys=True, default=str))
+        if cached := self._cache.get(key):
+            tool.cache_hits += 1
+            return cached[1]
+        if (pending := self._inflight.get(key)) is None:
+            pending = self._inflight[key] = asyncio.ensure_future(self._execute(tool, bound))
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            tool.cache_hits += 1
+        # 待っている側がキャンセルされても、実行中の呼び出しは他の待ち手のために残す
+        result = await asyncio.shield(pending)
+        self._cache.put(key, result, tool.cache_ttl)
+        return result
+
+    async def _execute(self, tool, bound):
+        start = time.perf_counter()
+        try:
+            if tool.is_async:
+                work = tool.func(**bound)
+            else:
+                # 時間のかかる同期関数でイベントループを止めないよう、スレッドで実行する
+                # （タイムアウトしてもスレッド自体は止められないので、結果を捨てるだけ）
+                work = asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(tool.func, **bound))
+            return await asyncio.wait_for(work, tool.timeout)
+        except asyncio.TimeoutError:
+            tool.timeouts += 1
+            tool.errors += 1
+            raise ToolError(f"{tool.name} が {tool.timeout} 秒以内に終わりませんでした")
+        except Exception:
+            tool.errors += 1
+            raise
+        finally:
+            tool.total_seconds += time.perf_counter() - start
+
+    def stats(self):
+        return {
+            "tools": {name: tool.stats() for name, tool in self._tools.items()},
+            "cache": {"entries": len(self._cache), "evicted": self._cache.evicted},
+            "inflight": len(self._inflight),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,111 @@
+import numpy as np
+
+# ------------------------------------------------------------------
+# サーバー側の簡易VAD（エネルギー + ゼロ交差率）
+# 無音区間を Gemini に送らないことで上り帯域とモデル側の処理を減らす。
+# 発話の立ち上がりを切らないよう、直前の無音をプリロールとして一緒に送る。
+# drop_silence=False なら何も捨てず、発話の判定（had_speech）だけを使う（応答レイテンシの計測用）
+# ------------------------------------------------------------------
+
+
+class VoiceActivityDetector:
+    def __init__(self, sample_rate=16000, frame_ms=20, threshold_db=-45.0, zcr_max=0.35,
+                 loud_margin_db=12.0, hangover_ms=800, preroll_ms=200, silence_keep_every=0, drop_silence=True):
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.threshold_db = threshold_db
+        # ゼロ交差率が高い区間はノイズとみなす。ただし十分大きい音（子音など）は通す
+        self.zcr_max = zcr_max
+        self.loud_margin_db = loud_margin_db
+        self.hangover_frames = max(hangover_ms // frame_ms, 0)
+        self.preroll_bytes = sample_rate * preroll_ms // 1000 * 2
+        # 無音フレームを完全に捨てず N フレームに1つ送る（0 なら全て捨てる）
+        self.silence_keep_every = silence_keep_every
+        self.drop_silence = drop_silence
+        # 直前の process に発話のフレームが含まれていたか
+        self.had_speech = False
+
+        # 最後に発話と判定されたフレームからの経過フレーム数
+        self._since_speech = self.hangover_frames + 1
+        self._silent_count = 0
+        self._preroll = bytearray()
+
+        self.frames_in = 0
+        self.frames_sent = 0
+        self.bytes_in = 0
+        self.bytes_dropped = 0
+
+    def _classify(self, samples):
+        """フレームごとの発話判定をまとめて計算する"""
+        n = samples.size
+        starts = np.arange(0, n, self.frame_samples)
+        counts = np.diff(np.append(starts, n))
+
+        x = samples.astype(np.float32) / 32768.0
+        energy = np.add.reduceat(x * x, starts) / counts
+        db = 10.0 * np.log10(energy + 1e-10)
+
+        crossings = np.empty(n, dtype=np.int8)
+        crossings[0] = 0
+        np.not_equal(np.signbit(x[1:]), np.signbit(x[:-1]), out=crossings[1:].view(bool))
+        zcr = np.add.reduceat(crossings, starts) / counts
+
+        voiced = db > self.threshold_db
+        speech = voiced & ((zcr < self.zcr_max) | (db > self.threshold_db + self.loud_margin_db))
+        return starts, counts, speech
+
+    def process(self, pcm):
+        """int16 PCM を受け取り、上流に送るべきバイト列を返す（全て無音なら b""）"""
+        samples = np.frombuffer(pcm, dtype="<i2")
+        if not samples.size:
+            self.had_speech = False
+            return b""
+        starts, counts, speech = self._classify(samples)
+        frames = speech.size
+        self.frames_in += frames
+        self.bytes_in += len(pcm)
+        self.had_speech = bool(speech.any())
+        if not self.drop_silence:
+            self.frames_sent += frames
+            return pcm
+
+        # 直近の発話フレームからの距離をベクトル演算で求め、ハングオーバー内なら送る
+        idx = np.arange(frames)
+        last_speech = np.maximum.accumulate(np.where(speech, idx, -1 - self._since_speech))
+        since = idx - last_speech
+        active = since <= self.hangover_frames
+        self._since_speech = min(int(since[-1]), self.hangover_frames + 1)
+
+        silent = ~active
+        if self.silence_keep_every:
+            silent_idx = np.cumsum(silent) - 1 + self._silent_count
+            send = active | (silent & (silent_idx % self.silence_keep_every == 0))
+            self._silent_count = int(silent_idx[-1] + 1) % self.silence_keep_every
+        else:
+            send = active
+
+        out = bytearray()
+        for i in range(frames):
+            start = int(starts[i]) * 2
+            frame = pcm[start:start + int(counts[i]) * 2]
+            if not send[i]:
+                # 送らなかった無音はプリロール用に直近分だけ保持する
+                self._preroll += frame
+                del self._preroll[:max(len(self._preroll) - self.preroll_bytes, 0)]
+                continue
+            if active[i] and self._preroll:
+                # 発話の立ち上がり：直前の無音を先に送る
+                out += self._preroll
+            self._preroll.clear()
+            out += frame
+        self.frames_sent += int(send.sum())
+        self.bytes_dropped += max(len(pcm) - len(out), 0)
+        return bytes(out)
+
+    def stats(self):
+        return {
+            "frames_in": self.frames_in,
+            "frames_sent": self.frames_sent,
+            "bytes_in": self.bytes_in,
+            "bytes_dropped": self.bytes_dropped,
+            "drop_ratio": round(self.bytes_dropped / self.bytes_in, 3) if self.bytes_in else 0.0,
+        }
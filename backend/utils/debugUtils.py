@@ -1,10 +1,22 @@
-import sounddevice as sd
 import numpy as np
 from PIL import Image
 import io
+import threading
+import time
+from collections import deque
+
+from utils.loopMonitor import percentiles_ms
+from utils.structuredLog import get_logger
+
+# sounddevice は PortAudio がないと import の時点で失敗するので、使うときに読み込む
+# （音声デバイスのないサーバー・CI でも geminiSession を起動できるように）
+
+log = get_logger("playback")
 
 def play_client_pcm(pcm_data, samplerate=16000):
     try:
+        import sounddevice as sd
+
         # PCMデータをnumpy配列に変換（int16型でリトルエンディアンを想定）
         audio_array = np.frombuffer(pcm_data, dtype=np.int16)
 
@@ -14,16 +26,303 @@ def play_client_pcm(pcm_data, samplerate=16000):
         sd.wait()
     except Exception as e:
         print(f"音声再生エラー: {e}")
-        
 
-async def play_gemini_pcm(audio_queue):
-    with sd.OutputStream(samplerate=24000, channels=1, dtype='int16') as stream:
+
+# ------------------------------------------------------------------
+# Gemini の応答音声の再生エンジン
+# 届いた PCM は確保済みの int16 リングバッファに書くだけで、再生はオーディオデバイスの
+# コールバック（別スレッド）がリングから出力バッファへ直接コピーする（チャンクごとの確保なし）。
+#
+# - ジッターバッファ: 再生開始（と途切れた後の再開）は target 分溜まるまで待つ。
+#   target は到着の遅れの揺れ（RFC 3550 と同じ 1/16 の平滑化）と、最近の途切れに合わせて伸び縮みする
+# - underrun: 発話の途中でバッファが空になった（空になってから gap_ms 以内に続きが届いた）
+# - overrun : リングに入りきらず、古いサンプルを捨てた
+# - 音声デバイスがない（サーバー・CI）ときは NullOutputStream が同じ間隔でコールバックを呼ぶので、
+#   同じ統計でレイテンシを測れる
+# ------------------------------------------------------------------
+
+class PcmRingBuffer:
+    """int16 のリングバッファ。書き込みはイベントループ、読み出しはオーディオスレッドから"""
+
+    def __init__(self, capacity):
+        self._buf = np.zeros(capacity, dtype=np.int16)
+        self.capacity = capacity
+        # これまでに書いた / 読んだサンプル数の累計（差が溜まっている量）
+        self.written = 0
+        self.read = 0
+
+    @property
+    def available(self):
+        return self.written - self.read
+
+    def write(self, samples):
+        """書き込み、入りきらずに捨てた古いサンプル数を返す"""
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        dropped = max(self.available + n - self.capacity, 0)
+        self.read += dropped
+        start = self.written % self.capacity
+        first = min(n, self.capacity - start)
+        self._buf[start:start + first] = samples[:first]
+        self._buf[:n - first] = samples[first:]
+        self.written += n
+        return dropped
+
+    def read_into(self, out):
+        """out（1次元のビュー）に読めるだけ読み、読んだサンプル数を返す"""
+        n = min(len(out), self.available)
+        start = self.read % self.capacity
+        first = min(n, self.capacity - start)
+        out[:first] = self._buf[start:start + first]
+        out[first:n] = self._buf[:n - first]
+        self.read += n
+        return n
+
+    def clear(self):
+        self.read = self.written
+
+
+class _NullClock:
+    """全ての NullOutputStream のコールバックを1本のスレッドから呼ぶ（セッションごとにスレッドを作らない）"""
+
+    def __init__(self):
+        self._streams = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, stream):
+        with self._lock:
+            self._streams.add(stream)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="null-audio", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def remove(self, stream):
+        with self._lock:
+            self._streams.discard(stream)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                streams = list(self._streams)
+            if not streams:
+                self._wake.wait(1.0)
+                self._wake.clear()
+                continue
+            now = time.monotonic()
+            for stream in streams:
+                # 遅れていても1回に1ブロックずつ進める（実際のデバイスと同じく、遅れた分は次で取り戻す）
+                if stream.next_at <= now:
+                    stream.tick(now)
+            next_at = min(stream.next_at for stream in streams)
+            self._wake.wait(max(next_at - time.monotonic(), 0))
+            self._wake.clear()
+
+
+_null_clock = _NullClock()
+
+
+class NullOutputStream:
+    """音を出さずに、実デバイスと同じ間隔で callback(outdata, frames, time, status) を呼ぶ出力ストリーム"""
+
+    def __init__(self, samplerate, channels=1, dtype="int16", blocksize=480, callback=None):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.callback = callback
+        self.period = blocksize / samplerate
+        self._out = np.zeros((blocksize, channels), dtype=dtype)
+        self.next_at = 0.0
+        self.late_callbacks = 0
+
+    def tick(self, now):
+        # 予定より1ブロック以上遅れたら、デバイスなら音が途切れるところ
+        if now - self.next_at > self.period:
+            self.late_callbacks += 1
+        self.callback(self._out, self.blocksize, None, None)
+        self.next_at += self.period
+
+    def start(self):
+        self.next_at = time.monotonic() + self.period
+        _null_clock.add(self)
+
+    def stop(self):
+        _null_clock.remove(self)
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PlaybackEngine:
+    def __init__(self, samplerate=24000, blocksize=480, capacity_ms=2000, min_target_ms=60,
+                 max_target_ms=500, underrun_gap_ms=500, null_device=False, histogram=None):
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.min_target = min_target_ms * samplerate // 1000
+        self.max_target = max_target_ms * samplerate // 1000
+        self.underrun_gap = underrun_gap_ms / 1000
+        self.null_device = null_device
+        # 指定されていれば、書いてから再生されるまでの時間を /metrics 用のヒストグラムにも記録する
+        self.histogram = histogram
+        self._ring = PcmRingBuffer(capacity_ms * samplerate // 1000)
+        self._lock = threading.Lock()
+        self._stream = None
+
+        # 溜まるのを待っている（再生前・途切れた後）か
+        self._buffering = True
+        self._starved_at = None
+        # 到着間隔の揺れ（秒）と、途切れたときに上乗せする分（サンプル数。時間とともに減る）
+        self._jitter = 0.0
+        self._last_arrival = None
+        self._last_duration = 0.0
+        self._boost = 0
+        self._boost_at = 0.0
+        self.target = self.min_target
+        # (書いた後の written, 書いた時刻)。読み出しが追い越したときに再生までの時間を記録する
+        self._pending = deque()
+        self._latencies = deque(maxlen=1024)
+
+        self.callbacks = 0
+        self.underruns = 0
+        self.overruns = 0
+        self.dropped_samples = 0
+        self.played_samples = 0
+        self.silence_samples = 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if not self.null_device:
+            try:
+                import sounddevice as sd
+
+                self._stream = sd.OutputStream(
+                    samplerate=self.samplerate, channels=1, dtype="int16",
+                    blocksize=self.blocksize, callback=self._callback,
+                )
+            except Exception as e:
+                # PortAudio がない（ImportError / OSError）・デバイスを開けないときは無音で再生する
+                log.warning("audio_device_unavailable", error=repr(e))
+                self.null_device = True
+        if self.null_device:
+            self._stream = NullOutputStream(self.samplerate, blocksize=self.blocksize, callback=self._callback)
+        self._stream.start()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+
+    def write(self, pcm):
+        """届いた PCM をリングに書く（ブロックしない）"""
+        samples = np.frombuffer(pcm, dtype=np.int16, count=len(pcm) // 2)
+        now = time.monotonic()
+        with self._lock:
+            self._update_target(now, len(samples))
+            dropped = self._ring.write(samples)
+            if dropped:
+                self.overruns += 1
+                self.dropped_samples += dropped
+            self._pending.append((self._ring.written, now))
+
+    def _update_target(self, now, n):
+        if self._last_arrival is not None:
+            # 前のチャンクの長さよりどれだけ遅れて届いたか（Gemini は実時間より速く送ってくるので、
+            # 早く届いた分は揺れに数えない）
+            lateness = max((now - self._last_arrival) - self._last_duration, 0.0)
+            self._jitter += (lateness - self._jitter) / 16
+        self._last_arrival = now
+        self._last_duration = n / self.samplerate
+
+        if self._starved_at is not None:
+            if now - self._starved_at < self.underrun_gap:
+                # 発話の途中で途切れた：次からはもっと溜めてから再生する
+                self.underruns += 1
+                self._boost = min(self._boost + self.min_target, self.max_target)
+                self._boost_at = now
+            self._starved_at = None
+        elif self._boost and now - self._boost_at > 10:
+            # 10秒途切れなければ上乗せを半分に戻す
+            self._boost //= 2
+            self._boost_at = now
+
+        target = self.min_target + int(3 * self._jitter * self.samplerate) + self._boost
+        self.target = min(max(target, self.min_target), self.max_target)
+
+    def _callback(self, outdata, frames, time_info, status):
+        out = outdata[:, 0]
+        with self._lock:
+            self.callbacks += 1
+            if self._buffering and self._ring.available >= min(self.target, self._ring.capacity):
+                self._buffering = False
+            n = 0 if self._buffering else self._ring.read_into(out[:frames])
+            if n < frames:
+                out[n:frames] = 0
+                if not self._buffering:
+                    # 空になった。続きが gap 以内に届けば underrun として数える
+                    self._buffering = True
+                    self._starved_at = time.monotonic()
+                if n or self._ring.written > self._ring.read:
+                    self.silence_samples += frames - n
+            self.played_samples += n
+            now = time.monotonic()
+            read = self._ring.read
+            while self._pending and self._pending[0][0] <= read:
+                _, written_at = self._pending.popleft()
+                self._latencies.append(now - written_at)
+                if self.histogram is not None:
+                    self.histogram.observe(now - written_at)
+
+    def clear(self):
+        """溜まっている音声を捨てる（割り込まれたとき）"""
+        with self._lock:
+            self._ring.clear()
+            self._pending.clear()
+            self._buffering = True
+            self._starved_at = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "device": "null" if self.null_device else "sounddevice",
+                "buffered_ms": round(self._ring.available * 1000 / self.samplerate, 1),
+                "target_ms": round(self.target * 1000 / self.samplerate, 1),
+                "jitter_ms": round(self._jitter * 1000, 2),
+                "underruns": self.underruns,
+                "overruns": self.overruns,
+                "dropped_ms": round(self.dropped_samples * 1000 / self.samplerate, 1),
+                "played_ms": round(self.played_samples * 1000 / self.samplerate, 1),
+                "silence_ms": round(self.silence_samples * 1000 / self.samplerate, 1),
+                "callbacks": self.callbacks,
+                "late_callbacks": getattr(self._stream, "late_callbacks", 0),
+                "write_to_play": percentiles_ms(self._latencies),
+            }
+
+
+async def play_gemini_pcm(audio_queue, engine=None):
+    # 書き込みはリングに入れるだけなので、イベントループを止めない
+    engine = engine or PlaybackEngine()
+    with engine:
         while True:
-            data = await audio_queue.get()
-            audio_array = np.frombuffer(data, dtype=np.int16)
-            stream.write(audio_array)
+            engine.write(await audio_queue.get())
+
 
-        
 
 def show_image(image_data: bytes):
     try:
@@ -33,4 +332,4 @@ def show_image(image_data: bytes):
         # 画像を表示（別ウィンドウで開く）
         image.show()
     except Exception as e:
-        print(f"画像表示エラー: {e}")
\ No newline at end of file
+        print(f"画像表示エラー: {e}")
@@ -0,0 +1,73 @@
+import asyncio
+
+import numpy as np
+
+
+class LoopLagMonitor:
+    """一定間隔で sleep し、予定時刻からの遅れをイベントループの遅延として記録する"""
+
+    def __init__(self, interval=0.05, window=2048, histogram=None):
+        self.interval = interval
+        # 指定されていれば /metrics 用のヒストグラムにも記録する
+        self.histogram = histogram
+        self.samples = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.max_lag = 0.0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self.samples[self.count % self.samples.size] = lag
+            self.count += 1
+            if self.histogram is not None:
+                self.histogram.observe(lag)
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    @property
+    def last(self):
+        if not self.count:
+            return 0.0
+        return float(self.samples[(self.count - 1) % self.samples.size])
+
+    def recent_max(self, seconds):
+        """直近 seconds 秒の最大の遅延（秒）"""
+        n = min(int(seconds / self.interval), self.count, self.samples.size)
+        if not n:
+            return 0.0
+        return float(self.samples[(self.count - 1 - np.arange(n)) % self.samples.size].max())
+
+    def summary(self):
+        window = self.samples[:min(self.count, self.samples.size)]
+        if not window.size:
+            return {"samples": 0}
+        p50, p95, p99 = np.percentile(window, [50, 95, 99]) * 1000
+        return {
+            "samples": self.count,
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+            "max_ms": round(self.max_lag * 1000, 2),
+        }
+
+
+def percentiles_ms(values, points=(50, 95, 99)):
+    """秒単位のサンプル列から p50/p95/p99 をミリ秒で返す"""
+    if not len(values):
+        return {f"p{p}_ms": None for p in points}
+    result = np.percentile(np.asarray(values), points) * 1000
+    return {f"p{p}_ms": round(float(v), 2) for p, v in zip(points, result)}
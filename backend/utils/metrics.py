@@ -0,0 +1,177 @@
+import bisect
+
+# ------------------------------------------------------------------
+# /metrics 用の軽量なメトリクス（Prometheus のテキスト形式で出力する）
+# 更新はイベントループのスレッドからだけ行うのでロックは使わない。
+# ラベル付きの子はセッション開始時などに labels() で作っておき、
+# チャンクごとの処理では inc() / observe() を呼ぶだけにする（dict も tuple も作らない）。
+# ------------------------------------------------------------------
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# 秒単位のレイテンシ向けのバケット上限
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # 最後の要素が +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Family:
+    """同じ名前のメトリクスをラベルの値ごとにまとめたもの"""
+
+    def __init__(self, name, help, kind, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._children = {}
+        # 出力時に値を計算する関数（キューの深さなど、更新側に手を入れたくないもの）
+        self._collector = None
+        if not self.labelnames:
+            self._unlabelled = self.labels()
+
+    def _new_child(self):
+        if self.kind == COUNTER:
+            return Counter()
+        if self.kind == GAUGE:
+            return Gauge()
+        return Histogram(self.buckets)
+
+    def labels(self, *values):
+        """ラベルの値に対応する子を返す（なければ作る）。ホットパスでは呼ばず、結果を持っておく"""
+        values = tuple(str(v) for v in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name}: ラベルの数が違います {values}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(v) for v in values), None)
+
+    def set_collector(self, collector):
+        """collector() は {ラベル値のタプル: 値} を返す。ゲージ専用"""
+        if self.kind != GAUGE:
+            raise ValueError(f"{self.name}: collector はゲージにだけ設定できます")
+        self._collector = collector
+
+    # ラベルなしのときは Family をそのまま使えるようにする
+    def inc(self, amount=1):
+        self._unlabelled.inc(amount)
+
+    def set(self, value):
+        self._unlabelled.set(value)
+
+    def observe(self, value):
+        self._unlabelled.observe(value)
+
+    def render(self, lines):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        if self._collector is not None:
+            samples = {tuple(str(v) for v in k): v for k, v in self._collector().items()}
+            for values, value in samples.items():
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(value)}")
+            return
+        for values, child in list(self._children.items()):
+            if self.kind != HISTOGRAM:
+                lines.append(f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), values + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, values)} {_number(child.sum)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, values)} {child.count}")
+
+
+class Registry:
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._families = {}
+
+    def _add(self, name, help, kind, labelnames=(), **kwargs):
+        name = self.prefix + name
+        if name in self._families:
+            raise ValueError(f"メトリクス {name} は登録済みです")
+        family = self._families[name] = Family(name, help, kind, labelnames, **kwargs)
+        return family
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(name, help, COUNTER, labelnames)
+
+    def gauge(self, name, help, labelnames=(), collector=None):
+        family = self._add(name, help, GAUGE, labelnames)
+        if collector is not None:
+            family.set_collector(collector)
+        return family
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(name, help, HISTOGRAM, labelnames, buckets=buckets)
+
+    def render(self):
+        lines = []
+        for family in self._families.values():
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
@@ -0,0 +1,191 @@
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+import traceback
+
+# ------------------------------------------------------------------
+# イベントループを止めない構造化ログ
+# ログはキューに入れるだけで、LogRecord の生成と標準出力への書き込みは
+# 別スレッド（QueueListener）が行う。キューが LOG_QUEUE_SIZE を超えたら待たずに捨てる。
+#
+#   LOG_LEVEL=INFO
+#   LOG_FORMAT=json                     json / text
+#   LOG_DISABLE=media,pool              出さないサブシステム
+#   LOG_SAMPLE=audio_chunk=0.01,...     イベントごとの記録率（0〜1）
+#   LOG_QUEUE_SIZE=10000
+# ------------------------------------------------------------------
+
+ROOT = "live"
+
+# チャンクごとのイベントは既定で間引く
+DEFAULT_SAMPLE_RATES = {"audio_chunk": 0.01, "image_frame": 0.05, "ingress_throttled": 0.01}
+
+
+class _Config:
+    def __init__(self):
+        self.level = logging.INFO
+        self.disabled = set()
+        self.sample_rates = {}
+        # イベントごとに「何回に1回残すか」（0 なら残さない）
+        self.every = {}
+        self.max_queue = 10000
+        self.set_sample_rates(DEFAULT_SAMPLE_RATES)
+
+    def set_sample_rates(self, rates):
+        self.sample_rates = dict(rates)
+        self.every = {event: round(1 / rate) if rate > 0 else 0 for event, rate in rates.items()}
+
+
+_config = _Config()
+# イベントループ側は (時刻, レベル, サブシステム, イベント, sid, 項目, 例外) のタプルを入れるだけ。
+# LogRecord の生成・整形・書き込みは全て QueueListener のスレッドで行う
+_queue = None
+_listener = None
+_dropped = 0
+
+
+def _parse_rates(text):
+    rates = {}
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        event, _, rate = item.partition("=")
+        rates[event.strip()] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class EventLogger:
+    """サブシステムごとのロガー。event は短い英語の名前、詳細はキーワード引数で渡す"""
+
+    def __init__(self, subsystem):
+        self.subsystem = subsystem
+        self._counts = {}
+
+    def log(self, level, event, sid=None, exc_info=False, **fields):
+        global _dropped
+        if _queue is None or level < _config.level or self.subsystem in _config.disabled:
+            return
+        every = _config.every.get(event, 1)
+        if every != 1:
+            # every 回に1回だけ残す（乱数を使わないので再現性がある）
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1
+            if not every or count % every:
+                return
+        if _queue.qsize() >= _config.max_queue:
+            _dropped += 1
+            return
+        # トレースバックだけはこのスレッドで文字列にしておく
+        exc_text = traceback.format_exc() if exc_info else None
+        _queue.put_nowait((time.time(), level, self.subsystem, event, sid, fields, exc_text))
+
+    def debug(self, event, sid=None, **fields):
+        self.log(logging.DEBUG, event, sid, **fields)
+
+    def info(self, event, sid=None, **fields):
+        self.log(logging.INFO, event, sid, **fields)
+
+    def warning(self, event, sid=None, **fields):
+        self.log(logging.WARNING, event, sid, **fields)
+
+    def error(self, event, sid=None, exc_info=False, **fields):
+        self.log(logging.ERROR, event, sid, exc_info=exc_info, **fields)
+
+
+def get_logger(subsystem):
+    return EventLogger(subsystem)
+
+
+class _EventListener(logging.handlers.QueueListener):
+    """書き込みスレッド側でタプルを LogRecord にしてからハンドラーに渡す"""
+
+    def prepare(self, item):
+        created, level, subsystem, event, sid, fields, exc_text = item
+        record = logging.LogRecord(f"{ROOT}.{subsystem}", level, "", 0, event, None, None)
+        record.created = created
+        record.event = event
+        record.sid = sid
+        record.fields = fields
+        record.sample_rate = _config.sample_rates.get(event, 1.0)
+        record.exc_text = exc_text
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "subsystem": record.name.removeprefix(ROOT + "."),
+            "event": getattr(record, "event", record.getMessage()),
+        }
+        if sid := getattr(record, "sid", None):
+            entry["sid"] = sid
+        if (rate := getattr(record, "sample_rate", 1.0)) < 1.0:
+            entry["sample_rate"] = rate
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        parts = [f"[{record.name.removeprefix(ROOT + '.')}]", getattr(record, "event", record.getMessage())]
+        if sid := getattr(record, "sid", None):
+            parts.append(f"sid={sid}")
+        parts.extend(f"{k}={v}" for k, v in getattr(record, "fields", {}).items())
+        line = " ".join(parts)
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+def setup_logging(level=None, fmt=None, disabled=None, sample_rates=None, queue_size=None, stream=None):
+    """環境変数（または引数）から設定し、書き込みスレッドを開始する。2回目以降は設定だけ更新する"""
+    global _queue, _listener
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    _config.level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    if disabled is None:
+        disabled = [s.strip() for s in os.getenv("LOG_DISABLE", "").split(",") if s.strip()]
+    _config.disabled = set(disabled)
+    _config.set_sample_rates({**DEFAULT_SAMPLE_RATES, **(sample_rates or _parse_rates(os.getenv("LOG_SAMPLE", "")))})
+    _config.max_queue = queue_size or int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    if _listener is not None:
+        return _listener
+
+    fmt = fmt or os.getenv("LOG_FORMAT", "json")
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _queue = queue.SimpleQueue()
+    _listener = _EventListener(_queue, output)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging(timeout=2.0):
+    """キューに残っているログを書き出してからスレッドを止める
+
+    出力先が詰まっていても終了を妨げないよう、timeout 秒で待つのをやめる
+    （書き込みスレッドはデーモンなので、残りはプロセス終了とともに捨てられる）。
+    """
+    global _queue, _listener
+    if _listener is not None:
+        # 以降のログは捨てる（書き込みスレッドが止まった後に溜まらないように）
+        _queue, listener, _listener = None, _listener, None
+        listener.enqueue_sentinel()
+        listener._thread.join(timeout)
+
+
+def log_stats():
+    if _queue is None:
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "queued": _queue.qsize(),
+        "dropped": _dropped,
+        "disabled": sorted(_config.disabled),
+        "sample_rates": _config.sample_rates,
+    }
@@ -18,25 +18,188 @@ const CameraViewIndex = () => {
   const audioSetting = useAudioSettings();
 
   const [isRecording, setIsRecording] = useState(false);
+  // サーバーが混んでいるときの順番待ち（null なら待っていない）
+  const [queuePosition, setQueuePosition] = useState<number | null>(null);
 
   const cameraRef = useRef<Camera>(null);
   const imageIntervalRef = useRef<number | null>(null);
+  // サーバーの video_control で変わるフレーム送信間隔（ms）
+  const frameIntervalRef = useRef(300);
+  // start_session の ack で決まる、gemini_response の WAV ヘッダーのバイト数
+  const headerBytesRef = useRef(44);
 
   useEffect(() => {
-  const handleGeminiAudio = async (wavArrayBuffer: any) => {
-    const path = RNFS.CachesDirectoryPath + '/gemini_resp.wav';
-    await RNFS.writeFile(path, Buffer.from(wavArrayBuffer).toString('base64'), 'base64');
+  // 応答はターンごとに1つの WAV として届く（最初のチャンクの先頭に長さ未確定のヘッダー）。
+  // ターンの終わりを待たず、最初に START_BUFFER_MS 分溜まったら再生を始め、以降は SEGMENT_MS ごとに
+  // 区切った WAV（同じヘッダーの長さだけ書き換えたもの）を次々に読み込んで、順に再生する。
+  // gemini_response_end では残りを最後の区切りとして流すだけ
+  const START_BUFFER_MS = 300;
+  const SEGMENT_MS = 1000;
+  let header: Buffer | null = null;
+  let pending: Buffer[] = [];
+  let pendingBytes = 0;
+  let segmentStarted = false;
+  let segmentCount = 0;
+  // 読み込み済み（または読み込み中）で再生を待っている区切り
+  let queue: Promise<{ sound: Sound; file: string } | null>[] = [];
+  let playing: { sound: Sound; file: string } | null = null;
 
-    const sound = new Sound(path, '', (error) => {
-      if (!error) sound.play();
-      else console.error("音声ロードエラー:", error);
+  // ヘッダーの ByteRate（28）と BlockAlign（32）から、ms → バイト数（ブロック単位に切り捨て）
+  const bytesFor = (ms: number) => {
+    if (!header) return Infinity;
+    const blockAlign = header.readUInt16LE(32) || 1;
+    const bytes = Math.floor(header.readUInt32LE(28) * ms / 1000);
+    return Math.max(bytes - bytes % blockAlign, blockAlign);
+  };
+
+  const release = (item: { sound: Sound; file: string }) => {
+    item.sound.release();
+    RNFS.unlink(item.file).catch(() => {});
+  };
+
+  // 割り込みのたびに進める。読み込みを待っている間に割り込まれた区切りは再生しない
+  let generation = 0;
+  let advancing = false;
+  const playNext = async () => {
+    if (playing || advancing || !queue.length) return;
+    advancing = true;
+    const current = generation;
+    const item = await queue.shift()!;
+    advancing = false;
+    if (current !== generation) {
+      if (item) release(item);
+      return playNext();
+    }
+    if (!item) return playNext();
+    playing = item;
+    item.sound.play(() => {
+      // 割り込みで止めた区切りは handleGeminiInterrupted 側で片付ける
+      if (playing !== item) return;
+      playing = null;
+      release(item);
+      // 再生中に溜まった分があれば、区切りの長さを待たずに流す
+      if (!queue.length && segmentStarted && pendingBytes) flushSegment();
+      playNext();
     });
   };
 
+  // 溜まっている分（ブロック単位）を1つの WAV にして再生待ちに入れる
+  const flushSegment = (all = false) => {
+    if (!header || !pendingBytes) return;
+    const data = Buffer.concat(pending);
+    const blockAlign = header.readUInt16LE(32) || 1;
+    const size = all ? data.length : data.length - data.length % blockAlign;
+    if (!size) return;
+    pending = size < data.length ? [data.subarray(size)] : [];
+    pendingBytes = data.length - size;
+    segmentStarted = true;
+
+    const wav = Buffer.concat([header, data.subarray(0, size)]);
+    wav.writeUInt32LE(wav.length - 8, 4);
+    wav.writeUInt32LE(size, header.length - 4);
+    const file = `${RNFS.CachesDirectoryPath}/gemini_resp_${segmentCount++}.wav`;
+    queue.push(
+      RNFS.writeFile(file, wav.toString('base64'), 'base64')
+        .then(() => new Promise<{ sound: Sound; file: string } | null>((resolve) => {
+          const sound = new Sound(file, '', (error) => {
+            if (error) {
+              console.error("音声ロードエラー:", error);
+              resolve(null);
+              return;
+            }
+            resolve({ sound, file });
+          });
+        }))
+        .catch((e) => {
+          console.error("音声ファイル書き込みエラー:", e);
+          return null;
+        }),
+    );
+    playNext();
+  };
+
+  const handleGeminiAudio = (chunk: any) => {
+    let data = Buffer.from(chunk);
+    if (!header) {
+      // ターンの最初のチャンク：ヘッダーを取り出しておく
+      header = Buffer.from(data.subarray(0, headerBytesRef.current));
+      data = data.subarray(headerBytesRef.current);
+    }
+    pending.push(data);
+    pendingBytes += data.length;
+    if (pendingBytes >= bytesFor(segmentStarted ? SEGMENT_MS : START_BUFFER_MS)) {
+      flushSegment();
+    }
+  };
+
+  // ターンの終わり：残りを最後の区切りとして流し、次のターンはまたヘッダーから始まる
+  const handleGeminiAudioEnd = (_data: { turn: number; bytes: number; header: any }) => {
+    if (!header) return;
+    flushSegment(true);
+    header = null;
+    pending = [];
+    pendingBytes = 0;
+    segmentStarted = false;
+  };
+
+  // ユーザーが話し始めて応答が打ち切られた：受け取った分・再生待ちを捨て、再生中の音声を止める
+  // ack を返すと、サーバー側で割り込みが届くまでの時間を計測できる
+  const handleGeminiInterrupted = (_data: { turn: number; discarded_bytes: number }, ack?: () => void) => {
+    generation++;
+    header = null;
+    pending = [];
+    pendingBytes = 0;
+    segmentStarted = false;
+    const waiting = queue;
+    queue = [];
+    waiting.forEach((next) => next.then((item) => item && release(item)));
+    const current = playing;
+    playing = null;
+    current?.sound.stop(() => release(current));
+    ack?.();
+  };
+
+  // 上りが詰まっているときは、サーバーがフレームの送信間隔を伸ばすよう指示してくる
+  const handleVideoControl = ({ interval_ms }: { interval_ms: number; quality: number }) => {
+    frameIntervalRef.current = interval_ms;
+  };
+
+  // サーバーの同時セッション数が上限のときは順番待ちになり、順番が変わるたびに届く
+  const handleSessionQueued = ({ position }: { position: number; waiting: number }) => {
+    setQueuePosition(position);
+  };
+  const handleSessionAdmitted = () => {
+    setQueuePosition(null);
+  };
+  // 待ち時間の上限を過ぎた
+  const handleSessionRejected = () => {
+    Alert.alert("開始できませんでした", "サーバーが混み合っています");
+    stopRecording();
+  };
+  // サーバー側でセッションが失敗した（Gemini につなぎ直せなかったなど）
+  const handleSessionError = () => {
+    Alert.alert("接続が切れました", "もう一度開始してください");
+    stopRecording();
+  };
+
   socket.on('gemini_response', handleGeminiAudio);
+  socket.on('gemini_response_end', handleGeminiAudioEnd);
+  socket.on('video_control', handleVideoControl);
+  socket.on('gemini_interrupted', handleGeminiInterrupted);
+  socket.on('session_queued', handleSessionQueued);
+  socket.on('session_admitted', handleSessionAdmitted);
+  socket.on('session_rejected', handleSessionRejected);
+  socket.on('session_error', handleSessionError);
 
   return () => {
     socket.off('gemini_response', handleGeminiAudio);
+    socket.off('gemini_response_end', handleGeminiAudioEnd);
+    socket.off('video_control', handleVideoControl);
+    socket.off('gemini_interrupted', handleGeminiInterrupted);
+    socket.off('session_queued', handleSessionQueued);
+    socket.off('session_admitted', handleSessionAdmitted);
+    socket.off('session_rejected', handleSessionRejected);
+    socket.off('session_error', handleSessionError);
   };
 }, []);
 
@@ -51,7 +214,15 @@ const CameraViewIndex = () => {
   // --- 音声＋画像ストリーミング開始 ---
   const startRecording = () => {
     setIsRecording(true);
-    socket.emit("start_session", {});
+    socket.emit("start_session", { input_rate: audioSetting.sampleRate }, (ack: { error?: string; reason?: string; queue_position?: number; header_bytes?: number }) => {
+      if (ack?.error) {
+        Alert.alert("開始できませんでした", ack.reason === "per_client_limit" ? "この端末のセッション数が上限です" : "サーバーが混み合っています");
+        stopRecording();
+        return;
+      }
+      headerBytesRef.current = ack?.header_bytes ?? 44;
+      setQueuePosition(ack?.queue_position ? ack.queue_position : null);
+    });
 
     // 音声ストリーミング
     AudioRecord.start();
@@ -59,31 +230,35 @@ const CameraViewIndex = () => {
       socket.emit("send_audio_chunk", { mime_type: "audio/pcm", data, });
     });
 
-    // 1秒ごとにカメラプレビューのJPEGフレームを送信
-    imageIntervalRef.current = setInterval(() => {
-      (async () => {
-        try {
-          const frame = (await cameraRef.current?.takePhoto({ enableShutterSound: false }));
-          if (frame) {
-            const base64Frame = await FileSystem.readAsStringAsync(frame.path, { encoding: FileSystem.EncodingType.Base64 });
-            socket.emit("send_image_frame", { mime_type: "image/jpeg", data: base64Frame });
-          }
-        } catch (e) {
-          console.error("画像送信エラー:", e);
+    // カメラプレビューのJPEGフレームを送信（間隔はサーバーの video_control に従う）
+    frameIntervalRef.current = 300;
+    const sendFrame = async () => {
+      try {
+        const frame = (await cameraRef.current?.takePhoto({ enableShutterSound: false }));
+        if (frame) {
+          const base64Frame = await FileSystem.readAsStringAsync(frame.path, { encoding: FileSystem.EncodingType.Base64 });
+          socket.emit("send_image_frame", { mime_type: "image/jpeg", data: base64Frame });
         }
-      })();
-    }, 300);
+      } catch (e) {
+        console.error("画像送信エラー:", e);
+      }
+      if (imageIntervalRef.current !== null) {
+        imageIntervalRef.current = setTimeout(sendFrame, frameIntervalRef.current);
+      }
+    };
+    imageIntervalRef.current = setTimeout(sendFrame, frameIntervalRef.current);
   };
 
   // --- ストリーミング停止 ---
   const stopRecording = () => {
     setIsRecording(false);
+    setQueuePosition(null);
     AudioRecord.stop();
 
     socket.emit("end_session", {});
 
     if (imageIntervalRef.current) {
-      clearInterval(imageIntervalRef.current);
+      clearTimeout(imageIntervalRef.current);
       imageIntervalRef.current = null;
     }
   };
@@ -103,6 +278,9 @@ const CameraViewIndex = () => {
         photoQualityBalance={photoQuality}
         format={format}
       />
+      {queuePosition !== null && (
+        <Text style={styles.queueText}>順番待ち中です（{queuePosition}番目）</Text>
+      )}
       <View style={styles.buttonContainer}>
         <TouchableOpacity
           style={styles.recordButton}
@@ -126,6 +304,11 @@ const styles = StyleSheet.create({
     alignSelf: "center",
     overflow: "hidden",
   },
+  queueText: {
+    color: "white",
+    textAlign: "center",
+    marginTop: 8,
+  },
   buttonContainer: {
     flex: 1,
     flexDirection: "row",